@@ -0,0 +1,93 @@
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from .authentication import token_cache
+from .models import CustomUser
+from .views import record_follow, remove_follow
+
+# Native async counterparts of the small write endpoints, used instead of the DRF
+# views when ASYNC_VIEWS is on (the default under asgi.py). DRF views are sync
+# only, so these are plain Django views: token authentication and the ORM
+# calls are awaited, and the responses match the DRF ones. Every middleware in
+# settings.MIDDLEWARE is async-capable, so under ASGI no request is handed to a
+# thread as a whole. The writes need a transaction, which Django only runs in
+# sync code: each one is the shared sync function (record_follow, record_like,
+# ...) called through one sync_to_async hop on the thread_sensitive thread, the
+# one Django's async ORM queries run on too. `manage.py bench_async` measures
+# what that leaves.
+
+
+async def authenticate(request):
+    # Same rules as accounts.authentication.CachedTokenAuthentication, through the same cache
+    parts = request.headers.get('Authorization', '').split()
+    if len(parts) != 2 or parts[0].lower() != 'token':
+        return None, 'Authentication credentials were not provided.'
+    token = await token_cache.aget(parts[1])
+    if token is None:
+        return None, 'Invalid token.'
+    if not token.user.is_active:
+        return None, 'User inactive or deleted.'
+    return token.user, None
+
+
+class AsyncAPIView(View):
+    http_method_names = ['post', 'put', 'delete', 'options']
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token authenticated like the DRF views, so no CSRF check
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        user, error = await authenticate(request)
+        if user is None:
+            response = JsonResponse({'detail': error}, status=status.HTTP_401_UNAUTHORIZED)
+            response['WWW-Authenticate'] = 'Token'
+            return response
+        request.user = user
+        return await super().dispatch(request, *args, **kwargs)
+
+
+def user_not_found():
+    return JsonResponse({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+
+# Same flow and answers as accounts.views.follow and accounts.views.unfollow
+async def follow(request, pk, unchanged_status):
+    if pk == request.user.pk:
+        return JsonResponse({'error': 'You cannot follow/unfollow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
+    if await sync_to_async(record_follow, thread_sensitive=True)(request.user, pk):
+        return JsonResponse({'status': 'User followed successfully.'}, status=status.HTTP_200_OK)
+    if not await CustomUser.objects.filter(pk=pk).aexists():
+        return user_not_found()
+    return JsonResponse({'status': 'You are already following this user.'}, status=unchanged_status)
+
+
+async def unfollow(request, pk, unchanged_status):
+    if pk == request.user.pk:
+        return JsonResponse({'error': 'You cannot follow/unfollow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
+    if await sync_to_async(remove_follow, thread_sensitive=True)(request.user, pk):
+        return JsonResponse({'status': 'User unfollowed successfully.'}, status=status.HTTP_200_OK)
+    if not await CustomUser.objects.filter(pk=pk).aexists():
+        return user_not_found()
+    return JsonResponse({'status': 'You are not following this user.'}, status=unchanged_status)
+
+
+class AsyncFollowView(AsyncAPIView):
+
+    async def post(self, request, pk):
+        return await follow(request, pk, status.HTTP_400_BAD_REQUEST)
+
+    async def put(self, request, pk):
+        return await follow(request, pk, status.HTTP_200_OK)
+
+    async def delete(self, request, pk):
+        return await unfollow(request, pk, status.HTTP_200_OK)
+
+
+class AsyncUnfollowView(AsyncAPIView):
+
+    async def post(self, request, pk):
+        return await unfollow(request, pk, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,237 @@
+"""
+Cached token authentication.
+
+`CachedTokenAuthentication` is a drop-in replacement for DRF's
+TokenAuthentication. Token lookups go through `token_cache`: a bounded,
+per-process LRU of token key -> Token (with its user) whose entries live for
+AUTH_TOKEN_CACHE_TTL seconds. When AUTH_TOKEN_CACHE_ALIAS (the default cache
+unless set) names a cache shared by every process, misses of the LRU are
+looked up there before the database, so a new process or one that evicted a
+token does not hit the auth tables either.
+
+Entries are dropped as soon as their Token is deleted or their user is saved
+or deleted (see accounts.signals). With a shared cache, every token also has
+a version key there, which invalidation replaces: LRU hits are only served
+while their version is still the current one, so an invalidation in one
+process is seen by every other process on its next lookup, at the cost of
+one cache read per hit. Without a shared cache (the alias is "" or a local
+memory cache) revocation is not immediate: other processes keep serving their
+LRU copy until it expires, so entries then live at most UNSHARED_TTL seconds
+and `manage.py check` warns. Hit and miss counters are served by the
+`auth-cache-stats` endpoint.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from social_media_api.cache import is_shared
+
+KEY_PREFIX = 'accounts:token'
+VERSION_PREFIX = 'accounts:token-version'
+# Longest a process serves a token it cannot check against a shared version
+UNSHARED_TTL = 5
+
+
+def shared_key(key):
+    return f'{KEY_PREFIX}:{key}'
+
+
+def version_key(key):
+    return f'{VERSION_PREFIX}:{key}'
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+class TokenCache:
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, so a lookup that raced one does not store a stale token
+        self._generation = 0
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @property
+    def size(self):
+        return settings.AUTH_TOKEN_CACHE_SIZE
+
+    @property
+    def shared(self):
+        alias = settings.AUTH_TOKEN_CACHE_ALIAS
+        return caches[alias] if alias and is_shared(caches[alias]) else None
+
+    @property
+    def ttl(self):
+        if self.shared is None:
+            return min(settings.AUTH_TOKEN_CACHE_TTL, UNSHARED_TTL)
+        return settings.AUTH_TOKEN_CACHE_TTL
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _local_put(self, key, token, version, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, token, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _local_hit(self, key, entry, version):
+        # Served only while the entry's version is the current one (always, without a shared cache)
+        if entry[2] == version:
+            self._record('local_hits')
+            return entry[1]
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+                self._stats['invalidations'] += 1
+        return None
+
+    def _shared_hit(self, key, cached, version, generation):
+        if version is None or cached is None or cached[0] != version:
+            return None
+        self._record('shared_hits')
+        self._local_put(key, cached[1], version, generation)
+        return cached[1]
+
+    def _record(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _lookup(self, key):
+        return Token.objects.select_related('user').filter(key=key)
+
+    def get(self, key):
+        """The Token with its user for `key`, or None when there is no such token."""
+        if self.size <= 0:
+            return self._lookup(key).first()
+        shared = self.shared
+        entry = self._local_get(key)
+        if entry is not None:
+            token = self._local_hit(key, entry, shared.get(version_key(key)) if shared is not None else None)
+            if token is not None:
+                return token
+        generation = self._generation
+        version = None
+        if shared is not None:
+            found = shared.get_many([version_key(key), shared_key(key)])
+            version = found.get(version_key(key))
+            token = self._shared_hit(key, found.get(shared_key(key)), version, generation)
+            if token is not None:
+                return token
+            # Taken before the database read: an invalidation meanwhile replaces it
+            if version is None:
+                version = new_version()
+                if not shared.add(version_key(key), version, settings.AUTH_TOKEN_CACHE_TTL):
+                    version = shared.get(version_key(key)) or new_version()
+        self._record('misses')
+        token = self._lookup(key).first()
+        if token is not None:
+            if shared is not None:
+                shared.set(shared_key(key), (version, token), settings.AUTH_TOKEN_CACHE_TTL)
+            self._local_put(key, token, version, generation)
+        return token
+
+    async def aget(self, key):
+        if self.size <= 0:
+            return await self._lookup(key).afirst()
+        shared = self.shared
+        entry = self._local_get(key)
+        if entry is not None:
+            token = self._local_hit(key, entry, await shared.aget(version_key(key)) if shared is not None else None)
+            if token is not None:
+                return token
+        generation = self._generation
+        version = None
+        if shared is not None:
+            found = await shared.aget_many([version_key(key), shared_key(key)])
+            version = found.get(version_key(key))
+            token = self._shared_hit(key, found.get(shared_key(key)), version, generation)
+            if token is not None:
+                return token
+            if version is None:
+                version = new_version()
+                if not await shared.aadd(version_key(key), version, settings.AUTH_TOKEN_CACHE_TTL):
+                    version = await shared.aget(version_key(key)) or new_version()
+        self._record('misses')
+        token = await self._lookup(key).afirst()
+        if token is not None:
+            if shared is not None:
+                await shared.aset(shared_key(key), (version, token), settings.AUTH_TOKEN_CACHE_TTL)
+            self._local_put(key, token, version, generation)
+        return token
+
+    def invalidate(self, keys):
+        keys = list(keys)
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._stats['invalidations'] += 1
+        shared = self.shared
+        if shared is not None and keys:
+            # Other processes drop their copies when they see the new versions
+            shared.set_many({version_key(key): new_version() for key in keys}, settings.AUTH_TOKEN_CACHE_TTL)
+            shared.delete_many([shared_key(key) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            current = dict(self._stats, entries=len(self._entries))
+        lookups = current['local_hits'] + current['shared_hits'] + current['misses']
+        current['hit_ratio'] = round((current['local_hits'] + current['shared_hits']) / lookups, 4) if lookups else None
+        return current
+
+
+token_cache = TokenCache()
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if settings.AUTH_TOKEN_CACHE_SIZE > 0 and token_cache.shared is None:
+        return [checks.Warning(
+            f'AUTH_TOKEN_CACHE_ALIAS ({settings.AUTH_TOKEN_CACHE_ALIAS!r}) is not a cache shared between processes, '
+            f'so a deleted token or deactivated user keeps authenticating for up to {token_cache.ttl} seconds '
+            'in the other processes.',
+            hint='Point it at a file-based, Redis or Memcached cache.',
+            id='accounts.W001',
+        )]
+    return []
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return (token.user, token)
@@ -0,0 +1,40 @@
+"""
+Stored follower and following counts.
+
+CustomUser.followers_count and following_count are kept exact by the
+handlers in accounts.signals (add, remove and clear on `following`, from
+either side, and user deletion). Writes that skip the M2M manager, such as
+the single-statement follow in accounts.views or bulk_create on the through
+table, call `adjust_follow_counts` or `recount_follow_counts` themselves.
+"""
+
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, When
+from django.db.models.functions import Coalesce
+
+from .models import CustomUser, Follow
+
+
+def adjust_follow_counts(follower_ids, followed_ids, delta):
+    """Every follower in `follower_ids` started (delta=1) or stopped (delta=-1) following every user in `followed_ids`."""
+    if not follower_ids or not followed_ids:
+        return
+    # One UPDATE for both sides
+    CustomUser.objects.filter(pk__in=set(follower_ids) | set(followed_ids)).update(
+        following_count=Case(When(pk__in=follower_ids, then=F('following_count') + delta * len(followed_ids)),
+                             default=F('following_count'), output_field=IntegerField()),
+        followers_count=Case(When(pk__in=followed_ids, then=F('followers_count') + delta * len(follower_ids)),
+                             default=F('followers_count'), output_field=IntegerField()),
+    )
+
+
+def _count(column):
+    counts = (Follow.objects.filter(**{column: OuterRef('pk')}).order_by()
+              .values(column).annotate(count=Count('pk')).values('count'))
+    return Coalesce(Subquery(counts), 0)
+
+
+def recount_follow_counts(users=None):
+    """Recompute both counts from the through table, for `users` (a queryset) or everybody; one UPDATE."""
+    users = CustomUser.objects.all() if users is None else users
+    return users.update(followers_count=_count('to_customuser'),
+                        following_count=_count('from_customuser'))
@@ -0,0 +1,63 @@
+import json
+import zlib
+from django.core.serializers.json import DjangoJSONEncoder
+from posts.models import Post, Comment, Like
+from notifications.models import Notification
+
+# Rows fetched per query while exporting
+CHUNK_SIZE = 2000
+# Bytes collected before a chunk is handed to the server
+FLUSH_SIZE = 64 * 1024
+
+# What a user's data export contains: (record type, queryset factory, exported columns)
+EXPORT_SECTIONS = [
+    ('post', lambda user: Post.objects.filter(author=user),
+     ['id', 'title', 'content', 'created_at', 'updated_at', 'like_count', 'comment_count']),
+    ('comment', lambda user: Comment.objects.filter(author=user),
+     ['id', 'post_id', 'content', 'created_at', 'updated_at']),
+    ('like', lambda user: Like.objects.filter(user=user), ['id', 'post_id']),
+    ('notification', lambda user: Notification.objects.filter(recipient=user),
+     ['id', 'actor_id', 'verb', 'target_id', 'timestamp']),
+]
+
+
+def iterate_rows(queryset, fields, chunk_size=CHUNK_SIZE):
+    # Walks the rows in primary key order, one bounded query per chunk.
+    # (MySQLdb buffers whole result sets on the client, so a single .iterator()
+    # query would not keep memory flat there.)
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).order_by('pk').values(*fields)[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1]['id']
+
+
+def export_lines(user):
+    profile = {'type': 'user', 'id': user.pk, 'username': user.username, 'email': user.email,
+               'bio': user.bio, 'birth_date': user.birth_date, 'date_joined': user.date_joined,
+               'following': list(user.following.values_list('pk', flat=True))}
+    yield json.dumps(profile, cls=DjangoJSONEncoder) + '\n'
+    for record_type, queryset, fields in EXPORT_SECTIONS:
+        for row in iterate_rows(queryset(user), fields):
+            yield json.dumps({'type': record_type, **row}, cls=DjangoJSONEncoder) + '\n'
+
+
+# NDJSON export of everything a user owns, in chunks of about FLUSH_SIZE bytes
+def export_chunks(user, compress=False):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+    buffer, size = [], 0
+    for line in export_lines(user):
+        data = line.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= FLUSH_SIZE:
+            chunk = b''.join(buffer)
+            yield compressor.compress(chunk) if compressor else chunk
+            buffer, size = [], 0
+    chunk = b''.join(buffer)
+    if compressor:
+        yield compressor.compress(chunk) + compressor.flush()
+    elif chunk:
+        yield chunk
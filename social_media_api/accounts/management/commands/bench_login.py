@@ -0,0 +1,104 @@
+"""
+Benchmark login at scale.
+
+Seeds --users accounts (1M by default) with mixed-case usernames, then looks
+up random usernames typed in lower case, first with the old
+`username__iexact` filter and then with `find_user`, which uses the
+user_username_lower_idx expression index. It prints both query plans and
+latencies, and finally the throughput of LoginView.
+
+Passwords are hashed with MD5 during the run so that the time measured is
+the lookup rather than PBKDF2; pass --real-hasher to keep PASSWORD_HASHERS.
+
+Everything runs inside a transaction that is rolled back, so the database is
+left untouched.
+
+Usage: python manage.py bench_login --users 1000000 --lookups 2000 --logins 2000
+"""
+
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Lower
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from accounts.serializers import find_user
+from accounts.views import LoginView
+
+PASSWORD = 'bench-login-pass'
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Compare case-insensitive username lookups and measure login throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000)
+        parser.add_argument('--lookups', type=int, default=2000, help='Lookups per method')
+        parser.add_argument('--logins', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=10000, help='Users per INSERT while seeding')
+        parser.add_argument('--real-hasher', action='store_true', help='Hash passwords with PASSWORD_HASHERS')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        hashers = {} if options['real_hasher'] else {'PASSWORD_HASHERS': FAST_HASHERS}
+        with override_settings(**hashers), transaction.atomic():
+            prefix = self.seed(rng, options)
+            names = [f'{prefix}{rng.randrange(options["users"])}'.lower() for _ in range(max(options['lookups'], options['logins']))]
+            User = get_user_model()
+            self.compare('username__iexact', names[:options['lookups']],
+                         lambda name: User.objects.filter(username__iexact=name).order_by('pk'))
+            self.compare('find_user', names[:options['lookups']],
+                         lambda name: User.objects.alias(username_lower=Lower('username'))
+                         .filter(username_lower=Lower(Value(name))).order_by('pk'), find_user)
+            self.logins(names[:options['logins']])
+            transaction.set_rollback(True)
+
+    def seed(self, rng, options):
+        User = get_user_model()
+        count = options['users']
+        prefix = f'Bench{rng.randrange(10 ** 6)}_'
+        password = make_password(PASSWORD)
+        started = time.perf_counter()
+        for start in range(0, count, options['batch_size']):
+            User.objects.bulk_create([User(username=f'{prefix}{number}', password=password)
+                                      for number in range(start, min(count, start + options['batch_size']))])
+        self.stdout.write(f'Seeded {count} users in {time.perf_counter() - started:.1f} s')
+        return prefix
+
+    def compare(self, label, names, queryset, lookup=None):
+        self.stdout.write(f'\n{label}: {queryset(names[0]).explain()}')
+        lookup = lookup or (lambda name: queryset(name).first())
+        latencies = []
+        for name in names:
+            started = time.perf_counter()
+            user = lookup(name)
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert user is not None, name
+        self.stdout.write(f'  {len(names)} lookups, mean {statistics.mean(latencies):.3f} ms, '
+                          f'p50 {percentile(latencies, 50):.3f} ms, p99 {percentile(latencies, 99):.3f} ms')
+
+    def logins(self, names):
+        factory = APIRequestFactory()
+        view = LoginView.as_view()
+        statuses = {}
+        started = time.perf_counter()
+        for name in names:
+            response = view(factory.post('/api/login/', {'username': name, 'password': PASSWORD}, format='json'))
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'\nLoginView: {len(names)} logins in {elapsed:.2f} s, {len(names) / elapsed:.0f} logins/s, '
+                          f'statuses {statuses}')
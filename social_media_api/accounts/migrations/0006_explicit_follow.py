@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_username_lower_index"),
+    ]
+
+    operations = [
+        # The table, its columns and its unique constraint already exist as the
+        # auto-created through table of CustomUser.following
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="Follow",
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        (
+                            "from_customuser",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="+",
+                                to=settings.AUTH_USER_MODEL,
+                            ),
+                        ),
+                        (
+                            "to_customuser",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="+",
+                                to=settings.AUTH_USER_MODEL,
+                            ),
+                        ),
+                    ],
+                    options={
+                        "db_table": "accounts_customuser_following",
+                        "unique_together": {("from_customuser", "to_customuser")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="customuser",
+                    name="following",
+                    field=models.ManyToManyField(
+                        blank=True,
+                        related_name="followers_set",
+                        through="accounts.Follow",
+                        through_fields=("from_customuser", "to_customuser"),
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(
+                fields=["to_customuser", "id"], name="follow_followers_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(
+                fields=["from_customuser", "id"], name="follow_following_idx"
+            ),
+        ),
+        # The composite indexes lead with these columns, so their own indexes go
+        migrations.AlterField(
+            model_name="follow",
+            name="from_customuser",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="follow",
+            name="to_customuser",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.db.models.functions import Lower
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
@@ -8,7 +9,15 @@ class CustomUser(AbstractUser):
     bio = models.TextField(blank=True, null=True)
     birth_date = models.DateField(blank=True, null=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
-    following = models.ManyToManyField('self', symmetrical=False, related_name='followers_set', blank=True) 
+    following = models.ManyToManyField('self', through='Follow', through_fields=('from_customuser', 'to_customuser'),
+                                       symmetrical=False, related_name='followers_set', blank=True)
+    # Stored counts of the following M2M, kept exact by accounts.signals
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+    following_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta(AbstractUser.Meta):
+        # Case-insensitive login lookups (see accounts.serializers.find_user)
+        indexes = [models.Index(Lower('username'), name='user_username_lower_idx')]
 
     def validate_birth_date(self):
         if self.birth_date and self.birth_date > timezone.now().date():
@@ -23,6 +32,22 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
 
+# Through table of CustomUser.following: from_customuser follows to_customuser.
+# Formerly Django's auto-created table, made explicit to index the follower and
+# following listings, which are keyset paginated on id
+class Follow(models.Model):
+    # Both columns lead a composite index below, so they need no index of their own
+    from_customuser = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+', db_index=False)
+    to_customuser = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+', db_index=False)
+
+    class Meta:
+        db_table = 'accounts_customuser_following'
+        unique_together = ('from_customuser', 'to_customuser')
+        indexes = [
+            models.Index(fields=['to_customuser', 'id'], name='follow_followers_idx'),
+            models.Index(fields=['from_customuser', 'id'], name='follow_following_idx'),
+        ]
+
 class Post(models.Model):
     author = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField()
@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db.models import Value
+from django.db.models.functions import Lower
 from rest_framework.authtoken.models import Token
 
 # Registration serializer
@@ -22,17 +24,27 @@ class UserCreateSerializer(serializers.ModelSerializer):
         Token.objects.create(user=user)
         return user
 
+# Resolves which users of a page the viewer follows with a single query
+class UserListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        users = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        if request and request.user.is_authenticated:
+            self.context['following_ids'] = set(
+                request.user.following.filter(pk__in=[user.pk for user in users]).values_list('pk', flat=True)
+            )
+        return super().to_representation(users)
+
 # Profile / public serializer
 class UserSerializer(serializers.ModelSerializer):
     is_following = serializers.SerializerMethodField()
-    followers_count = serializers.IntegerField(source='followers.count', read_only=True)
-    following_count = serializers.IntegerField(source='following.count', read_only=True)
 
     class Meta:
         model = get_user_model()
         fields = ['id', 'username', 'email', 'bio', 'birth_date', 'profile_picture', 
                   'followers_count', 'following_count', 'is_following']
         read_only_fields = fields
+        list_serializer_class = UserListSerializer
 
     def get_is_following(self, obj):
         request = self.context.get('request')
@@ -40,8 +52,25 @@ class UserSerializer(serializers.ModelSerializer):
             return False
         if obj == request.user:
             return False
+        following_ids = self.context.get('following_ids')
+        if following_ids is not None:
+            return obj.pk in following_ids
         return request.user.following.filter(pk=obj.pk).exists()
 
+# Compact user card for follower/following listings: only columns of the user row,
+# so a page of cards is one query
+class UserCardSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = get_user_model()
+        fields = ['id', 'username', 'profile_picture', 'followers_count']
+        read_only_fields = fields
+
+# Case-insensitive username lookup. LOWER(username) = LOWER(%s) is answered by the
+# user_username_lower_idx expression index, which username__iexact cannot use
+def find_user(username):
+    return (get_user_model().objects.alias(username_lower=Lower('username'))
+            .filter(username_lower=Lower(Value(username))).order_by('pk').first())
+
 # Login serializer
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField(required=True)
@@ -54,7 +83,7 @@ class LoginSerializer(serializers.Serializer):
         if not username or not password:
             raise serializers.ValidationError("Both username and password are required.")
 
-        user = get_user_model().objects.filter(username__iexact=username).first()
+        user = find_user(username)
         if not user or not user.check_password(password):
             raise serializers.ValidationError("Invalid username or password.")
 
@@ -0,0 +1,72 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .models import CustomUser, Follow
+from .authentication import token_cache
+from .counters import adjust_follow_counts
+
+
+def _follows(instance, reverse, pk_set=None):
+    # Ids on the other side of the instance's existing follows, optionally limited to pk_set
+    if reverse:
+        rows = Follow.objects.filter(to_customuser_id=instance.pk).values_list('from_customuser_id', flat=True)
+        if pk_set is not None:
+            rows = rows.filter(from_customuser_id__in=pk_set)
+    else:
+        rows = Follow.objects.filter(from_customuser_id=instance.pk).values_list('to_customuser_id', flat=True)
+        if pk_set is not None:
+            rows = rows.filter(to_customuser_id__in=pk_set)
+    return set(rows)
+
+
+def _adjust(instance, reverse, ids, delta):
+    if reverse:
+        adjust_follow_counts(ids, [instance.pk], delta)
+    else:
+        adjust_follow_counts([instance.pk], ids, delta)
+
+
+# Keep followers_count/following_count in step with the following through table.
+# post_add only lists rows that were really inserted; remove and clear are told what
+# was asked for, so the rows that actually go are read before the delete.
+@receiver(m2m_changed, sender=Follow)
+def count_follows(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add':
+        _adjust(instance, reverse, pk_set, 1)
+    elif action in ('pre_remove', 'pre_clear'):
+        instance._removed_follows = _follows(instance, reverse, pk_set if action == 'pre_remove' else None)
+    elif action in ('post_remove', 'post_clear'):
+        _adjust(instance, reverse, instance.__dict__.pop('_removed_follows', set()), -1)
+
+
+# Deleting a user cascades to their follow rows without any m2m_changed signal. Only
+# the other side of each row is uncounted: when several users who follow each other
+# go in one delete, every row between them is then uncounted once, not twice.
+@receiver(pre_delete, sender=CustomUser)
+def uncount_deleted_user(sender, instance, **kwargs):
+    followed = Follow.objects.filter(from_customuser_id=instance.pk).values('to_customuser_id')
+    followers = Follow.objects.filter(to_customuser_id=instance.pk).values('from_customuser_id')
+    CustomUser.objects.filter(pk__in=followed).exclude(pk=instance.pk).update(followers_count=F('followers_count') - 1)
+    CustomUser.objects.filter(pk__in=followers).exclude(pk=instance.pk).update(following_count=F('following_count') - 1)
+
+
+# Drop cached token lookups (see accounts.authentication) when the token goes or the
+# user changes, e.g. is deactivated; again on commit, in case a lookup refilled them meanwhile
+def _invalidate_tokens(keys):
+    keys = list(keys)
+    if keys:
+        token_cache.invalidate(keys)
+        transaction.on_commit(lambda: token_cache.invalidate(keys))
+
+
+@receiver(post_delete, sender=Token)
+def uncache_deleted_token(sender, instance, **kwargs):
+    _invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=CustomUser)
+def uncache_saved_user(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        _invalidate_tokens(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
@@ -1,3 +1,157 @@
-from django.test import TestCase
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from accounts import urls
+from accounts.authentication import UNSHARED_TTL, TokenCache, check_shared_cache
+from accounts.views import FollowersView, FollowingView
+from posts.pagination import KeysetPagination
+from social_media_api.testing import PASSWORD, QueryBudgetTestCase, QueryPlanMixin, route_names
+
+# Query budgets for every route in accounts.urls (see social_media_api/testing.py)
+class AccountsQueryBudgetTests(QueryBudgetTestCase):
+    routes = {
+        'api-root', 'login', 'user_registration', 'export-data', 'auth-cache-stats', 'profile-list', 'profile-detail',
+        'user-followers', 'user-following',
+    }
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual(route_names(urls.urlpatterns) - self.routes, set())
+
+    def test_api_root(self):
+        self.assertQueryBudget(1, 'get', reverse('api-root'), status=200)
+
+    def test_login(self):
+        self.client.credentials()
+        self.assertQueryBudget(3, 'post', reverse('login'), {'username': 'user3', 'password': PASSWORD}, status=200)
+
+    def test_registration(self):
+        self.client.credentials()
+        self.assertQueryBudget(5, 'post', reverse('user_registration'),
+                               {'username': 'newcomer', 'email': 'newcomer@example.com', 'password': PASSWORD}, status=201)
+
+    def test_export(self):
+        response = self.assertQueryBudget(6, 'get', reverse('export-data'), status=200)
+        self.assertTrue(response.streamed_content)
+
+    def test_auth_cache_stats(self):
+        self.viewer.is_staff = True
+        self.viewer.save(update_fields=['is_staff'])
+        self.assertQueryBudget(1, 'get', reverse('auth-cache-stats'), status=200)
+
+    # A client whose token is cached does not touch the auth tables
+    def test_cached_token(self):
+        self.assertQueryBudget(3, 'get', reverse('profile-detail', args=[self.viewer.pk]), status=200)
+        self.assertQueryBudget(2, 'get', reverse('profile-detail', args=[self.viewer.pk]), status=200)
+
+    # Deactivating a user takes effect on the next request, cached token or not
+    def test_deactivated_user(self):
+        self.assertQueryBudget(3, 'get', reverse('profile-detail', args=[self.viewer.pk]), status=200)
+        self.viewer.is_active = False
+        self.viewer.save(update_fields=['is_active'])
+        self.assertQueryBudget(1, 'get', reverse('profile-detail', args=[self.viewer.pk]), status=401)
+
+    def test_followers(self):
+        self.assertListBudget(2, reverse('user-followers', args=[self.viewer.pk]))
+
+    def test_following(self):
+        self.assertListBudget(2, reverse('user-following', args=[self.viewer.pk]))
+
+    def test_profile_list(self):
+        self.assertQueryBudget(4, 'get', reverse('profile-list'), status=200)
+
+    def test_profile_retrieve(self):
+        self.assertQueryBudget(3, 'get', reverse('profile-detail', args=[self.viewer.pk]), status=200)
+
+    def test_profile_update(self):
+        self.assertQueryBudget(4, 'patch', reverse('profile-detail', args=[self.viewer.pk]), {'bio': 'Counting queries'}, status=200)
+
+
+# Follower and following pages are index range scans of the Follow table
+class AccountsQueryPlanTests(QueryPlanMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='planner', password=PASSWORD)
+        cls.cursor = 'cursor=' + KeysetPagination().encode_position(timezone.now(), 1)
+
+    def test_followers(self):
+        followers = FollowersView(kwargs={'pk': self.user.pk}).get_queryset()
+        self.assertIndexedPlan(self.page_query(followers))
+        self.assertIndexedPlan(self.page_query(followers, self.cursor))
+
+    def test_following(self):
+        following = FollowingView(kwargs={'pk': self.user.pk}).get_queryset()
+        self.assertIndexedPlan(self.page_query(following))
+        self.assertIndexedPlan(self.page_query(following, self.cursor))
+
+
+# followers_count and following_count stay exact through deletes (see accounts.signals)
+class FollowCountTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.ann, self.bob, self.cat = [User.objects.create_user(username=name, password=PASSWORD)
+                                        for name in ('ann', 'bob', 'cat')]
+        self.ann.following.add(self.bob, self.cat)
+        self.bob.following.add(self.ann, self.cat)
+        self.cat.following.add(self.ann)
+
+    def assertCounts(self, user, followers, following):
+        user.refresh_from_db()
+        self.assertEqual((user.followers_count, user.following_count), (followers, following))
+
+    def test_delete_user(self):
+        self.bob.delete()
+        self.assertCounts(self.ann, 1, 1)
+        self.assertCounts(self.cat, 1, 1)
+
+    def test_bulk_delete_mutual_followers(self):
+        get_user_model().objects.filter(pk__in=[self.ann.pk, self.bob.pk]).delete()
+        self.assertCounts(self.cat, 0, 0)
+
+
+# Two processes sharing AUTH_TOKEN_CACHE_ALIAS, each with its own LRU
+class SharedTokenCacheTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.enterContext(override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+                    'tokens': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}},
+            AUTH_TOKEN_CACHE_ALIAS='tokens',
+        ))
+        self.user = get_user_model().objects.create_user(username='worker', password=PASSWORD)
+        self.key = Token.objects.create(user=self.user).key
+        self.first, self.second = TokenCache(), TokenCache()
+
+    def test_invalidation_reaches_other_processes(self):
+        self.assertEqual(self.first.get(self.key).user, self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.second.get(self.key).user, self.user)
+            self.assertEqual(self.second.get(self.key).user, self.user)
+        self.assertEqual((self.second.stats()['shared_hits'], self.second.stats()['local_hits']), (1, 1))
+
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
+        self.first.invalidate([self.key])
+        with self.assertNumQueries(1):
+            self.assertFalse(self.second.get(self.key).user.is_active)
+
+    def test_deleted_token(self):
+        self.assertIsNotNone(self.second.get(self.key))
+        Token.objects.filter(key=self.key).delete()
+        self.first.invalidate([self.key])
+        self.assertIsNone(self.second.get(self.key))
+
+    def test_local_memory_is_not_shared(self):
+        with override_settings(AUTH_TOKEN_CACHE_ALIAS='default'):
+            self.assertIsNone(self.first.shared)
+            self.assertEqual(self.first.ttl, UNSHARED_TTL)
+            self.assertEqual([message.id for message in check_shared_cache(None)], ['accounts.W001'])
+        self.assertEqual(check_shared_cache(None), [])
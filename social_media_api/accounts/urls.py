@@ -1,4 +1,5 @@
-from .views import UserRegistrationView, LoginView, ProfileViewSet
+from .views import (UserRegistrationView, LoginView, ProfileViewSet, ExportDataView, AuthCacheStatsView,
+                    FollowersView, FollowingView)
 from django.urls import path, include
 from rest_framework import routers
 
@@ -8,6 +9,10 @@ router.register(r'profiles', ProfileViewSet, basename='profile')
 urlpatterns = [
     path("login/", LoginView.as_view(), name="login"),
     path("register/", UserRegistrationView.as_view(), name="user_registration"),
+    path("export/", ExportDataView.as_view(), name="export-data"),
+    path("auth/cache-stats/", AuthCacheStatsView.as_view(), name="auth-cache-stats"),
+    path("users/<int:pk>/followers/", FollowersView.as_view(), name="user-followers"),
+    path("users/<int:pk>/following/", FollowingView.as_view(), name="user-following"),
 ]
 
 urlpatterns += router.urls
\ No newline at end of file
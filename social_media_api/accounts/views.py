@@ -1,14 +1,25 @@
 from django.shortcuts import render
 import accounts
 from posts.permissions import IsOwnerOrReadOnly
-from .models import CustomUser
+from .models import CustomUser, Follow
 from rest_framework.views import APIView
 from rest_framework import generics, permissions, status, viewsets
-from .serializers import UserCreateSerializer, LoginSerializer, UserSerializer
+from .serializers import UserCreateSerializer, LoginSerializer, UserSerializer, UserCardSerializer
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
-from rest_framework.authentication import TokenAuthentication
+from accounts.authentication import CachedTokenAuthentication, token_cache
 from rest_framework.authtoken.models import Token
 from accounts.permissions import IsOwnerOrReadOnly, IsAuthenticatedOrReadOnly
+from posts.feed import backfill_timeline, purge_timeline
+from .export import export_chunks
+from .counters import adjust_follow_counts
+from django.db import transaction
+from django.db.models import Value
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from posts.pagination import KeysetPagination
+from social_media_api.routers import ReplicaReadMixin
+from social_media_api.sql import insert_from_select, delete_rows
 # Create your views here.
 from .serializers import UserCreateSerializer, UserSerializer
 
@@ -55,60 +66,149 @@ class LoginView(APIView):
 
 
 # ViewSet for the profile management.
-class ProfileViewSet(viewsets.ModelViewSet):
+class ProfileViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = UserSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsOwnerOrReadOnly, permissions.IsAuthenticated]
 
     def get_queryset(self):
         return CustomUser.objects.filter(id=self.request.user.id)
     
 # Follow and Unfollow functionality
+# One INSERT ... SELECT into the following through table that skips an existing
+# follow, or one DELETE; the timeline is only backfilled or purged when the row
+# count says the follow changed. Shared with the async views.
+def record_follow(user, target_id):
+    with transaction.atomic():
+        created = insert_from_select(Follow, ['from_customuser', 'to_customuser'],
+                                     CustomUser.objects.filter(pk=target_id).values_list(Value(user.pk), 'pk'),
+                                     ignore_conflicts=True)
+        if created:
+            # The through table was written directly, so no m2m_changed signal counts this follow
+            adjust_follow_counts([user.pk], [target_id], 1)
+            # Bring the followed user's recent posts into the home timeline
+            backfill_timeline(user.pk, target_id)
+    return bool(created)
+
+
+def remove_follow(user, target_id):
+    with transaction.atomic():
+        deleted = delete_rows(Follow.objects.filter(from_customuser_id=user.pk, to_customuser_id=target_id))
+        if deleted:
+            adjust_follow_counts([user.pk], [target_id], -1)
+            purge_timeline(user.pk, target_id)
+    return bool(deleted)
+
+
+def user_not_found():
+    return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+
+# POST follow/unfollow answer 400 when nothing changes; PUT and DELETE are idempotent and answer 200
+def follow(request, pk, unchanged_status):
+    # Prevent users from following/unfollowing themselves
+    if pk == request.user.pk:
+        return Response({'error': 'You cannot follow/unfollow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
+    if record_follow(request.user, pk):
+        return Response({'status': 'User followed successfully.'}, status=status.HTTP_200_OK)
+    if not CustomUser.objects.filter(pk=pk).exists():
+        return user_not_found()
+    return Response({'status': 'You are already following this user.'}, status=unchanged_status)
+
+
+def unfollow(request, pk, unchanged_status):
+    if pk == request.user.pk:
+        return Response({'error': 'You cannot follow/unfollow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
+    if remove_follow(request.user, pk):
+        return Response({'status': 'User unfollowed successfully.'}, status=status.HTTP_200_OK)
+    if not CustomUser.objects.filter(pk=pk).exists():
+        return user_not_found()
+    return Response({'status': 'You are not following this user.'}, status=unchanged_status)
+
+
+# POST follows; PUT follows and DELETE unfollows idempotently
 class FollowView(generics.GenericAPIView):
-    authentication_classes = [TokenAuthentication]
-    permission_classes = [permissions.IsAuthenticated] # Only authenticated users can follow/unfollow                                        
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated] # Only authenticated users can follow/unfollow
 
     def post(self, request, pk):
-        try:
-            target_user = CustomUser.objects.get(pk=pk)
-        except CustomUser.DoesNotExist:
-            return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
-        # Prevent users from following/unfollowing themselves
-        if target_user == request.user:
-            return Response({'error': 'You cannot follow/unfollow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Check if already following
-        if request.user.following.filter(id=target_user.id).exists():
-            # Return 'You are already following this user'
-            return Response({'status': 'You are already following this user.'}, 
-                            status=status.HTTP_400_BAD_REQUEST
-                            )
-        # Add target_user to the following list of the request.user
-        request.user.following.add(target_user)
-        return Response({'status': 'User followed successfully.'}, 
-                        status=status.HTTP_200_OK
-                        )
+        return follow(request, pk, status.HTTP_400_BAD_REQUEST)
+
+    def put(self, request, pk):
+        return follow(request, pk, status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        return unfollow(request, pk, status.HTTP_200_OK)
+
+
 # Unfollow functionality
 class UnfollowView(generics.GenericAPIView):
-    authentication_classes = [TokenAuthentication]
-    permission_classes = [permissions.IsAuthenticated] # Only authenticated users can follow/unfollow                                        
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated] # Only authenticated users can follow/unfollow
 
     def post(self, request, pk):
-        try:
-            target_user = CustomUser.objects.get(pk=pk)
-        except CustomUser.DoesNotExist:
-            return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
-        # Prevent users from following/unfollowing themselves
-        if target_user == request.user:
-            return Response({'error': 'You cannot follow/unfollow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Check if already following and unfollow
-        if request.user.following.filter(id=target_user.id).exists():
-            request.user.following.remove(target_user)
-            return Response({'status': 'User unfollowed successfully.'}, 
-                            status=status.HTTP_200_OK
-                            )
-        return Response({'status': 'You are not following this user.'}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                        )
-    
+        return unfollow(request, pk, status.HTTP_400_BAD_REQUEST)
+
+
+# Followers and following of a user, newest follow first. Pages are keyset ranges of
+# the Follow table (follow_followers_idx / follow_following_idx), each row joined to
+# the card of the listed user, so a page is one query however large it is
+class FollowListView(ReplicaReadMixin, generics.ListAPIView):
+    serializer_class = UserCardSerializer
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = []
+    # Follow column holding the user in the URL, and the relation to the listed users
+    user_field = None
+    card_field = None
+
+    def get_queryset(self):
+        cards = [f'{self.card_field}__{name}' for name in UserCardSerializer.Meta.fields]
+        return (Follow.objects.filter(**{f'{self.user_field}_id': self.kwargs['pk']})
+                .select_related(self.card_field).only(self.card_field, *cards))
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        # Only an empty page needs to know whether the user exists
+        if not page and not CustomUser.objects.filter(pk=self.kwargs['pk']).exists():
+            raise NotFound('User not found.')
+        serializer = self.get_serializer([getattr(follow, self.card_field) for follow in page], many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class FollowersView(FollowListView):
+    user_field = 'to_customuser'
+    card_field = 'from_customuser'
+
+
+class FollowingView(FollowListView):
+    user_field = 'from_customuser'
+    card_field = 'to_customuser'
+
+
+# Hit/miss counters of the token authentication cache (per process), for capacity planning
+class AuthCacheStatsView(APIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(token_cache.stats())
+
+
+# "Download my data": streams the user's posts, comments, likes and notifications
+# as NDJSON. Rows are read in bounded chunks, so memory use does not grow with the
+# size of the account; gzip is used when the client accepts it.
+class ExportDataView(APIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        compress = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        response = StreamingHttpResponse(export_chunks(request.user, compress=compress),
+                                         content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="{request.user.username}-export.ndjson"'
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
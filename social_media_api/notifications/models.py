@@ -9,5 +9,9 @@ class Notification(models.Model):
     target = models.ForeignKey('posts.Post', on_delete=models.CASCADE, blank=True,)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # A user's inbox is read newest first with keyset pagination
+        indexes = [models.Index(fields=['recipient', 'timestamp', 'id'], name='notification_inbox_idx')]
+
     def __str__(self):
         return f'Notification to {self.recipient.username} from {self.actor.username} at {self.created_at}'
\ No newline at end of file
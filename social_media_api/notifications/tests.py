@@ -1,3 +1,40 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+from notifications import urls
+from notifications.models import Notification
+from posts.pagination import KeysetPagination
+from social_media_api.testing import QueryBudgetTestCase, QueryPlanMixin, route_names
+
+# Query budgets for every route in notifications.urls (see social_media_api/testing.py)
+class NotificationsQueryBudgetTests(QueryBudgetTestCase):
+    routes = {'api-root', 'notification-list', 'notification-detail'}
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual(route_names(urls.urlpatterns) - self.routes, set())
+
+    def test_api_root(self):
+        self.assertQueryBudget(1, 'get', reverse('api-root'), status=200)
+
+    def test_notification_list(self):
+        self.assertListBudget(2, reverse('notification-list'))
+
+    def test_notification_retrieve(self):
+        notification = Notification.objects.filter(recipient=self.viewer).first()
+        self.assertQueryBudget(2, 'get', reverse('notification-detail', args=[notification.pk]), status=200)
+
+    def test_notification_destroy(self):
+        notification = Notification.objects.filter(recipient=self.viewer).first()
+        self.assertQueryBudget(3, 'delete', reverse('notification-detail', args=[notification.pk]), status=204)
+
+
+class NotificationsQueryPlanTests(QueryPlanMixin, TestCase):
+
+    def test_inbox(self):
+        user = get_user_model().objects.create_user(username='planner', password='plan-pass-123')
+        inbox = Notification.objects.filter(recipient=user, target__deleted_at__isnull=True)
+        cursor = 'cursor=' + KeysetPagination().encode_position(timezone.now(), 1)
+        self.assertIndexedPlan(self.page_query(inbox))
+        self.assertIndexedPlan(self.page_query(inbox, cursor))
@@ -1,16 +1,17 @@
 from django.shortcuts import render
-from .models import Post, Comment, Like, Notification
+from .models import Notification
 from rest_framework.viewsets import ModelViewSet
 from .serializers import NotificationSerializer
-from rest_framework.authentication import TokenAuthentication
+from accounts.authentication import CachedTokenAuthentication
 from rest_framework.permissions import IsAuthenticated
+from social_media_api.routers import ReplicaReadMixin
 # Create your views here.
-class NotificationViewSet(ModelViewSet):
+class NotificationViewSet(ReplicaReadMixin, ModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        # Return notifications for the authenticated user only
-        return self.queryset.filter(recipient=self.request.user)
\ No newline at end of file
+        # Return notifications for the authenticated user only, leaving out deleted posts
+        return self.queryset.filter(recipient=self.request.user, target__deleted_at__isnull=True)
\ No newline at end of file
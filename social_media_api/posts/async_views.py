@@ -0,0 +1,69 @@
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework import status
+from accounts.async_views import AsyncAPIView
+from .models import Post
+from .views import record_like, remove_like
+from . import write_behind
+
+# Async like/unlike (see accounts.async_views). Lookups use the async ORM; the like
+# row, the post counter and the notification change in one transaction, which
+# Django only runs in sync code, so that part is record_like/remove_like through
+# one sync_to_async call.
+
+
+async def get_post(pk):
+    try:
+        return await Post.objects.aget(pk=pk)
+    except Post.DoesNotExist:
+        return None
+
+
+def not_found():
+    return JsonResponse({'detail': 'No Post matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+
+
+# Same flow and answers as posts.views.like and posts.views.unlike
+async def like(request, pk, unchanged_status):
+    post = await get_post(pk)
+    if post is None:
+        return not_found()
+    if write_behind.should_buffer(post):
+        result = await sync_to_async(write_behind.buffer_like)(request.user.pk, post.pk)
+        if result == 'already liked':
+            return JsonResponse({'status': 'you already liked this post'}, status=unchanged_status)
+        if result == 'liked':
+            return JsonResponse({'status': 'post liked'}, status=status.HTTP_201_CREATED)
+        # Buffer full: write this like directly
+
+    if await sync_to_async(record_like, thread_sensitive=True)(request.user, post.pk):
+        return JsonResponse({'status': 'post liked'}, status=status.HTTP_201_CREATED)
+    return JsonResponse({'status': 'you already liked this post'}, status=unchanged_status)
+
+
+async def unlike(request, pk, unchanged_status):
+    if write_behind.enabled() and await sync_to_async(write_behind.buffer_unlike)(request.user.pk, pk):
+        return JsonResponse({'status': 'post unliked'}, status=status.HTTP_200_OK)
+    if await sync_to_async(remove_like, thread_sensitive=True)(request.user, pk):
+        return JsonResponse({'status': 'post unliked'}, status=status.HTTP_200_OK)
+    if not await Post.objects.filter(pk=pk).aexists():
+        return not_found()
+    return JsonResponse({'status': 'you have not liked this post'}, status=unchanged_status)
+
+
+class AsyncLikePostView(AsyncAPIView):
+
+    async def post(self, request, pk):
+        return await like(request, pk, status.HTTP_400_BAD_REQUEST)
+
+    async def put(self, request, pk):
+        return await like(request, pk, status.HTTP_200_OK)
+
+    async def delete(self, request, pk):
+        return await unlike(request, pk, status.HTTP_200_OK)
+
+
+class AsyncUnlikePostView(AsyncAPIView):
+
+    async def post(self, request, pk):
+        return await unlike(request, pk, status.HTTP_400_BAD_REQUEST)
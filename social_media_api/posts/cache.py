@@ -0,0 +1,120 @@
+"""
+Versioned response cache for the post endpoints.
+
+Rendered JSON responses are stored under keys that embed version numbers:
+one per post, one for all post lists and a global one. Saving or deleting a
+Post, Comment or Like bumps the affected versions (see posts.signals), so stale
+entries are simply never looked up again and expire on their own. Nothing is
+deleted key by key, which keeps this usable with the local-memory and
+file-based cache backends.
+
+The versions must be seen by every process, so responses are only cached when
+POST_RESPONSE_CACHE names a shared cache (file-based, Redis, Memcached...). On
+a local-memory cache a write in one worker could not invalidate the responses
+cached by the others, so caching stays off and `manage.py check` warns.
+"""
+
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import transaction
+
+from social_media_api.cache import is_shared
+
+RESPONSE_TIMEOUT = 300
+KEY_PREFIX = 'posts:cache'
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0}
+
+
+def get_cache():
+    return caches[settings.POST_RESPONSE_CACHE]
+
+
+def enabled():
+    return bool(settings.POST_RESPONSE_CACHE) and is_shared(get_cache())
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if settings.POST_RESPONSE_CACHE and not is_shared(get_cache()):
+        return [checks.Warning(
+            f'POST_RESPONSE_CACHE ({settings.POST_RESPONSE_CACHE!r}) is not shared between processes, '
+            'so post responses are not cached.',
+            hint='Point it at a file-based, Redis or Memcached cache, or set it to "" to silence this.',
+            id='posts.W001',
+        )]
+    return []
+
+
+def version_key(name):
+    return f'{KEY_PREFIX}:version:{name}'
+
+
+def post_version(post_id):
+    return f'post:{post_id}'
+
+
+def _initial_version():
+    # Start from the clock so a version evicted from the cache never reuses an old number
+    return time.time_ns()
+
+
+def get_versions(names):
+    cache = get_cache()
+    keys = [version_key(name) for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _initial_version(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def _bump(names):
+    cache = get_cache()
+    for name in names:
+        try:
+            cache.incr(version_key(name))
+        except ValueError:
+            cache.set(version_key(name), _initial_version(), None)
+
+
+# Invalidate every cached list and the given posts, once the current transaction commits
+def bump_versions(post_ids=(), lists=True):
+    if not enabled():
+        return
+    names = [post_version(post_id) for post_id in post_ids]
+    if lists:
+        names.append('list')
+    transaction.on_commit(lambda: _bump(names))
+
+
+# Invalidate everything, e.g. after bulk changes made outside the views
+def bump_all():
+    if enabled():
+        transaction.on_commit(lambda: _bump(['all']))
+
+
+def response_key(kind, versions, request):
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+    return f'{KEY_PREFIX}:{kind}:{":".join(map(str, versions))}:{user_id}:{path}'
+
+
+def record(stat):
+    with _lock:
+        _stats[stat] += 1
+
+
+def stats():
+    with _lock:
+        current = dict(_stats)
+    lookups = current['hits'] + current['misses']
+    current['hit_ratio'] = round(current['hits'] / lookups, 4) if lookups else None
+    return current
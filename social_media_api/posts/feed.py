@@ -0,0 +1,179 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from social_media_api.cache import is_shared
+from social_media_api.sql import insert_from_select
+from .models import Post, TimelineEntry, PulledAuthor
+
+# Number of rows written per INSERT when fanning out a post
+FANOUT_BATCH_SIZE = 1000
+# Number of recent posts copied into a timeline when a user starts following someone
+BACKFILL_LIMIT = 50
+# Number of recent posts kept per pulled author, this bounds how far back their posts show up in feeds
+RECENT_POSTS_LIMIT = 200
+# The lists are dropped when their author posts or deletes, which only reaches every
+# process through a shared cache; on a per-process cache they expire quickly instead
+RECENT_POSTS_TIMEOUT = 60 * 60
+RECENT_POSTS_LOCAL_TIMEOUT = 30
+
+
+# Authors with at least this many followers are merged in at read time
+# instead of being pushed into every follower's timeline (0 disables the hybrid mode)
+def fanout_threshold():
+    return getattr(settings, 'FEED_FANOUT_THRESHOLD', 0)
+
+
+def follower_ids(author_id):
+    # Read follower ids straight from the M2M through table, no user rows are loaded
+    Follow = get_user_model().following.through
+    return Follow.objects.filter(to_customuser_id=author_id).values_list('from_customuser_id', flat=True)
+
+
+def _entry(user_id, post):
+    return TimelineEntry(user_id=user_id, post_id=post.id, author_id=post.author_id, created_at=post.created_at)
+
+
+def recent_posts_key(author_id):
+    return f'feed:recent:{author_id}'
+
+
+def recent_posts_cache():
+    return caches[settings.FEED_CACHE]
+
+
+def recent_posts_timeout():
+    return RECENT_POSTS_TIMEOUT if is_shared(recent_posts_cache()) else RECENT_POSTS_LOCAL_TIMEOUT
+
+
+# Drop the author's recent-post list once the post change commits, so a feed read
+# in between cannot put the old list back
+def invalidate_recent_posts(author_id):
+    transaction.on_commit(lambda: recent_posts_cache().delete(recent_posts_key(author_id)))
+
+
+# Decide which of the authors have their posts pulled at read time.
+# Once an author crosses the threshold they stay in pull mode so their older posts keep showing up.
+def pulled_authors(author_ids):
+    threshold = fanout_threshold()
+    if not threshold:
+        return set()
+    pulled = set(PulledAuthor.objects.filter(author_id__in=author_ids).values_list('author_id', flat=True))
+    if len(pulled) == len(author_ids):
+        return pulled
+    # The stored count (see accounts.counters) instead of counting the follow rows
+    crossed = set(get_user_model().objects.filter(pk__in=set(author_ids) - pulled, followers_count__gte=threshold)
+                  .values_list('pk', flat=True))
+    if crossed:
+        PulledAuthor.objects.bulk_create([PulledAuthor(author_id=author_id) for author_id in crossed], ignore_conflicts=True)
+    return pulled | crossed
+
+
+def is_pulled_author(author_id):
+    return author_id in pulled_authors({author_id})
+
+
+# Push a new post into the timeline of its author and every follower.
+# Returns the number of timeline rows written.
+def fan_out_post(post):
+    batch = [_entry(post.author_id, post)]
+    if is_pulled_author(post.author_id):
+        # Followers will read the post from the author's recent-post cache instead
+        invalidate_recent_posts(post.author_id)
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        return 1
+
+    written = 0
+    for user_id in follower_ids(post.author_id).iterator(chunk_size=FANOUT_BATCH_SIZE):
+        batch.append(_entry(user_id, post))
+        if len(batch) >= FANOUT_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            written += len(batch)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        written += len(batch)
+    return written
+
+
+# Fan-out of many posts at once, e.g. after a bulk import: the authors' own entries
+# in one INSERT and the followers' entries of every pushed post in one INSERT ... SELECT
+# over the follow table. Returns the number of timeline rows written.
+def fan_out_posts(posts):
+    pulled = pulled_authors({post.author_id for post in posts})
+    for author_id in pulled:
+        invalidate_recent_posts(author_id)
+    written = len(TimelineEntry.objects.bulk_create([_entry(post.author_id, post) for post in posts], ignore_conflicts=True))
+    pushed = [post.id for post in posts if post.author_id not in pulled]
+    if pushed:
+        Follow = get_user_model().following.through
+        entries = (Follow.objects.filter(to_customuser__user_posts__in=pushed)
+                   .values_list('from_customuser_id', 'to_customuser__user_posts__id', 'to_customuser_id',
+                                'to_customuser__user_posts__created_at'))
+        written += insert_from_select(TimelineEntry, ['user', 'post', 'author', 'created_at'], entries, ignore_conflicts=True)
+    return written
+
+
+# Copy the latest posts of a newly followed author into the follower's timeline
+def backfill_timeline(user_id, author_id):
+    if PulledAuthor.objects.filter(author_id=author_id).exists():
+        return
+    recent = Post.objects.filter(author_id=author_id).only('id', 'author_id', 'created_at').order_by('-created_at')[:BACKFILL_LIMIT]
+    TimelineEntry.objects.bulk_create([_entry(user_id, post) for post in recent], ignore_conflicts=True)
+
+
+# Remove an unfollowed author's posts from the follower's timeline
+def purge_timeline(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+# (created_at, post id) pairs of the latest posts of each author, served from the cache
+def recent_posts(author_ids):
+    keys = {recent_posts_key(author_id): author_id for author_id in author_ids}
+    cache = recent_posts_cache()
+    found = cache.get_many(keys.keys())
+    missing = {}
+    for key, author_id in keys.items():
+        if key not in found:
+            missing[key] = list(
+                Post.objects.filter(author_id=author_id)
+                .order_by('-created_at', '-id')
+                .values_list('created_at', 'id')[:RECENT_POSTS_LIMIT]
+            )
+    if missing:
+        cache.set_many(missing, recent_posts_timeout())
+        found.update(missing)
+    return [item for items in found.values() for item in items]
+
+
+def pulled_author_ids(user):
+    Follow = get_user_model().following.through
+    following = Follow.objects.filter(from_customuser_id=user.id).values('to_customuser_id')
+    return list(PulledAuthor.objects.filter(author_id__in=following).values_list('author_id', flat=True))
+
+
+# Read one page of the home feed, newest first.
+# `before` is the (created_at, post id) position of the last item of the previous page.
+# Returns a list of (created_at, post id, post) tuples.
+def read_feed(user, limit, before=None):
+    entries = TimelineEntry.objects.filter(user=user, post__deleted_at__isnull=True).select_related('post')
+    if before:
+        created_at, post_id = before
+        entries = entries.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, post_id__lt=post_id))
+    items = {entry.post_id: (entry.created_at, entry.post_id, entry.post)
+             for entry in entries.order_by('-created_at', '-post_id')[:limit]}
+
+    pulled = pulled_author_ids(user)
+    if not pulled:
+        return list(items.values())
+
+    for created_at, post_id in recent_posts(pulled):
+        if post_id not in items and (before is None or (created_at, post_id) < before):
+            items[post_id] = (created_at, post_id, None)
+    page = sorted(items.values(), key=lambda item: (item[0], item[1]), reverse=True)[:limit]
+
+    # Load the pulled posts that made it onto the page in one query
+    posts = Post.objects.in_bulk([post_id for _, post_id, post in page if post is None])
+    return [(created_at, post_id, post or posts[post_id])
+            for created_at, post_id, post in page if post or post_id in posts]
@@ -0,0 +1,32 @@
+from rest_framework.filters import BaseFilterBackend
+from .search import filter_posts
+from .serializers import SparseFieldsMixin, requested_fields
+
+# `?search=` on the post list, answered from the full-text index instead of LIKE scans.
+# Matching posts keep the list ordering; use /api/posts/search/?q= for relevance order.
+# As a filter it must keep every matching post, not just the best ranked ones.
+class PostSearchFilter(BaseFilterBackend):
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return filter_posts(queryset, query)
+
+
+# Column pruning for sparse fieldsets: loads only the columns behind the fields
+# requested with `?fields=` (plus the primary key and the pagination key)
+class SparseFieldsFilter(BaseFilterBackend):
+
+    def filter_queryset(self, request, queryset, view):
+        if not requested_fields(request) or not issubclass(view.get_serializer_class(), SparseFieldsMixin):
+            return queryset
+        serializer = view.get_serializer()
+        model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        columns = {queryset.model._meta.pk.name}
+        columns.update(field.source for field in serializer.fields.values() if field.source in model_fields)
+        keyset_field = getattr(view.paginator, 'get_keyset_field', None)
+        if keyset_field:
+            columns.add(keyset_field(queryset, view) or queryset.model._meta.pk.name)
+        return queryset.only(*columns)
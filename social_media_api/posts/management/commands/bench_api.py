@@ -0,0 +1,312 @@
+"""
+Load benchmark for the API, run in process through the WSGI handler.
+
+Seeds a synthetic social graph (users, follows, posts fanned out to
+timelines, comments, likes and notifications), then replays a weighted mix of
+requests from a thread pool: feed, post list, post detail, like/unlike,
+follow/unfollow, comment and notifications. Each worker thread acts as its
+own set of users, and the mix is drawn from a seeded random generator, so
+runs with the same options issue the same requests.
+
+Reports p50/p95/p99 latency, requests per second and SQL queries per request
+for each endpoint, and writes them as JSON (--output) so runs can be compared
+between commits. The seeded rows are deleted at the end unless --keep is given.
+
+Meant for a local SQLite database:
+
+Usage: DB_ENGINE=django.db.backends.sqlite3 DB_NAME=bench.sqlite3 python manage.py migrate
+       DB_ENGINE=django.db.backends.sqlite3 DB_NAME=bench.sqlite3 python manage.py bench_api --threads 8 --requests 5000 --output bench.json
+"""
+
+import json
+import logging
+import random
+import statistics
+import subprocess
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, transaction
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from accounts.counters import recount_follow_counts
+from notifications.models import Notification
+from posts.feed import fan_out_post
+from posts.models import Post, Comment, Like
+
+USERNAME_PREFIX = 'bench_api_'
+DEFAULT_MIX = 'feed=30,list=20,retrieve=15,like=10,follow=5,comment=5,notifications=15'
+MIX_NAMES = ('feed', 'list', 'retrieve', 'like', 'follow', 'comment', 'notifications')
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        try:
+            mix[name.strip()] = float(weight)
+        except ValueError:
+            raise CommandError(f'Invalid --mix entry "{item}", expected name=weight')
+    unknown = set(mix) - set(MIX_NAMES)
+    if unknown:
+        raise CommandError(f'Unknown endpoints in --mix: {", ".join(sorted(unknown))}')
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5,
+                              cwd=settings.BASE_DIR).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def is_success(status):
+    return 200 <= status < 300
+
+
+# A misconfigured run (redirects, auth failures) would otherwise report fast, meaningless numbers
+def check_responses(samples):
+    first = {}
+    for name, _, _, status in samples:
+        first.setdefault(name, status)
+    failing = sorted(f'{name} ({status})' for name, status in first.items() if not is_success(status))
+    if failing:
+        raise CommandError(f'First response was not a 2xx for: {", ".join(failing)}')
+
+
+# One simulated user: its token and what it has liked and followed so far
+class Client:
+    def __init__(self, user_id, token):
+        self.user_id = user_id
+        self.token = token
+        self.liked = set()
+        self.following = set()
+
+
+class Command(BaseCommand):
+    help = 'Replay a weighted request mix through the WSGI handler and report latency and queries per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--follows', type=int, default=20, help='Accounts followed per user')
+        parser.add_argument('--posts', type=int, default=5, help='Posts per user')
+        parser.add_argument('--comments', type=int, default=3, help='Comments per post')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=2000, help='Measured requests, over all threads')
+        parser.add_argument('--warmup', type=int, default=100, help='Requests issued before measuring')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Endpoint weights, default "{DEFAULT_MIX}"')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded data')
+
+    def handle(self, *args, **options):
+        if options['users'] < options['threads'] * 2:
+            raise CommandError('--users must be at least twice --threads')
+        self.mix = parse_mix(options['mix'])
+        rng = random.Random(options['seed'])
+
+        started = time.perf_counter()
+        clients, post_ids = self.seed(rng, options)
+        self.stdout.write(f'Seeded {len(clients)} users and {len(post_ids)} posts in {time.perf_counter() - started:.1f} s')
+
+        self.post_ids = post_ids
+        self.user_ids = [client.user_id for client in clients]
+        # Failed requests are counted in the report rather than logged one by one
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            # The requests arrive over plain http, so the HTTPS redirect is off or every one would be a 301
+            with override_settings(ALLOWED_HOSTS=['*'], SECURE_SSL_REDIRECT=False):
+                # Built under the overrides, since SecurityMiddleware reads its settings once
+                self.handler = WSGIHandler()
+                groups = [clients[number::options['threads']] for number in range(options['threads'])]
+                check_responses(self.run(groups, options['warmup'], options['seed'] + 1)[1])
+                elapsed, samples = self.run(groups, options['requests'], options['seed'] + 2)
+                check_responses(samples)
+        finally:
+            request_logger.setLevel(level)
+            close_old_connections()
+            if not options['keep']:
+                get_user_model().objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+        results = self.summarize(elapsed, samples)
+        self.report(results)
+        if options['output']:
+            document = {
+                'commit': git_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'options': {name: options[name] for name in ('users', 'follows', 'posts', 'comments', 'threads',
+                                                              'requests', 'warmup', 'mix', 'seed')},
+                **results,
+            }
+            with open(options['output'], 'w') as output:
+                json.dump(document, output, indent=2)
+            self.stdout.write(f'Wrote {options["output"]}')
+
+    @transaction.atomic
+    def seed(self, rng, options):
+        User = get_user_model()
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        users = User.objects.bulk_create([User(username=f'{USERNAME_PREFIX}{number}', password='!')
+                                          for number in range(options['users'])])
+        tokens = Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])
+
+        Follow = User.following.through
+        following = {}
+        for user in users:
+            targets = rng.sample([other.pk for other in users if other.pk != user.pk], min(options['follows'], len(users) - 1))
+            following[user.pk] = set(targets)
+        Follow.objects.bulk_create([Follow(from_customuser_id=user_id, to_customuser_id=target)
+                                    for user_id, targets in following.items() for target in targets])
+        recount_follow_counts(User.objects.filter(username__startswith=USERNAME_PREFIX))
+
+        posts = []
+        for user in users:
+            for number in range(options['posts']):
+                posts.append(Post(author=user, title=f'Post {number} by {user.username}',
+                                  content=f'Benchmark post {number} with a few words of content.'))
+        posts = Post.objects.bulk_create(posts)
+        for post in posts:
+            fan_out_post(post)
+
+        Comment.objects.bulk_create([Comment(post=post, author=rng.choice(users), content='Benchmark comment')
+                                     for post in posts for _ in range(options['comments'])])
+        Post.objects.filter(pk__in=[post.pk for post in posts]).update(comment_count=options['comments'])
+
+        likes = {(rng.choice(users).pk, rng.choice(posts).pk) for _ in range(len(posts) * 2)}
+        Like.objects.bulk_create([Like(user_id=user_id, post_id=post_id) for user_id, post_id in likes])
+        per_post = defaultdict(int)
+        for _, post_id in likes:
+            per_post[post_id] += 1
+        for post_id, count in per_post.items():
+            Post.objects.filter(pk=post_id).update(like_count=count)
+        authors = {post.pk: post.author_id for post in posts}
+        Notification.objects.bulk_create([Notification(recipient_id=authors[post_id], actor_id=user_id,
+                                                       verb='liked your post', target_id=post_id)
+                                          for user_id, post_id in likes])
+
+        clients = []
+        for user, token in zip(users, tokens):
+            client = Client(user.pk, token.key)
+            client.liked = {post_id for user_id, post_id in likes if user_id == user.pk}
+            client.following = following[user.pk]
+            clients.append(client)
+        return clients, [post.pk for post in posts]
+
+    def call(self, client, method, path, body=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'bench',
+            'SERVER_PORT': '80', 'HTTP_HOST': 'bench', 'HTTP_AUTHORIZATION': f'Token {client.token}',
+            'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(payload)),
+            'wsgi.input': BytesIO(payload), 'wsgi.url_scheme': 'http', 'wsgi.errors': BytesIO(),
+        }
+        statuses = []
+        response = self.handler(environ, lambda status, headers: statuses.append(status))
+        b''.join(response)
+        response.close()
+        return int(statuses[0].split()[0])
+
+    # Picks the next request for a client: (endpoint name, method, path, body)
+    def next_request(self, rng, client):
+        endpoint = rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if endpoint == 'feed':
+            return 'feed', 'GET', '/api/feed/', None
+        if endpoint == 'list':
+            return 'posts:list', 'GET', '/api/posts/', None
+        if endpoint == 'retrieve':
+            return 'posts:retrieve', 'GET', f'/api/posts/{rng.choice(self.post_ids)}/', None
+        if endpoint == 'like':
+            post_id = rng.choice(self.post_ids)
+            if post_id in client.liked:
+                client.liked.discard(post_id)
+                return 'unlike', 'POST', f'/api/posts/{post_id}/unlike/', None
+            client.liked.add(post_id)
+            return 'like', 'POST', f'/api/posts/{post_id}/like/', None
+        if endpoint == 'follow':
+            user_id = rng.choice(self.user_ids)
+            while user_id == client.user_id:
+                user_id = rng.choice(self.user_ids)
+            if user_id in client.following:
+                client.following.discard(user_id)
+                return 'unfollow', 'POST', f'/api/unfollow/{user_id}/', None
+            client.following.add(user_id)
+            return 'follow', 'POST', f'/api/follow/{user_id}/', None
+        if endpoint == 'comment':
+            return 'comment', 'POST', '/api/comments/', {'post': rng.choice(self.post_ids), 'content': 'Benchmark reply'}
+        return 'notifications', 'GET', '/api/notifications/', None
+
+    def run(self, groups, total, seed):
+        per_thread = [total // len(groups) + (1 if number < total % len(groups) else 0) for number in range(len(groups))]
+
+        def worker(number):
+            rng = random.Random(seed * 1000 + number)
+            clients = groups[number]
+            queries = [0]
+
+            def count(execute, sql, params, many, context):
+                queries[0] += 1
+                return execute(sql, params, many, context)
+
+            samples = []
+            with connection.execute_wrapper(count):
+                for _ in range(per_thread[number]):
+                    client = rng.choice(clients)
+                    name, method, path, body = self.next_request(rng, client)
+                    queries[0] = 0
+                    started = time.perf_counter()
+                    status = self.call(client, method, path, body)
+                    samples.append((name, time.perf_counter() - started, queries[0], status))
+            close_old_connections()
+            return samples
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            samples = [sample for chunk in pool.map(worker, range(len(groups))) for sample in chunk]
+        return time.perf_counter() - started, samples
+
+    def summarize(self, elapsed, samples):
+        by_endpoint = defaultdict(list)
+        for sample in samples:
+            by_endpoint[sample[0]].append(sample)
+
+        def stats(rows):
+            latencies = [latency for _, latency, _, _ in rows]
+            return {
+                'requests': len(rows),
+                'errors': sum(1 for *_, status in rows if not is_success(status)),
+                'rps': round(len(rows) / elapsed, 1),
+                'p50_ms': round(statistics.median(latencies) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+                'queries_per_request': round(sum(queries for _, _, queries, _ in rows) / len(rows), 2),
+            }
+
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'endpoints': {name: stats(rows) for name, rows in sorted(by_endpoint.items())},
+            'total': stats(samples),
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"endpoint":16}{"requests":>9}{"errors":>8}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}')
+        rows = list(results['endpoints'].items()) + [('total', results['total'])]
+        for name, row in rows:
+            self.stdout.write(f'{name:16}{row["requests"]:>9}{row["errors"]:>8}{row["rps"]:>9.1f}{row["p50_ms"]:>9.2f}'
+                              f'{row["p95_ms"]:>9.2f}{row["p99_ms"]:>9.2f}{row["queries_per_request"]:>9.2f}')
@@ -0,0 +1,207 @@
+"""
+Benchmark like/unlike/follow/unfollow throughput of the sync views under WSGI
+against the async views under ASGI.
+
+Creates throwaway users and posts, then drives the Django handlers in
+process: WSGI requests come from a thread pool with --concurrency threads
+(one request per thread at a time, like a threaded WSGI server) and ASGI
+requests are --concurrency coroutines on one event loop. Every client cycles
+through like, unlike, follow and unfollow on posts of its own and a shared
+author, so every request writes.
+Sync views under ASGI are measured too, for reference. The benchmark data is
+deleted at the end.
+
+SQLite serialises writers, so run it against the database the deployment
+uses for meaningful numbers.
+
+Usage: python manage.py bench_async --concurrency 32 --requests 2000
+"""
+
+import asyncio
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import override_settings
+from django.urls import path
+from rest_framework.authtoken.models import Token
+
+from accounts.async_views import AsyncFollowView, AsyncUnfollowView
+from accounts.views import FollowView, UnfollowView
+from posts.async_views import AsyncLikePostView, AsyncUnlikePostView
+from posts.models import Post, Like
+from posts.views import LikePostView, UnlikePostView
+
+USERNAME_PREFIX = 'bench_async_'
+
+# Both sets of views, mounted side by side while the benchmark runs
+urlpatterns = [
+    path('sync/posts/<int:pk>/like/', LikePostView.as_view()),
+    path('sync/posts/<int:pk>/unlike/', UnlikePostView.as_view()),
+    path('sync/follow/<int:pk>/', FollowView.as_view()),
+    path('sync/unfollow/<int:pk>/', UnfollowView.as_view()),
+    path('async/posts/<int:pk>/like/', AsyncLikePostView.as_view()),
+    path('async/posts/<int:pk>/unlike/', AsyncUnlikePostView.as_view()),
+    path('async/follow/<int:pk>/', AsyncFollowView.as_view()),
+    path('async/unfollow/<int:pk>/', AsyncUnfollowView.as_view()),
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def is_success(status):
+    return 200 <= status < 300
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent throughput of the sync (WSGI) and async (ASGI) like/unlike/follow views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per mode')
+        parser.add_argument('--posts-per-client', type=int, default=20)
+
+    def handle(self, *args, **options):
+        author_id, clients = self.seed(options['concurrency'], options['posts_per_client'])
+        Follow = get_user_model().following.through
+        per_client = max(1, options['requests'] // len(clients))
+        # Failed requests are counted in the report rather than logged one by one
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            # The requests arrive over plain http, so the HTTPS redirect is off or every one would be a 301
+            with override_settings(ROOT_URLCONF=__name__, ALLOWED_HOSTS=['*'], SECURE_SSL_REDIRECT=False,
+                                   LIKE_WRITE_BEHIND=False):
+                for label, server, prefix in (('sync views, WSGI', 'wsgi', 'sync'),
+                                              ('sync views, ASGI', 'asgi', 'sync'),
+                                              ('async views, ASGI', 'asgi', 'async')):
+                    # Start every mode from no likes or follows, whatever failed in the previous one
+                    Like.objects.filter(user__username__startswith=USERNAME_PREFIX).delete()
+                    Follow.objects.filter(from_customuser__username__startswith=USERNAME_PREFIX).delete()
+                    plans = [self.plan(token, post_ids, author_id, prefix, per_client) for token, post_ids in clients]
+                    run = self.run_wsgi if server == 'wsgi' else self.run_asgi
+                    started = time.perf_counter()
+                    latencies, statuses = run(plans)
+                    if not is_success(statuses[0]):
+                        raise CommandError(f'{label}: first response was {statuses[0]}, not a 2xx')
+                    self.report(label, time.perf_counter() - started, latencies, statuses)
+        finally:
+            request_logger.setLevel(level)
+            close_old_connections()
+            get_user_model().objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def seed(self, concurrency, posts_per_client):
+        User = get_user_model()
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        author = User.objects.create_user(username=f'{USERNAME_PREFIX}author', password='x')
+        clients = []
+        for number in range(concurrency):
+            user = User.objects.create_user(username=f'{USERNAME_PREFIX}{number}', password='x')
+            posts = Post.objects.bulk_create([Post(author=author, title=f'bench {number}.{i}', content='bench')
+                                              for i in range(posts_per_client)])
+            clients.append((Token.objects.create(user=user).key, [post.pk for post in posts]))
+        return author.pk, clients
+
+    def plan(self, token, post_ids, author_id, prefix, count):
+        # like p1, unlike p1, follow, unfollow, like p2, ... so that every request changes a row
+        requests = []
+        for i in range(count):
+            post_id = post_ids[(i // 4) % len(post_ids)]
+            step = (f'posts/{post_id}/like', f'posts/{post_id}/unlike', f'follow/{author_id}', f'unfollow/{author_id}')[i % 4]
+            requests.append((f'/{prefix}/{step}/', token))
+        return requests
+
+    def run_wsgi(self, plans):
+        handler = WSGIHandler()
+
+        def call(request_path, token):
+            environ = {
+                'REQUEST_METHOD': 'POST', 'PATH_INFO': request_path, 'QUERY_STRING': '', 'SERVER_NAME': 'bench',
+                'SERVER_PORT': '80', 'HTTP_HOST': 'bench', 'HTTP_AUTHORIZATION': f'Token {token}',
+                'CONTENT_LENGTH': '0', 'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': BytesIO(),
+            }
+            statuses = []
+            response = handler(environ, lambda status, headers: statuses.append(status))
+            b''.join(response)
+            response.close()
+            return int(statuses[0].split()[0])
+
+        def client(plan):
+            results = []
+            for request_path, token in plan:
+                started = time.perf_counter()
+                code = call(request_path, token)
+                results.append((time.perf_counter() - started, code))
+            close_old_connections()
+            return results
+
+        with ThreadPoolExecutor(max_workers=len(plans)) as pool:
+            results = [item for chunk in pool.map(client, plans) for item in chunk]
+        return [latency for latency, _ in results], [code for _, code in results]
+
+    def run_asgi(self, plans):
+        handler = ASGIHandler()
+
+        async def call(request_path, token):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+                'scheme': 'http', 'path': request_path, 'raw_path': request_path.encode(), 'query_string': b'',
+                'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('bench', 80),
+                'headers': [(b'host', b'bench'), (b'authorization', f'Token {token}'.encode())],
+            }
+            disconnect = asyncio.Event()
+            sent_body = False
+
+            async def receive():
+                nonlocal sent_body
+                if not sent_body:
+                    sent_body = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            codes = []
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    codes.append(message['status'])
+
+            await handler(scope, receive, send)
+            disconnect.set()
+            return codes[0]
+
+        async def client(plan):
+            results = []
+            for request_path, token in plan:
+                started = time.perf_counter()
+                code = await call(request_path, token)
+                results.append((time.perf_counter() - started, code))
+            return results
+
+        async def main():
+            return await asyncio.gather(*(client(plan) for plan in plans))
+
+        results = [item for chunk in async_to_sync(main)() for item in chunk]
+        return [latency for latency, _ in results], [code for _, code in results]
+
+    def report(self, label, elapsed, latencies, statuses):
+        errors = sum(1 for code in statuses if not is_success(code))
+        self.stdout.write(
+            f'{label:18} {len(latencies) / elapsed:8.1f} req/s   '
+            f'p50 {statistics.median(latencies) * 1000:7.2f} ms   '
+            f'p95 {percentile(latencies, 95) * 1000:7.2f} ms   '
+            f'p99 {percentile(latencies, 99) * 1000:7.2f} ms   '
+            f'errors {errors}/{len(statuses)}'
+        )
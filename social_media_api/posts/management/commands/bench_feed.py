@@ -0,0 +1,107 @@
+"""
+Benchmark the home feed in push-only and hybrid push/pull mode.
+
+Seeds a synthetic follow graph where follower counts follow a power law,
+publishes posts from authors picked by popularity and reads feeds for random
+users. For each mode it reports the timeline rows written per post (write
+amplification) and the feed read latency.
+
+Everything runs inside a transaction that is rolled back, so the database is
+left untouched.
+
+Usage: python manage.py bench_feed --users 5000 --posts 500 --threshold 200
+"""
+
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+
+from accounts.counters import recount_follow_counts
+from posts.feed import fan_out_post, read_feed
+from posts.models import Post
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Compare write amplification and read latency of push-only and hybrid feeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--follows', type=int, default=30, help='Average accounts followed per user')
+        parser.add_argument('--alpha', type=float, default=1.1, help='Power-law exponent of author popularity')
+        parser.add_argument('--posts', type=int, default=300)
+        parser.add_argument('--reads', type=int, default=300)
+        parser.add_argument('--threshold', type=int, default=100, help='Follower threshold for the hybrid mode')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            users, weights = self.seed_graph(rng, options)
+            for mode, threshold in (('push', 0), ('hybrid', options['threshold'])):
+                savepoint = transaction.savepoint()
+                with override_settings(FEED_FANOUT_THRESHOLD=threshold):
+                    cache.clear()
+                    self.run_mode(mode, threshold, rng, users, weights, options)
+                transaction.savepoint_rollback(savepoint)
+            transaction.set_rollback(True)
+
+    def seed_graph(self, rng, options):
+        User = get_user_model()
+        count = options['users']
+        prefix = f'bench{rng.randrange(10 ** 6)}_'
+        User.objects.bulk_create(
+            [User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password='!') for i in range(count)],
+            batch_size=1000,
+        )
+        users = list(User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', flat=True))
+        # Popularity of the i-th user is proportional to 1 / i^alpha
+        weights = [1 / (rank + 1) ** options['alpha'] for rank in range(count)]
+
+        Follow = User.following.through
+        edges = []
+        for follower in users:
+            k = max(1, int(rng.expovariate(1 / options['follows'])))
+            for followee in set(rng.choices(users, weights=weights, k=k)):
+                if followee != follower:
+                    edges.append(Follow(from_customuser_id=follower, to_customuser_id=followee))
+        Follow.objects.bulk_create(edges, batch_size=5000, ignore_conflicts=True)
+        recount_follow_counts(User.objects.filter(username__startswith=prefix))
+
+        top = [Follow.objects.filter(to_customuser_id=user_id).count() for user_id in users[:5]]
+        self.stdout.write(f'Seeded {count} users and {len(edges)} follows, top follower counts: {top}')
+        return users, weights
+
+    def run_mode(self, mode, threshold, rng, users, weights, options):
+        authors = rng.choices(users, weights=weights, k=options['posts'])
+        written = 0
+        started = time.perf_counter()
+        for i, author_id in enumerate(authors):
+            post = Post.objects.create(author_id=author_id, title=f'Post {i}', content='benchmark')
+            written += fan_out_post(post)
+        write_seconds = time.perf_counter() - started
+
+        User = get_user_model()
+        readers = list(User.objects.filter(id__in=rng.sample(users, min(options['reads'], len(users)))))
+        latencies = []
+        for reader in readers:
+            started = time.perf_counter()
+            read_feed(reader, 20)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        self.stdout.write(self.style.SUCCESS(f'[{mode}] threshold={threshold}'))
+        self.stdout.write(f'  timeline rows written: {written} ({written / len(authors):.1f} per post)')
+        self.stdout.write(f'  write time: {write_seconds * 1000 / len(authors):.2f} ms per post')
+        self.stdout.write(f'  read latency: p50={percentile(latencies, 50):.2f} ms '
+                          f'p95={percentile(latencies, 95):.2f} ms p99={percentile(latencies, 99):.2f} ms '
+                          f'mean={statistics.mean(latencies):.2f} ms')
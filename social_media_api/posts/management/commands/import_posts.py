@@ -0,0 +1,262 @@
+"""
+Stream posts or comments into the database with bulk inserts.
+
+Reads JSON lines or CSV from a file or stdin ("-") and writes rows with
+bulk_create in batches, committing every few batches. Input is read one row
+at a time and authors are resolved by username through a bounded cache (one
+query per batch for the names it has not seen), so memory use stays flat no
+matter how large the input is.
+
+Post rows:    {"id": 1, "author": "alice", "title": "...", "content": "...", "created_at": "2024-01-01T10:00:00Z"}
+Comment rows: {"id": 7, "post": 1, "author": "bob", "content": "...", "created_at": "..."}
+
+"id" and "created_at" are optional. Keeping the ids of the old platform lets
+comments reference imported posts without a mapping table. Rows with an
+unknown author or post are skipped and counted, and so are invalid rows (a
+line that is not a JSON object, an id or post that is not an integer, a
+created_at that is not an ISO 8601 time, a missing title or non-text fields).
+
+Imported posts are fanned out to their followers' timelines batch by batch
+(see posts.feed.fan_out_posts), so they show up in /api/feed/. Bulk inserts
+send no signals: run `rebuild_search_index` once the import is done to index
+the new posts. Comment counters are updated as comments are imported.
+
+Usage: python manage.py import_posts posts.jsonl
+       gunzip -c comments.csv.gz | python manage.py import_posts - --kind comments --format csv
+"""
+
+import csv
+import io
+import json
+import sys
+import time
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts.cache import bump_all
+from posts.feed import fan_out_posts
+from posts.models import Post, Comment
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def integer(value, name):
+    # JSON numbers arrive as int, CSV cells as str; bool is an int too but never an id
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise InvalidRow(name)
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidRow(name)
+
+
+def text(value, name, required=False):
+    if value is None and not required:
+        return ''
+    if not isinstance(value, str) or (required and not value.strip()):
+        raise InvalidRow(name)
+    return value
+
+
+def timestamp(value, default):
+    if not value:
+        return default
+    value = text(value, 'created_at')
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:  # well formed but out of range, e.g. month 13
+        parsed = None
+    if parsed is None:
+        raise InvalidRow('created_at')
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+class UsernameCache:
+    """Bounded LRU of username -> user id."""
+
+    def __init__(self, size):
+        self.size = size
+        self.ids = OrderedDict()
+
+    def resolve(self, usernames):
+        missing = {name for name in usernames if name not in self.ids}
+        if missing:
+            found = dict(get_user_model().objects.filter(username__in=missing).values_list('username', 'id'))
+            for name in missing:
+                self.ids[name] = found.get(name)
+        resolved = {}
+        for name in usernames:
+            self.ids.move_to_end(name)
+            resolved[name] = self.ids[name]
+        while len(self.ids) > self.size:
+            self.ids.popitem(last=False)
+        return resolved
+
+
+@contextmanager
+def keep_timestamps(model):
+    # bulk_create honours auto_now/auto_now_add, which would overwrite the imported timestamps
+    fields = [field for field in model._meta.concrete_fields if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Bulk import posts or comments from JSON lines or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file, or - for stdin')
+        parser.add_argument('--kind', choices=['posts', 'comments'], default='posts')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='Defaults to the file extension, jsonl for stdin')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT')
+        parser.add_argument('--batches-per-transaction', type=int, default=10)
+        parser.add_argument('--author-cache-size', type=int, default=100000)
+        parser.add_argument('--report-every', type=float, default=5.0, help='Seconds between progress lines')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8') if path == '-' else open(path, encoding='utf-8', newline='')
+        self.model = Post if options['kind'] == 'posts' else Comment
+        self.authors = UsernameCache(options['author_cache_size'])
+        self.stats = Counter()
+        self.started = self.last_report = time.perf_counter()
+        self.report_every = options['report_every']
+
+        batch_size = options['batch_size']
+        per_transaction = options['batches_per_transaction']
+        try:
+            with keep_timestamps(self.model):
+                batches = self.batches(self.rows(stream, fmt), batch_size)
+                while True:
+                    with transaction.atomic():
+                        done = 0
+                        for batch in batches:
+                            self.write(batch)
+                            done += 1
+                            if done == per_transaction:
+                                break
+                    self.report()
+                    if done < per_transaction:
+                        break
+        finally:
+            if path != '-':
+                stream.close()
+        bump_all()
+        self.report(final=True)
+
+    def rows(self, stream, fmt):
+        if fmt == 'csv':
+            yield from csv.DictReader(stream)
+            return
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield None  # counted as invalid
+
+    def batches(self, rows, size):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def clean(self, row, now):
+        # Model fields of a row, with the author still a username; raises InvalidRow
+        if not isinstance(row, dict):
+            raise InvalidRow('row')
+        created_at = timestamp(row.get('created_at'), now)
+        fields = {'author': text(row.get('author'), 'author'), 'content': text(row.get('content'), 'content'),
+                  'created_at': created_at, 'updated_at': created_at}
+        if row.get('id') not in (None, ''):
+            fields['id'] = integer(row['id'], 'id')
+        if self.model is Post:
+            fields['title'] = text(row.get('title'), 'title', required=True)[:255]
+        else:
+            fields['post_id'] = integer(row.get('post'), 'post')
+        return fields
+
+    def write(self, rows):
+        now = timezone.now()
+        cleaned = []
+        for row in rows:
+            try:
+                cleaned.append(self.clean(row, now))
+            except InvalidRow:
+                self.stats['skipped_invalid'] += 1
+        authors = self.authors.resolve({fields['author'] for fields in cleaned})
+        if self.model is Comment:
+            existing = set(Post.objects.filter(pk__in={fields['post_id'] for fields in cleaned}).values_list('pk', flat=True))
+
+        objects = []
+        for fields in cleaned:
+            fields['author_id'] = authors.get(fields.pop('author'))
+            if fields['author_id'] is None:
+                self.stats['skipped_author'] += 1
+                continue
+            if self.model is Comment and fields['post_id'] not in existing:
+                self.stats['skipped_post'] += 1
+                continue
+            objects.append(self.model(**fields))
+
+        # MySQL does not hand back the ids of bulk-inserted rows; those posts are then
+        # the ones past the highest id before the insert
+        last_id = None
+        if self.model is Post and not connection.features.can_return_rows_from_bulk_insert:
+            last_id = Post.all_objects.aggregate(last=Max('pk'))['last'] or 0
+        self.model.objects.bulk_create(objects)
+        self.stats['imported'] += len(objects)
+        if self.model is Comment:
+            self.update_comment_counts(objects)
+        elif objects:
+            self.fan_out(objects, last_id)
+
+    def fan_out(self, posts, last_id):
+        if any(post.pk is None for post in posts):
+            known = {post.pk for post in posts if post.pk is not None}
+            posts = [post for post in posts if post.pk is not None] + list(
+                Post.all_objects.filter(pk__gt=last_id).exclude(pk__in=known).only('id', 'author_id', 'created_at'))
+        self.stats['timeline_rows'] += fan_out_posts(posts)
+
+    def update_comment_counts(self, comments):
+        # One UPDATE per distinct increment, most batches only need one or two
+        per_post = Counter(comment.post_id for comment in comments)
+        by_increment = defaultdict(list)
+        for post_id, count in per_post.items():
+            by_increment[count].append(post_id)
+        for count, post_ids in by_increment.items():
+            Post.objects.filter(pk__in=post_ids).update(comment_count=F('comment_count') + count)
+
+    def report(self, final=False):
+        now = time.perf_counter()
+        if not final and now - self.last_report < self.report_every:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        line = (f'{self.stats["imported"]} {self.model._meta.verbose_name_plural} imported '
+                f'({self.stats["imported"] / elapsed:.0f} rows/s), '
+                f'skipped: {self.stats["skipped_author"]} unknown author, {self.stats["skipped_post"]} unknown post, '
+                f'{self.stats["skipped_invalid"]} invalid')
+        self.stdout.write(self.style.SUCCESS(line) if final else line)
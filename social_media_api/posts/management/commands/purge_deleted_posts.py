@@ -0,0 +1,36 @@
+"""
+Remove soft-deleted posts together with their comments, likes,
+notifications and feed entries, in bounded batches.
+
+Run it periodically (e.g. every minute from cron), or keep it running as a
+small in-process scheduler with --loop.
+
+Usage: python manage.py purge_deleted_posts [--batch-size 1000] [--loop --interval 30]
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from posts.purge import BATCH_SIZE, purge_deleted_posts
+
+
+class Command(BaseCommand):
+    help = 'Purge soft-deleted posts and the rows that reference them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows deleted per transaction')
+        parser.add_argument('--limit', type=int, help='Posts purged per run')
+        parser.add_argument('--loop', action='store_true', help='Keep purging every --interval seconds')
+        parser.add_argument('--interval', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            posts, rows = purge_deleted_posts(options['batch_size'], options['limit'])
+            self.stdout.write(f'Purged {posts} posts ({rows} rows) in {(time.perf_counter() - started) * 1000:.0f} ms')
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(max(0.0, options['interval'] - (time.perf_counter() - started)))
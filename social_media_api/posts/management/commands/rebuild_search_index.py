@@ -0,0 +1,72 @@
+"""
+Rebuild the full-text search index for all posts.
+
+New and edited posts are indexed by signals; run this after loading posts
+without signals (e.g. bulk imports) or to recompute the BM25 weights once the
+corpus has grown. Posts are streamed in batches and written with bulk inserts,
+so memory use does not depend on the number of posts.
+
+Usage: python manage.py rebuild_search_index [--batch-size 1000]
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from posts.models import Post, SearchTerm, SearchPosting, SearchStats
+from posts.search import term_positions, term_ids, build_postings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started = time.perf_counter()
+        posts = Post.objects.only('id', 'title', 'content').order_by('id')
+
+        # First pass: corpus statistics, needed for the length normalisation of every weight
+        doc_count = total_length = 0
+        for post in posts.iterator(chunk_size=batch_size):
+            _, length = term_positions(post)
+            if length:
+                doc_count += 1
+                total_length += length
+        avg_length = total_length / max(doc_count, 1)
+
+        SearchPosting.objects.all().delete()
+        SearchStats.objects.update_or_create(pk=1, defaults={'doc_count': doc_count, 'total_length': total_length})
+
+        # Second pass: postings, written one batch of posts at a time
+        batch = []
+        for post in posts.iterator(chunk_size=batch_size):
+            batch.append(post)
+            if len(batch) >= batch_size:
+                self.index_batch(batch, avg_length)
+                batch = []
+        if batch:
+            self.index_batch(batch, avg_length)
+
+        # Document frequencies in one statement, then drop terms nothing refers to anymore
+        postings = SearchPosting.objects.filter(term=OuterRef('pk')).order_by().values('term').annotate(total=Count('id')).values('total')
+        SearchTerm.objects.update(doc_count=Coalesce(Subquery(postings), Value(0)))
+        SearchTerm.objects.filter(doc_count=0).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {doc_count} posts in {time.perf_counter() - started:.1f}s'
+        ))
+
+    @transaction.atomic
+    def index_batch(self, posts, avg_length):
+        indexed = [(post, *term_positions(post)) for post in posts]
+        ids = term_ids(list({text for _, positions, _ in indexed for text in positions}))
+        postings = []
+        for post, positions, length in indexed:
+            postings.extend(build_postings(post, positions, length, avg_length, ids))
+        SearchPosting.objects.bulk_create(postings, batch_size=1000)
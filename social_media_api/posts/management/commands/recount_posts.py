@@ -0,0 +1,43 @@
+"""
+Recompute the denormalised like_count and comment_count columns of posts.
+
+The counters are kept up to date with F() expressions by the like and comment
+views; this command repairs any drift (e.g. after rows were removed directly
+in the database). Posts are updated in primary key ranges with one UPDATE per
+batch, so no post rows are loaded into memory.
+
+Usage: python manage.py recount_posts [--batch-size 5000]
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from posts.cache import bump_all
+from posts.models import Post, Like, Comment
+
+
+def count_subquery(model):
+    counts = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(counts), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Recompute like_count and comment_count for all posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Post.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        updated = 0
+        for start in range(0, last_id, batch_size):
+            with transaction.atomic():
+                updated += Post.objects.filter(id__gt=start, id__lte=start + batch_size).update(
+                    like_count=count_subquery(Like),
+                    comment_count=count_subquery(Comment),
+                )
+                bump_all()
+        self.stdout.write(self.style.SUCCESS(f'Recounted likes and comments for {updated} posts'))
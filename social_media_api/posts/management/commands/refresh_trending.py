@@ -0,0 +1,34 @@
+"""
+Refresh the trending posts table from the likes and comments added since the
+last run.
+
+Run it periodically (e.g. every minute from cron), or keep it running as a
+small in-process scheduler with --loop.
+
+Usage: python manage.py refresh_trending [--loop --interval 60]
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from posts.trending import refresh_trending
+
+
+class Command(BaseCommand):
+    help = 'Incrementally refresh trending post scores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep refreshing every --interval seconds')
+        parser.add_argument('--interval', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            updated = refresh_trending()
+            self.stdout.write(f'Updated {updated} trending posts in {(time.perf_counter() - started) * 1000:.0f} ms')
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(max(0.0, options['interval'] - (time.perf_counter() - started)))
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+# Existing likes have no time of their own. Dating them at migration time would make
+# the first refresh_trending count every one of them as fresh, so they take the time
+# of their post: the earliest they can have happened.
+def backfill_like_times(apps, schema_editor):
+    Like = apps.get_model("posts", "Like")
+    Post = apps.get_model("posts", "Post")
+    Like.objects.update(
+        created_at=Subquery(Post.objects.filter(pk=OuterRef("post_id")).values("created_at")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0007_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrendingPost",
+            fields=[
+                (
+                    "post",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="trending",
+                        serialize=False,
+                        to="posts.post",
+                    ),
+                ),
+                ("score", models.FloatField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="TrendingState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("epoch", models.DateTimeField()),
+                ("last_like_id", models.BigIntegerField(default=0)),
+                ("last_comment_id", models.BigIntegerField(default=0)),
+                ("refreshed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="like",
+            name="created_at",
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_like_times, migrations.RunPython.noop),
+    ]
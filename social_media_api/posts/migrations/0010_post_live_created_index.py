@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0009_post_soft_delete"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="post",
+            name="post_created_idx",
+        ),
+        migrations.AlterField(
+            model_name="post",
+            name="deleted_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["deleted_at", "created_at", "id"], name="post_live_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:12
+
+import posts.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0011_hot_path_indexes"),
+    ]
+
+    operations = [
+        # Binary on MySQL only (see posts.models.search_term_collation)
+        migrations.AlterField(
+            model_name="searchterm",
+            name="text",
+            field=models.CharField(
+                db_collation=posts.models.search_term_collation(),
+                max_length=64,
+                unique=True,
+            ),
+        ),
+    ]
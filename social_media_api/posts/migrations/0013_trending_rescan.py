@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0012_search_term_collation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trendingstate",
+            name="recent_comment_ids",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="trendingstate",
+            name="recent_like_ids",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
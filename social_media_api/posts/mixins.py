@@ -0,0 +1,105 @@
+import hashlib
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max, Sum
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+from . import cache as response_cache
+
+# Conditional GET for list and retrieve.
+# A strong ETag is built from one aggregate query over the rows the response
+# would contain (the requested page for lists): the newest `updated_at`, the row
+# count and id sum (catches rows entering or leaving the page) and the sums of
+# `conditional_sum_fields` (counters that change without touching updated_at).
+# If-None-Match is answered with 304 before anything is serialized. No
+# Last-Modified is sent: likes, comments and soft deletes change the response
+# without moving the newest updated_at, so If-Modified-Since would serve stale data.
+class ConditionalGetMixin:
+    conditional_sum_fields = ()
+
+    def get_version(self, queryset):
+        aggregates = {'last_modified': Max('updated_at'), 'rows': Count('pk'), 'ids': Sum('pk')}
+        aggregates.update({name: Sum(name) for name in self.conditional_sum_fields})
+        return queryset.aggregate(**aggregates)
+
+    def get_etag(self, request, version):
+        # The representation depends on the viewer (e.g. has_liked) and on the query parameters
+        user_id = request.user.pk if request.user.is_authenticated else 0
+        fingerprint = repr((request.get_full_path(), user_id, sorted(version.items(), key=lambda item: item[0])))
+        return quote_etag(hashlib.sha1(fingerprint.encode()).hexdigest())
+
+    def conditional_response(self, request, version, render):
+        etag = self.get_etag(request, version)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = render()
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        paginator = self.paginator
+        window = paginator.get_window(queryset, request, self) if hasattr(paginator, 'get_window') else queryset
+
+        def render():
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                return self.get_paginated_response(self.get_serializer(page, many=True).data)
+            return Response(self.get_serializer(queryset, many=True).data)
+
+        return self.conditional_response(request, self.get_version(window), render)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = {self.lookup_field: kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        # A lookup value of the wrong type (e.g. /posts/abc/) is a 404, as in DRF's get_object_or_404
+        try:
+            version = self.get_version(self.filter_queryset(self.get_queryset()).filter(**lookup))
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        if not version['rows']:
+            return super().retrieve(request, *args, **kwargs)  # 404 as usual
+        return self.conditional_response(request, version, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
+
+
+# Serves list and retrieve from the versioned response cache (see posts.cache).
+# Only JSON responses are cached; entries keep their ETag so cached hits can
+# still be answered with 304 without touching the database.
+class CachedResponseMixin:
+
+    def cached_response(self, request, kind, version_names, compute):
+        if request.accepted_renderer.format != 'json' or not response_cache.enabled():
+            return compute()
+        key = response_cache.response_key(kind, response_cache.get_versions(version_names), request)
+        cache = response_cache.get_cache()
+        entry = cache.get(key)
+        if entry is not None:
+            response_cache.record('hits')
+            content, content_type, etag = entry
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = HttpResponse(content, content_type=content_type)
+            if etag:
+                response['ETag'] = etag
+            patch_vary_headers(response, ['Authorization'])
+            return response
+
+        response_cache.record('misses')
+        response = compute()
+        if response.status_code == 200 and isinstance(response, Response):
+            response = self.finalize_response(request, response)
+            response.render()
+            cache.set(key, (response.content, response['Content-Type'], response.get('ETag')),
+                      response_cache.RESPONSE_TIMEOUT)
+            response_cache.record('stores')
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, 'list', ['all', 'list'],
+                                    lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.cached_response(request, 'detail', ['all', response_cache.post_version(pk)],
+                                    lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
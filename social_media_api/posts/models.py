@@ -1,5 +1,12 @@
-from django.db import models
+from django.db import connection, models
 from django.conf import settings
+from django.utils import timezone
+
+# Soft-deleted posts (deleted_at set) are hidden everywhere the default manager
+# is used; relations such as comment.post still resolve through the base manager
+class LivePostManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
 
 # Create your models here.
 class Post(models.Model):
@@ -8,9 +15,33 @@ class Post(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalised counters, updated with F() expressions by the like/comment views
+    # (recount with `manage.py recount_posts`)
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # Set when the post is deleted; `manage.py purge_deleted_posts` removes it later
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LivePostManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # Keyset pagination walks this index newest first. deleted_at leads so that
+        # live posts (deleted_at IS NULL) stay one ordered range, and the purger
+        # finds deleted posts with a range scan on the same index.
+        indexes = [
+            models.Index(fields=['deleted_at', 'created_at', 'id'], name='post_live_created_idx'),
+            # Profile timelines and the per-author recent posts of the feed
+            models.Index(fields=['author', 'deleted_at', 'created_at', 'id'], name='post_author_live_idx'),
+        ]
 
     def __str__(self):
         return f'Post by {self.author.username} at {self.created_at}'
+
+    # Constant-time delete: one UPDATE, whatever the engagement of the post
+    def soft_delete(self):
+        self.deleted_at = timezone.now()
+        Post.all_objects.filter(pk=self.pk).update(deleted_at=self.deleted_at)
     
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
@@ -19,6 +50,13 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='comment_created_idx'),
+            # Comment threads of a post, in either direction
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_created_idx'),
+        ]
+
     def __str__(self):
         return f'Comment by {self.author.username} on {self.post.id} at {self.created_at}'
 
@@ -27,9 +65,104 @@ class Comment(models.Model):
 class Like(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='likes')
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes')
+    created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('user', 'post')  # Ensure a user can like a post only once
+        # Who liked a post, newest first
+        indexes = [models.Index(fields=['post', 'created_at', 'id'], name='like_post_created_idx')]
+
+    def __str__(self):
+        return f'Like by {self.user.username} on {self.post.id}'
+
+# Home timeline entries (fan-out on write)
+# One row per (follower, post) so reading a feed page is a single range scan
+# over the (user, created_at, post) index, no matter how many accounts are followed.
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()  # copy of post.created_at, used for ordering
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_recent_idx'),
+            models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'Post {self.post_id} in timeline of {self.user_id}'
+
+
+# Authors with too many followers to fan out to (see posts.feed).
+# Their posts are merged into follower feeds at read time from a per-author recent-post cache.
+class PulledAuthor(models.Model):
+    author = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    since = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Pulled author {self.author_id}'
+
+
+# Terms compare byte for byte. MySQL's default collation ignores case and accents,
+# so "cafe" and "café" would collide on the unique index; elsewhere the default is binary.
+def search_term_collation():
+    return 'utf8mb4_bin' if connection.vendor == 'mysql' else None
+
+# Full-text search index over post title and content (see posts.search)
+# Vocabulary: one row per distinct term with its document frequency
+class SearchTerm(models.Model):
+    text = models.CharField(max_length=64, unique=True, db_collation=search_term_collation())
+    doc_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.text
+
+# Postings: one row per (term, post) with the precomputed BM25 term weight,
+# so the best postings of a term are read straight off the (term, weight) index
+class SearchPosting(models.Model):
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE, related_name='postings')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='search_postings')
+    frequency = models.PositiveIntegerField()
+    weight = models.FloatField()
+    positions = models.TextField()  # comma separated token positions, used by phrase queries
+
+    class Meta:
+        unique_together = ('term', 'post')
+        indexes = [models.Index(fields=['term', '-weight'], name='posting_term_weight_idx')]
+
+    def __str__(self):
+        return f'{self.term_id} in post {self.post_id}'
+
+# Corpus statistics used for idf and document length normalisation (single row)
+class SearchStats(models.Model):
+    doc_count = models.PositiveIntegerField(default=0)
+    total_length = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.doc_count} documents'
+
+
+# Trending posts (see posts.trending)
+# Scores are stored relative to a fixed epoch, so ranking them never needs
+# rewriting rows that received no new likes or comments.
+class TrendingPost(models.Model):
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    score = models.FloatField(db_index=True)
+
+    def __str__(self):
+        return f'Post {self.post_id} trending score {self.score}'
+
+# Watermarks of the last like/comment processed and the epoch scores are relative to (single row).
+# The ids already processed just behind each watermark are kept too, since that range is read again.
+class TrendingState(models.Model):
+    epoch = models.DateTimeField()
+    last_like_id = models.BigIntegerField(default=0)
+    last_comment_id = models.BigIntegerField(default=0)
+    recent_like_ids = models.JSONField(null=True, blank=True)
+    recent_comment_ids = models.JSONField(null=True, blank=True)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f'Like by {self.user.username} on {self.post.id}'      
\ No newline at end of file
+        return f'Trending refreshed at {self.refreshed_at}'
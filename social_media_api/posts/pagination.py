@@ -1,6 +1,123 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+import math
+from datetime import datetime
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Largest value of a signed 64-bit column
+MAX_INTEGER = 2 ** 63 - 1
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+
+# Keyset (cursor) pagination ordered newest first on (timestamp field, id).
+# Each page is an index range scan starting after the last row of the previous
+# page, so there is no COUNT(*) and no OFFSET and deep pages cost the same as page 1.
+# The timestamp field is taken from `view.keyset_field`, or the model's
+# `created_at`/`timestamp` field, falling back to the primary key alone.
+class KeysetPagination(BasePagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    timestamp_fields = ('created_at', 'timestamp')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_keyset_field(self, queryset, view):
+        field = getattr(view, 'keyset_field', None)
+        if field:
+            return field
+        names = {f.name for f in queryset.model._meta.get_fields()}
+        return next((name for name in self.timestamp_fields if name in names), None)
+
+    # Returns the (timestamp, id) position to continue after, or None for the first page.
+    # When the ordering is on the primary key alone the timestamp is None; other
+    # keysets (e.g. search score) are stored as plain JSON values.
+    def get_position(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            # Only what encode_position writes: an ISO timestamp, a finite number or null,
+            # and an id that fits a database integer. Anything else would fail in the query.
+            if isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            elif value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                        or not math.isfinite(value) or abs(value) > MAX_INTEGER):
+                raise TypeError('Invalid cursor value')
+            if isinstance(pk, bool) or not isinstance(pk, int) or abs(pk) > MAX_INTEGER:
+                raise TypeError('Invalid cursor id')
+            return value, pk
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_position(self, value, pk):
+        payload = json.dumps([value.isoformat() if isinstance(value, datetime) else value, pk])
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    # Keep one page out of `rows` (fetched with one extra row to detect a next page)
+    def set_page(self, request, rows, limit, position):
+        self.request = request
+        self.has_next = len(rows) > limit
+        page = rows[:limit]
+        self.last_position = position(page[-1]) if page else None
+        return page
+
+    # The rows of the requested page plus one, as an unevaluated queryset
+    def get_window(self, queryset, request, view=None):
+        self.keyset_field = field = self.get_keyset_field(queryset, view)
+        limit = self.get_page_size(request)
+        position = self.get_position(request)
+        if field:
+            queryset = queryset.order_by(f'-{field}', '-pk')
+            if position:
+                value, pk = position
+                queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+        else:
+            queryset = queryset.order_by('-pk')
+            if position:
+                queryset = queryset.filter(pk__lt=position[1])
+        return queryset[:limit + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.get_window(queryset, request, view))
+        field = self.keyset_field
+        return self.set_page(request, rows, self.get_page_size(request),
+                             lambda obj: (getattr(obj, field) if field else None, obj.pk))
+
+    def get_next_link(self):
+        if not self.has_next or not self.last_position:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   self.encode_position(*self.last_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+# Feed pages use the same cursors; rows come from posts.feed.read_feed rather than a queryset
+class FeedPagination(KeysetPagination):
+    page_size = 20
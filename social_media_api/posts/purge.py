@@ -0,0 +1,63 @@
+"""
+Background removal of soft-deleted posts.
+
+Deleting a post through the API only sets Post.deleted_at, which hides the
+post, its comments, feed entries and notifications straight away.
+`purge_deleted_posts` then removes every row that references the post in
+batches of at most BATCH_SIZE rows, one short transaction per batch, and the
+post itself last. It is driven by `manage.py purge_deleted_posts`, either once
+(e.g. from cron) or in a loop.
+"""
+
+from django.db import transaction
+
+from notifications.models import Notification
+from .cache import bump_versions
+from .models import Post, Comment, Like, TimelineEntry, TrendingPost
+from .search import unindex_post
+
+BATCH_SIZE = 1000
+
+# (model, column pointing at the post)
+DEPENDENTS = (
+    (Notification, 'target_id'),
+    (Like, 'post_id'),
+    (Comment, 'post_id'),
+    (TimelineEntry, 'post_id'),
+    (TrendingPost, 'post_id'),
+)
+
+
+def _delete_batch(model, column, post_id, batch_size):
+    with transaction.atomic():
+        ids = list(model.objects.filter(**{column: post_id}).values_list('pk', flat=True)[:batch_size])
+        if ids:
+            # No collector and no per-row signals: nothing references these rows and
+            # the post's cached responses were invalidated when it was hidden
+            queryset = model.objects.filter(pk__in=ids)
+            queryset._raw_delete(queryset.db)
+    return len(ids)
+
+
+def purge_post(post_id, batch_size=BATCH_SIZE):
+    """Remove a soft-deleted post and everything that references it; returns the rows deleted."""
+    deleted = 0
+    for model, column in DEPENDENTS:
+        while True:
+            count = _delete_batch(model, column, post_id, batch_size)
+            deleted += count
+            if count < batch_size:
+                break
+    with transaction.atomic():
+        unindex_post(post_id)
+        count, _ = Post.all_objects.filter(pk=post_id, deleted_at__isnull=False).delete()
+        bump_versions([post_id])
+    return deleted + count
+
+
+def purge_deleted_posts(batch_size=BATCH_SIZE, limit=None):
+    """Purge soft-deleted posts, oldest deletion first; returns (posts, rows) deleted."""
+    post_ids = list(Post.all_objects.filter(deleted_at__isnull=False).order_by('deleted_at')
+                    .values_list('pk', flat=True)[:limit])
+    rows = sum(purge_post(post_id, batch_size) for post_id in post_ids)
+    return len(post_ids), rows
@@ -0,0 +1,225 @@
+"""
+Full-text search over post titles and content.
+
+Posts are tokenized into an inverted index (SearchTerm / SearchPosting) that is
+kept up to date by the post_save / pre_delete signals in posts.signals. Each
+posting stores its BM25 term weight, so a query only reads the best postings of
+its rarest clause from the (term, weight) index and checks the remaining clauses
+against those candidates. Query syntax:
+
+    django orm          both terms must match
+    "query planner"     phrase, terms must be adjacent
+    optim*              prefix, matches optimize, optimizer, ...
+"""
+
+import math
+import re
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import SearchTerm, SearchPosting, SearchStats
+
+TOKEN_RE = re.compile(r'\w+')
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+MAX_TERM_LENGTH = 64
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Postings read for the rarest clause of a query; bounds the work done per query
+MAX_CANDIDATES = 5000
+# Ranked results that /api/posts/search/ pages through
+MAX_RESULTS = 1000
+# Maximum number of terms a prefix expands to
+PREFIX_EXPANSIONS = 50
+# Position gap between title and content so phrases do not match across fields
+FIELD_GAP = 10
+CHUNK_SIZE = 500
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall((text or '').lower()) if len(token) <= MAX_TERM_LENGTH]
+
+
+def term_positions(post):
+    positions = defaultdict(list)
+    title = tokenize(post.title)
+    for i, token in enumerate(title):
+        positions[token].append(i)
+    offset = len(title) + FIELD_GAP
+    content = tokenize(post.content)
+    for i, token in enumerate(content):
+        positions[token].append(offset + i)
+    return positions, len(title) + len(content)
+
+
+def term_weight(frequency, length, avg_length):
+    return frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / max(avg_length, 1)))
+
+
+def idf(doc_count, total_docs):
+    return math.log(1 + (total_docs - doc_count + 0.5) / (doc_count + 0.5))
+
+
+def get_stats():
+    stats, _ = SearchStats.objects.get_or_create(pk=1)
+    return stats
+
+
+def term_ids(texts):
+    # Create missing vocabulary rows and return {text: id}
+    SearchTerm.objects.bulk_create([SearchTerm(text=text) for text in texts], ignore_conflicts=True)
+    return dict(SearchTerm.objects.filter(text__in=texts).values_list('text', 'id'))
+
+
+def build_postings(post, positions, length, avg_length, ids):
+    return [
+        SearchPosting(
+            term_id=ids[text], post_id=post.pk, frequency=len(found),
+            weight=term_weight(len(found), length, avg_length),
+            positions=','.join(map(str, found)),
+        )
+        for text, found in positions.items()
+    ]
+
+
+# (Re)index a single post, called when a post is saved
+@transaction.atomic
+def index_post(post):
+    unindex_post(post.pk)
+    positions, length = term_positions(post)
+    if not positions:
+        return
+    stats = get_stats()
+    SearchStats.objects.filter(pk=stats.pk).update(doc_count=F('doc_count') + 1, total_length=F('total_length') + length)
+    avg_length = (stats.total_length + length) / (stats.doc_count + 1)
+    ids = term_ids(list(positions))
+    SearchTerm.objects.filter(id__in=ids.values()).update(doc_count=F('doc_count') + 1)
+    SearchPosting.objects.bulk_create(build_postings(post, positions, length, avg_length, ids))
+
+
+# Remove a post from the index, called before a post is deleted
+@transaction.atomic
+def unindex_post(post_id):
+    postings = list(SearchPosting.objects.filter(post_id=post_id).values_list('term_id', 'frequency'))
+    if not postings:
+        return
+    length = sum(frequency for _, frequency in postings)
+    SearchTerm.objects.filter(id__in=[term_id for term_id, _ in postings], doc_count__gt=0).update(doc_count=F('doc_count') - 1)
+    SearchStats.objects.filter(pk=1, doc_count__gt=0).update(doc_count=F('doc_count') - 1, total_length=F('total_length') - length)
+    SearchPosting.objects.filter(post_id=post_id).delete()
+
+
+def parse_query(query):
+    # Returns a list of clauses: ('term', text), ('prefix', text) or ('phrase', [texts])
+    clauses = []
+    for phrase, word in QUERY_RE.findall(query or ''):
+        if phrase:
+            tokens = tokenize(phrase)
+            if len(tokens) > 1:
+                clauses.append(('phrase', tokens))
+            elif tokens:
+                clauses.append(('term', tokens[0]))
+            continue
+        tokens = tokenize(word)
+        for i, token in enumerate(tokens):
+            is_prefix = word.endswith('*') and i == len(tokens) - 1
+            clauses.append(('prefix' if is_prefix else 'term', token))
+    return clauses
+
+
+def resolve_terms(clauses):
+    # Every required clause becomes a list of alternative (term id, doc_count) pairs.
+    # Phrases add one required clause per term plus their ordered term ids for the position check.
+    texts = {text for kind, value in clauses for text in ([value] if kind == 'term' else value if kind == 'phrase' else [])}
+    vocabulary = {text: (term_id, doc_count) for text, term_id, doc_count
+                  in SearchTerm.objects.filter(text__in=texts, doc_count__gt=0).values_list('text', 'id', 'doc_count')}
+    required, phrases = [], []
+    for kind, value in clauses:
+        if kind == 'prefix':
+            matches = list(SearchTerm.objects.filter(text__gte=value, text__lt=value + '\uffff', doc_count__gt=0)
+                           .order_by('text').values_list('id', 'doc_count')[:PREFIX_EXPANSIONS])
+            required.append(matches)
+            continue
+        words = [value] if kind == 'term' else value
+        if any(word not in vocabulary for word in words):
+            return None, None
+        required.extend([[vocabulary[word]] for word in words])
+        if kind == 'phrase':
+            phrases.append([vocabulary[word][0] for word in words])
+    if any(not alternatives for alternatives in required):
+        return None, None
+    return required, phrases
+
+
+def matches_phrase(positions, post_id, phrase):
+    first = positions.get((post_id, phrase[0]))
+    if not first:
+        return False
+    following = [positions.get((post_id, term_id), set()) for term_id in phrase[1:]]
+    return any(all(start + i + 1 in found for i, found in enumerate(following)) for start in first)
+
+
+# Search the index, returns up to `limit` (post id, score) pairs (all of them for None),
+# best match first. Only the best `max_candidates` postings of the rarest clause are considered.
+def search(query, limit=100, max_candidates=MAX_CANDIDATES):
+    required, phrases = resolve_terms(parse_query(query))
+    if not required:
+        return []
+    total_docs = max(get_stats().doc_count, 1)
+    weights = {term_id: idf(doc_count, total_docs) for alternatives in required for term_id, doc_count in alternatives}
+    phrase_terms = {term_id for phrase in phrases for term_id in phrase}
+    required.sort(key=lambda alternatives: sum(doc_count for _, doc_count in alternatives))
+
+    positions = {}
+
+    def collect(rows):
+        matched = defaultdict(float)
+        for post_id, term_id, weight, found in rows:
+            matched[post_id] += weights[term_id] * weight
+            if term_id in phrase_terms:
+                positions[(post_id, term_id)] = {int(p) for p in found.split(',')}
+        return matched
+
+    # The rarest clause drives the query: its best postings come straight off the (term, weight) index
+    driver = [term_id for term_id, _ in required[0]]
+    rows = (SearchPosting.objects.filter(term_id__in=driver).order_by('-weight')
+            .values_list('post_id', 'term_id', 'weight', 'positions')[:max_candidates])
+    scores = collect(rows)
+
+    # Every other clause only looks up postings of the remaining candidates
+    for alternatives in required[1:]:
+        ids = [term_id for term_id, _ in alternatives]
+        candidates = list(scores)
+        matched = defaultdict(float)
+        for start in range(0, len(candidates), CHUNK_SIZE):
+            rows = (SearchPosting.objects.filter(term_id__in=ids, post_id__in=candidates[start:start + CHUNK_SIZE])
+                    .values_list('post_id', 'term_id', 'weight', 'positions'))
+            for post_id, score in collect(rows).items():
+                matched[post_id] += score
+        scores = {post_id: scores[post_id] + score for post_id, score in matched.items()}
+        if not scores:
+            return []
+
+    if phrases:
+        scores = {post_id: score for post_id, score in scores.items()
+                  if all(matches_phrase(positions, post_id, phrase) for phrase in phrases)}
+    ranked = sorted(scores.items(), key=lambda item: (item[1], item[0]), reverse=True)
+    return ranked if limit is None else ranked[:limit]
+
+
+# Restrict `queryset` to the posts matching `query`, in its own order. Every term and
+# prefix clause is a subquery on the postings, so there is no bound on the number of
+# matches and no id list is sent to the database. Phrase adjacency needs the positions,
+# so phrases are checked against the candidates of search() like the ranked endpoint.
+def filter_posts(queryset, query):
+    required, phrases = resolve_terms(parse_query(query))
+    if not required:
+        return queryset.none()
+    for alternatives in required:
+        postings = SearchPosting.objects.filter(term_id__in=[term_id for term_id, _ in alternatives])
+        queryset = queryset.filter(pk__in=postings.values('post_id'))
+    if phrases:
+        queryset = queryset.filter(pk__in=[post_id for post_id, _ in search(query, limit=None)])
+    return queryset
@@ -1,20 +1,88 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from .models import Post, Comment, Like
+from . import write_behind
+
+# Field names requested with `?fields=id,title,created_at` (None when not given)
+def requested_fields(request, param='fields'):
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    value = request.query_params.get(param)
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+# Sparse fieldsets: on reads, drop every field that was not asked for with `?fields=`.
+# posts.filters.SparseFieldsFilter applies the matching .only() to the queryset.
+class SparseFieldsMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = requested_fields(self.context.get('request'))
+        if requested and requested & set(self.fields):
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+# Resolves which posts of a page the viewer has liked with a single query,
+# instead of one query per serialized post
+class PostListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        posts = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        if request and request.user.is_authenticated and 'has_liked' in self.child.fields:
+            self.context['liked_post_ids'] = set(
+                Like.objects.filter(user=request.user, post_id__in=[post.pk for post in posts])
+                .values_list('post_id', flat=True)
+            ) | write_behind.pending_liked_post_ids(request.user.pk)
+        return super().to_representation(posts)
+
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    has_liked = serializers.SerializerMethodField()
 
-class PostSerializer(serializers.ModelSerializer):
     class Meta:
         model = Post
-        fields = "__all__"
-        read_only_fields = ['author', 'created_at']
+        # deleted_at is set by destroy only; clients never see or write it
+        exclude = ['deleted_at']
+        read_only_fields = ['author', 'created_at', 'like_count', 'comment_count']
+        list_serializer_class = PostListSerializer
+
+    def get_has_liked(self, obj):
+        request = self.context.get('request')
+        if not request or not request.user.is_authenticated:
+            return False
+        liked_post_ids = self.context.get('liked_post_ids')
+        if liked_post_ids is not None:
+            return obj.pk in liked_post_ids
+        if obj.pk in write_behind.pending_liked_post_ids(request.user.pk):
+            return True
+        return Like.objects.filter(user=request.user, post=obj).exists()
+
+    # Likes still in the write-behind buffer are counted right away
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if 'like_count' in data:
+            data['like_count'] += write_behind.pending_like_count(instance.pk)
+        return data
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = "__all__"
         read_only_fields = ['author', 'created_at']
 
-class LikeSerializer(serializers.ModelSerializer):
+class LikeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Like
         fields = "__all__"
-        read_only_fields = ['user']
\ No newline at end of file
+        read_only_fields = ['user']
+
+# Batch like/unlike request, e.g. {"like": [1, 2], "unlike": [3]}
+class LikeBatchSerializer(serializers.Serializer):
+    like = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list, max_length=500)
+    unlike = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list, max_length=500)
+
+    def validate(self, data):
+        if not data['like'] and not data['unlike']:
+            raise serializers.ValidationError("Provide at least one post id to like or unlike.")
+        if set(data['like']) & set(data['unlike']):
+            raise serializers.ValidationError("A post cannot be liked and unliked in the same batch.")
+        return data
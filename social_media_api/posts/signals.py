@@ -0,0 +1,28 @@
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from .models import Post, Comment, Like
+from .search import index_post, unindex_post
+from .cache import bump_versions
+
+# Keep the full-text search index in step with posts
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_post(instance)
+
+@receiver(pre_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    unindex_post(instance.pk)
+
+# Invalidate cached post responses (see posts.cache)
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_post_version(sender, instance, **kwargs):
+    bump_versions([instance.pk])
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def bump_post_version_of_related(sender, instance, **kwargs):
+    bump_versions([instance.post_id])
@@ -1,3 +1,777 @@
-from django.test import TestCase
+import base64
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from accounts.async_views import AsyncFollowView, AsyncUnfollowView
+from notifications.models import Notification
+from posts import cache as response_cache, urls, write_behind
+from posts.async_views import AsyncLikePostView, AsyncUnlikePostView
+from posts import feed
+from posts.feed import RECENT_POSTS_LIMIT
+from posts.models import Post, Comment, Like, PulledAuthor, SearchPosting, TimelineEntry, TrendingPost, TrendingState
+from posts.pagination import KeysetPagination
+from posts.purge import DEPENDENTS, purge_deleted_posts
+from posts.search import filter_posts, get_stats, search
+from posts import views
+from posts.views import record_like
+from posts.trending import refresh_trending, tau_seconds
+from social_media_api.routers import ReplicaRoutingMiddleware
+from social_media_api.testing import QueryBudgetTestCase, QueryPlanMixin, route_names
+
+# Query budgets for every route in posts.urls. A budget is the most queries the
+# request may run; list budgets must hold for small and large pages alike.
+class PostsQueryBudgetTests(QueryBudgetTestCase):
+    routes = {
+        'api-root', 'post-list', 'post-detail', 'post-cache-stats', 'post-trending', 'post-search', 'post-likes',
+        'comment-list', 'comment-detail', 'feed', 'like-batch', 'like-post', 'unlike-post',
+        'follow-user', 'unfollow-user',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        refresh_trending()
+
+    def own_post(self):
+        return Post.objects.filter(author=self.viewer).first()
+
+    def other_post(self, liked=False):
+        liked_ids = Like.objects.filter(user=self.viewer).values('post_id')
+        posts = Post.objects.exclude(author=self.viewer)
+        return (posts.filter(pk__in=liked_ids) if liked else posts.exclude(pk__in=liked_ids)).first()
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual(route_names(urls.urlpatterns) - self.routes, set())
+
+    def test_api_root(self):
+        self.assertQueryBudget(1, 'get', reverse('api-root'), status=200)
+
+    def test_post_list(self):
+        self.assertListBudget(4, reverse('post-list'))
+
+    def test_post_list_search(self):
+        self.assertListBudget(7, reverse('post-list') + '?search=budgets')
+
+    def test_post_list_sparse_fields(self):
+        self.assertListBudget(3, reverse('post-list') + '?fields=id,title,created_at')
+
+    def test_post_list_by_author(self):
+        self.assertListBudget(5, reverse('post-list') + f'?author={self.users[3].pk}')
+
+    def test_post_create(self):
+        self.assertQueryBudget(18, 'post', reverse('post-list'), {'title': 'New', 'content': 'Fresh budget post'}, status=201)
+
+    def test_post_retrieve(self):
+        self.assertQueryBudget(4, 'get', reverse('post-detail', args=[self.posts[1].pk]), status=200)
+
+    def test_post_update(self):
+        self.assertQueryBudget(19, 'patch', reverse('post-detail', args=[self.own_post().pk]), {'content': 'Edited budget post'}, status=200)
+
+    def test_post_destroy(self):
+        self.assertQueryBudget(4, 'delete', reverse('post-detail', args=[self.own_post().pk]), status=204)
+
+    def test_cache_stats(self):
+        self.viewer.is_staff = True
+        self.viewer.save(update_fields=['is_staff'])
+        self.assertQueryBudget(1, 'get', reverse('post-cache-stats'), status=200)
+
+    def test_trending(self):
+        self.assertListBudget(3, reverse('post-trending'))
+
+    def test_post_likes(self):
+        post = Like.objects.values_list('post_id', flat=True).first()
+        self.assertListBudget(3, reverse('post-likes', args=[post]))
+
+    def test_search(self):
+        self.assertListBudget(6, reverse('post-search') + '?q=budgets')
+
+    def test_comment_list(self):
+        self.assertListBudget(3, reverse('comment-list'))
+
+    def test_comment_thread(self):
+        self.assertListBudget(4, reverse('comment-list') + f'?post={self.posts[5].pk}')
+
+    def test_comment_create(self):
+        self.assertQueryBudget(6, 'post', reverse('comment-list'), {'post': self.posts[1].pk, 'content': 'Nice'}, status=201)
+
+    def test_comment_retrieve(self):
+        comment = Comment.objects.first()
+        self.assertQueryBudget(3, 'get', reverse('comment-detail', args=[comment.pk]), status=200)
+
+    def test_comment_update(self):
+        comment = Comment.objects.filter(author=self.viewer).first()
+        self.assertQueryBudget(6, 'patch', reverse('comment-detail', args=[comment.pk]), {'content': 'Edited'}, status=200)
+
+    def test_comment_destroy(self):
+        comment = Comment.objects.filter(author=self.viewer).first()
+        self.assertQueryBudget(7, 'delete', reverse('comment-detail', args=[comment.pk]), status=204)
+
+    def test_feed(self):
+        self.assertListBudget(4, reverse('feed'))
+
+    def test_like(self):
+        self.assertQueryBudget(6, 'post', reverse('like-post', args=[self.other_post().pk]), status=201)
+
+    def test_like_put(self):
+        self.assertQueryBudget(6, 'put', reverse('like-post', args=[self.other_post().pk]), status=201)
+
+    def test_like_put_repeated(self):
+        self.assertQueryBudget(5, 'put', reverse('like-post', args=[self.other_post(liked=True).pk]), status=200)
+
+    def test_like_delete(self):
+        self.assertQueryBudget(6, 'delete', reverse('like-post', args=[self.other_post(liked=True).pk]), status=200)
+
+    def test_like_delete_repeated(self):
+        self.assertQueryBudget(5, 'delete', reverse('like-post', args=[self.other_post().pk]), status=200)
+
+    def test_unlike(self):
+        self.assertQueryBudget(6, 'post', reverse('unlike-post', args=[self.other_post(liked=True).pk]), status=200)
+
+    def test_like_batch(self):
+        liked = Like.objects.filter(user=self.viewer).values('post_id')
+        like = list(Post.objects.exclude(pk__in=liked).values_list('pk', flat=True)[:10])
+        unlike = list(Post.objects.filter(pk__in=liked).values_list('pk', flat=True)[:10])
+        self.assertQueryBudget(11, 'post', reverse('like-batch'), {'like': like, 'unlike': unlike}, status=200)
+
+    def test_follow(self):
+        self.assertQueryBudget(8, 'post', reverse('follow-user', args=[self.users[-1].pk]), status=200)
+
+    def test_follow_put(self):
+        self.assertQueryBudget(8, 'put', reverse('follow-user', args=[self.users[-1].pk]), status=200)
+
+    def test_follow_put_repeated(self):
+        self.assertQueryBudget(5, 'put', reverse('follow-user', args=[self.users[1].pk]), status=200)
+
+    def test_follow_delete(self):
+        self.assertQueryBudget(6, 'delete', reverse('follow-user', args=[self.users[1].pk]), status=200)
+
+    def test_unfollow(self):
+        self.assertQueryBudget(6, 'post', reverse('unfollow-user', args=[self.users[1].pk]), status=200)
+
+
+# The hot list queries must be answered from an index, in index order
+class PostsQueryPlanTests(QueryPlanMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='planner', password='plan-pass-123')
+        cls.post = Post.objects.create(author=cls.user, title='Plans', content='Explain everything')
+        cls.cursor = 'cursor=' + KeysetPagination().encode_position(timezone.now(), cls.post.pk + 1)
+
+    def test_post_list(self):
+        self.assertIndexedPlan(self.page_query(Post.objects.all()))
+        self.assertIndexedPlan(self.page_query(Post.objects.all(), self.cursor))
+
+    def test_profile_timeline(self):
+        self.assertIndexedPlan(self.page_query(Post.objects.filter(author=self.user)))
+        self.assertIndexedPlan(self.page_query(Post.objects.filter(author=self.user), self.cursor))
+
+    def test_recent_posts_of_author(self):
+        self.assertIndexedPlan(Post.objects.filter(author_id=self.user.pk).order_by('-created_at', '-id')
+                               .values_list('created_at', 'id')[:RECENT_POSTS_LIMIT])
+
+    def test_comment_thread(self):
+        self.assertIndexedPlan(self.page_query(Comment.objects.filter(post=self.post)))
+        self.assertIndexedPlan(self.page_query(Comment.objects.filter(post=self.post), self.cursor))
+
+    def test_post_likes(self):
+        self.assertIndexedPlan(self.page_query(Like.objects.filter(post=self.post)))
+        self.assertIndexedPlan(self.page_query(Like.objects.filter(post=self.post), self.cursor))
+
+    def test_home_timeline(self):
+        self.assertIndexedPlan(TimelineEntry.objects.filter(user=self.user, post__deleted_at__isnull=True)
+                               .select_related('post').order_by('-created_at', '-post_id')[:21])
+
+
+# What the API does, beyond how many queries it takes
+@override_settings(SECURE_SSL_REDIRECT=False)
+class PostsBehaviourTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='behave-pass-123')
+        self.reader = User.objects.create_user(username='reader', password='behave-pass-123')
+        self.post = Post.objects.create(author=self.author, title='Hello', content='First post')
+        self.client.force_authenticate(self.author)
+        cache.clear()
+
+    def test_deleted_at_is_not_writable(self):
+        response = self.client.patch(reverse('post-detail', args=[self.post.pk]), {'deleted_at': timezone.now().isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('deleted_at', response.data)
+        self.post.refresh_from_db()
+        self.assertIsNone(self.post.deleted_at)
+        self.assertEqual(self.client.get(reverse('post-detail', args=[self.post.pk])).status_code, 200)
+
+    def test_retrieve_non_numeric_pk(self):
+        self.assertEqual(self.client.get(reverse('post-detail', args=['abc'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('comment-detail', args=['abc'])).status_code, 404)
+
+    def test_invalid_cursor(self):
+        for value, pk in ([[1], 1], [{'a': 1}, 1], [True, 1], ['2024-01-01T00:00:00+00:00', '1'], [None, 2 ** 70]):
+            cursor = base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode()
+            response = self.client.get(reverse('post-list'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, (value, pk))
+
+    def test_like_batch_counts_each_like_once(self):
+        self.client.force_authenticate(self.reader)
+        for _ in range(2):
+            response = self.client.post(reverse('like-batch'), {'like': [self.post.pk]}, format='json')
+        self.assertEqual(response.data['results'], [{'post': self.post.pk, 'status': 'already liked'}])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(Notification.objects.filter(actor=self.reader, target=self.post).count(), 1)
+
+        response = self.client.post(reverse('like-batch'), {'unlike': [self.post.pk]}, format='json')
+        self.assertEqual(response.data['results'], [{'post': self.post.pk, 'status': 'unliked'}])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+        self.assertFalse(Like.objects.filter(post=self.post).exists())
+        self.assertFalse(Notification.objects.filter(actor=self.reader, target=self.post).exists())
+
+    def test_like_batch_skips_a_racing_like(self):
+        other = Post.objects.create(author=self.author, title='Other', content='Second post')
+        insert = views.insert_from_select
+
+        def race(*args, **kwargs):
+            # A single like of the same post commits between the batch's read and its insert
+            with mock.patch('posts.views.insert_from_select', insert):
+                record_like(self.reader, self.post.pk)
+            return insert(*args, **kwargs)
+
+        self.client.force_authenticate(self.reader)
+        with mock.patch('posts.views.insert_from_select', side_effect=race):
+            response = self.client.post(reverse('like-batch'), {'like': [self.post.pk, other.pk]}, format='json')
+        self.assertEqual(response.data['results'], [{'post': self.post.pk, 'status': 'already liked'},
+                                                    {'post': other.pk, 'status': 'liked'}])
+        for post in (self.post, other):
+            post.refresh_from_db()
+            self.assertEqual(post.like_count, 1)
+            self.assertEqual(Notification.objects.filter(actor=self.reader, target=post).count(), 1)
+
+    def pages(self, url, params):
+        # Follows the next links, returns the ids on each page
+        pages, response = [], self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append([item['id'] for item in response.data['results']])
+            if not response.data['next']:
+                return pages
+            response = self.client.get(response.data['next'])
+
+    def test_keyset_next_pages(self):
+        posts = [self.post] + [Post.objects.create(author=self.author, title=f'Post {number}', content='More')
+                               for number in range(4)]
+        pages = self.pages(reverse('post-list'), {'page_size': 2})
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), [post.pk for post in reversed(posts)])
+
+    @override_settings(FEED_FANOUT_THRESHOLD=2)
+    def test_feed_merges_pulled_authors(self):
+        User = get_user_model()
+        celebrity = User.objects.create_user(username='celebrity', password='behave-pass-123')
+        fan = User.objects.create_user(username='fan', password='behave-pass-123')
+        self.reader.following.add(self.author, celebrity)
+        fan.following.add(celebrity)
+        posts = []
+        for number in range(3):
+            for author in (self.author, celebrity):
+                self.client.force_authenticate(author)
+                response = self.client.post(reverse('post-list'), {'title': f'Post {number}', 'content': 'Fan-out'})
+                posts.append(response.data['id'])
+        self.assertTrue(PulledAuthor.objects.filter(author=celebrity).exists())
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader, author=celebrity).exists())
+
+        self.client.force_authenticate(self.reader)
+        pages = self.pages(reverse('feed'), {'page_size': 4})
+        self.assertEqual([len(page) for page in pages], [4, 2])
+        self.assertEqual(sum(pages, []), posts[::-1])
+
+    @override_settings(FEED_FANOUT_THRESHOLD=2)
+    def test_feed_sees_new_posts_of_pulled_authors(self):
+        User = get_user_model()
+        User.objects.filter(pk=self.author.pk).update(followers_count=2)  # stored count decides, not the follow rows
+        self.reader.following.add(self.author)
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(self.pages(reverse('feed'), {}), [[]])
+
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.post(reverse('post-list'), {'title': 'Pulled', 'content': 'Read time'}).data['id']
+        self.assertTrue(PulledAuthor.objects.filter(author=self.author).exists())
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(self.pages(reverse('feed'), {}), [[first, self.post.pk]])
+        self.assertEqual(feed.recent_posts_timeout(), feed.RECENT_POSTS_LOCAL_TIMEOUT)
+
+        # The cached list is dropped once the next post commits
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            second = self.client.post(reverse('post-list'), {'title': 'Again', 'content': 'Read time'}).data['id']
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(self.pages(reverse('feed'), {}), [[second, first, self.post.pk]])
+
+    def test_conditional_get(self):
+        url = reverse('post-detail', args=[self.post.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('like-post', args=[self.post.pk]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['like_count'], 1)
+
+    def test_conditional_get_ignores_if_modified_since(self):
+        # A like changes like_count but not updated_at, so only the ETag can tell
+        url = reverse('post-detail', args=[self.post.pk])
+        self.assertNotIn('Last-Modified', self.client.get(url))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('like-post', args=[self.post.pk]))
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['like_count'], 1)
+
+    def shared_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                                     'LOCATION': directory}})
+
+    def test_responses_are_not_cached_per_process(self):
+        # A write in one worker could not invalidate what the others cached in local memory
+        self.assertFalse(response_cache.enabled())
+        self.assertEqual([message.id for message in response_cache.check_shared_cache(None)], ['posts.W001'])
+        misses = response_cache.stats()['misses']
+        self.client.get(reverse('post-list'))
+        self.assertEqual(response_cache.stats()['misses'], misses)
+
+    def test_cached_responses_are_invalidated(self):
+        self.enterContext(self.shared_cache())
+        self.assertTrue(response_cache.enabled())
+        list_url, detail_url = reverse('post-list'), reverse('post-detail', args=[self.post.pk])
+        hits = response_cache.stats()['hits']
+        self.client.get(detail_url)
+        self.assertEqual(self.client.get(detail_url).json()['title'], 'Hello')
+        self.assertEqual(response_cache.stats()['hits'], hits + 1)
+        self.assertEqual(self.client.get(list_url).json()['results'][0]['title'], 'Hello')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(detail_url, {'title': 'Edited'})
+        self.assertEqual(self.client.get(list_url).json()['results'][0]['title'], 'Edited')
+        self.assertEqual(self.client.get(detail_url).json()['title'], 'Edited')
+
+
+# The async like/unlike/follow views served under ASGI (settings.ASYNC_VIEWS)
+class AsyncViewsTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='async-pass-123')
+        self.reader = User.objects.create_user(username='reader', password='async-pass-123')
+        self.post = Post.objects.create(author=self.author, title='Hello', content='First post')
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.reader).key}'}
+        self.factory = AsyncRequestFactory()
+
+    async def call(self, view, method, pk):
+        return await view.as_view()(getattr(self.factory, method)('/', headers=self.headers), pk=pk)
+
+    async def test_like_and_unlike(self):
+        self.assertEqual((await self.call(AsyncLikePostView, 'post', self.post.pk)).status_code, 201)
+        self.assertEqual((await self.call(AsyncLikePostView, 'post', self.post.pk)).status_code, 400)
+        post = await Post.objects.aget(pk=self.post.pk)
+        self.assertEqual(post.like_count, 1)
+        self.assertEqual(await Notification.objects.filter(actor=self.reader, target=self.post).acount(), 1)
+
+        self.assertEqual((await self.call(AsyncUnlikePostView, 'post', self.post.pk)).status_code, 200)
+        self.assertEqual((await self.call(AsyncLikePostView, 'delete', self.post.pk)).status_code, 200)
+        post = await Post.objects.aget(pk=self.post.pk)
+        self.assertEqual(post.like_count, 0)
+        self.assertFalse(await Notification.objects.filter(actor=self.reader, target=self.post).aexists())
+        self.assertEqual((await self.call(AsyncLikePostView, 'put', self.post.pk + 1)).status_code, 404)
+
+    async def test_like_is_one_transaction(self):
+        # A failure after the like row is written leaves neither the row nor the counter behind
+        with mock.patch('posts.views.response_cache.bump_versions', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                await self.call(AsyncLikePostView, 'post', self.post.pk)
+        post = await Post.objects.aget(pk=self.post.pk)
+        self.assertEqual(post.like_count, 0)
+        self.assertFalse(await Like.objects.filter(post=self.post).aexists())
+
+    async def test_follow_and_unfollow(self):
+        self.assertEqual((await self.call(AsyncFollowView, 'post', self.author.pk)).status_code, 200)
+        self.assertEqual((await self.call(AsyncFollowView, 'post', self.author.pk)).status_code, 400)
+        author = await get_user_model().objects.aget(pk=self.author.pk)
+        self.assertEqual(author.followers_count, 1)
+        self.assertTrue(await TimelineEntry.objects.filter(user=self.reader, post=self.post).aexists())
+
+        self.assertEqual((await self.call(AsyncUnfollowView, 'post', self.author.pk)).status_code, 200)
+        author = await get_user_model().objects.aget(pk=self.author.pk)
+        self.assertEqual(author.followers_count, 0)
+        self.assertFalse(await TimelineEntry.objects.filter(user=self.reader, post=self.post).aexists())
+        self.assertEqual((await self.call(AsyncFollowView, 'put', self.author.pk + 100)).status_code, 404)
+
+    def test_middleware_runs_async(self):
+        # With DEBUG on, Django logs every middleware it has to adapt to the handler's mode
+        with override_settings(DEBUG=True), self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+
+# Full-text search (see posts.search)
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        self.author = get_user_model().objects.create_user(username='writer', password='search-pass-123')
+
+    def post(self, title, content=''):
+        return Post.objects.create(author=self.author, title=title, content=content)
+
+    def test_accented_terms_are_distinct(self):
+        plain, accented = self.post('cafe'), self.post('café')
+        self.assertEqual([post_id for post_id, _ in search('cafe')], [plain.pk])
+        self.assertEqual([post_id for post_id, _ in search('café')], [accented.pk])
+
+    def test_search_filter_keeps_every_match(self):
+        posts = [self.post(f'Tuning {number}', 'index ' * number) for number in range(1, 4)]
+        self.assertEqual(len(search('index', max_candidates=1)), 1)
+        response = self.client.get(reverse('post-list'), {'search': 'index'})
+        self.assertEqual({post['id'] for post in response.data['results']}, {post.pk for post in posts})
+        # Matches are read through a subquery, not passed back as a list of ids
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(filter_posts(Post.objects.all(), 'tun* index').count(), 3)
+        self.assertIn('"posts_searchposting"', queries[-1]['sql'])
+
+    def test_search_filter_phrase(self):
+        adjacent = self.post('Query planner tips')
+        self.post('Planner for every query')
+        response = self.client.get(reverse('post-list'), {'search': '"query planner"'})
+        self.assertEqual([post['id'] for post in response.data['results']], [adjacent.pk])
+        self.assertFalse(filter_posts(Post.objects.all(), 'unknown').exists())
+
+    def test_phrase_and_prefix(self):
+        adjacent = self.post('Query planner tips', 'Read the plan')
+        apart = self.post('Planner for every query', 'Not a phrase')
+        prefixed = self.post('Optimizer notes', 'An optimization a day')
+        self.assertEqual({post_id for post_id, _ in search('query planner')}, {adjacent.pk, apart.pk})
+        self.assertEqual([post_id for post_id, _ in search('"query planner"')], [adjacent.pk])
+        self.assertEqual([post_id for post_id, _ in search('optim*')], [prefixed.pk])
+        self.assertEqual(search('optim'), [])
+        self.assertEqual([post_id for post_id, _ in search('"query planner" pla*')], [adjacent.pk])
+
+
+# Scores maintained by posts.trending.refresh_trending and read by /api/posts/trending/
+@override_settings(SECURE_SSL_REDIRECT=False, TRENDING_HALF_LIFE_HOURS=6)
+class TrendingTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='trend-pass-123')
+        self.fans = [User.objects.create_user(username=f'fan{number}', password='trend-pass-123') for number in range(3)]
+        self.liked = Post.objects.create(author=self.author, title='Liked', content='Once')
+        self.discussed = Post.objects.create(author=self.author, title='Discussed', content='Twice')
+        self.now = timezone.now()
+
+    def like(self, user, post, hours_ago=0):
+        like = Like.objects.create(user=user, post=post)
+        Like.objects.filter(pk=like.pk).update(created_at=self.now - timedelta(hours=hours_ago))
+        return like
+
+    def score(self, post):
+        state = TrendingState.objects.get()
+        stored = TrendingPost.objects.get(post=post).score
+        return stored * math.exp(-(self.now - state.epoch).total_seconds() / tau_seconds())
+
+    def test_refresh_ranks_decayed_engagement(self):
+        self.like(self.fans[0], self.liked)
+        self.like(self.fans[1], self.liked, hours_ago=12)  # two half-lives: a quarter
+        self.like(self.fans[2], self.liked, hours_ago=24 * 4)  # outside the window
+        Comment.objects.create(post=self.discussed, author=self.fans[0], content='First')
+        Comment.objects.create(post=self.discussed, author=self.fans[1], content='Second')
+        self.assertEqual(refresh_trending(self.now), 2)
+        self.assertAlmostEqual(self.score(self.liked), 1.25)
+        self.assertAlmostEqual(self.score(self.discussed), 4, places=3)
+
+        response = self.client.get(reverse('post-trending'))
+        self.assertEqual([post['id'] for post in response.data['results']], [self.discussed.pk, self.liked.pk])
+
+        # Nothing new: nothing is counted again, and the scores keep decaying
+        self.now += timedelta(hours=6)
+        self.assertEqual(refresh_trending(self.now), 0)
+        self.assertAlmostEqual(self.score(self.liked), 0.625)
+
+    def test_late_commit_behind_the_watermark(self):
+        early = self.like(self.fans[0], self.liked)
+        self.like(self.fans[1], self.liked)
+        # The first like's transaction has not committed yet when the refresh runs
+        Like.objects.filter(pk=early.pk).delete()
+        refresh_trending(self.now)
+        Like.objects.create(pk=early.pk, user=self.fans[0], post=self.liked)
+        self.assertEqual(refresh_trending(self.now), 1)
+        self.assertEqual(refresh_trending(self.now), 0)
+        self.assertAlmostEqual(self.score(self.liked), 2, places=5)
+
+
+# Background removal of soft-deleted posts (see posts.purge)
+class PurgeTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='purge-pass-123')
+        self.fans = [User.objects.create_user(username=f'fan{number}', password='purge-pass-123') for number in range(2)]
+        self.doomed = self.post('Doomed', 'Purged with everything around it')
+        self.live = self.post('Live', 'Kept with everything around it')
+        self.doomed.soft_delete()
+
+    def post(self, title, content):
+        post = Post.objects.create(author=self.author, title=title, content=content)
+        for fan in self.fans:
+            Like.objects.create(user=fan, post=post)
+            Comment.objects.create(post=post, author=fan, content='Comment')
+            Notification.objects.create(recipient=self.author, actor=fan, verb='liked your post', target=post)
+            TimelineEntry.objects.create(user=fan, post=post, author=self.author, created_at=post.created_at)
+        TrendingPost.objects.create(post=post, score=1)
+        return post
+
+    def dependents(self, post):
+        return [model.objects.filter(**{column: post.pk}).count() for model, column in DEPENDENTS + ((SearchPosting, 'post_id'),)]
+
+    def test_purge_removes_only_deleted_posts(self):
+        live, doomed = self.dependents(self.live), self.dependents(self.doomed)
+        self.assertTrue(all(live) and all(doomed))
+        # Batches of one row: every dependent table takes several; the postings go with the post
+        self.assertEqual(purge_deleted_posts(batch_size=1), (1, sum(doomed[:-1]) + 1))
+        self.assertFalse(Post.all_objects.filter(pk=self.doomed.pk).exists())
+        self.assertEqual(self.dependents(self.doomed), [0] * len(live))
+        self.assertEqual(self.dependents(self.live), live)
+        self.assertEqual([post_id for post_id, _ in search('kept')], [self.live.pk])
+        self.assertEqual(get_stats().doc_count, 1)
+        self.assertEqual(purge_deleted_posts(), (0, 0))
+
+
+# Streaming bulk import (manage.py import_posts)
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ImportPostsTests(APITestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(username='alice', password='import-pass-123')
+        self.reader = User.objects.create_user(username='reader', password='import-pass-123')
+        self.reader.following.add(self.author)
+
+    def run_import(self, lines, *args):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w') as stream:
+            stream.write('\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines))
+        output = StringIO()
+        call_command('import_posts', path, *args, '--batch-size', '2', stdout=output)
+        return output.getvalue()
+
+    def test_invalid_rows_are_skipped(self):
+        output = self.run_import([
+            {'id': 500, 'author': 'alice', 'title': 'Kept', 'content': 'Old platform', 'created_at': '2024-01-01T10:00:00Z'},
+            {'author': 'alice', 'title': 'Also kept', 'created_at': '2024-01-02T10:00:00'},
+            {'id': 'x1', 'author': 'alice', 'title': 'Bad id'},
+            {'author': 'alice', 'title': 'Bad time', 'created_at': 'yesterday'},
+            {'author': 'alice', 'title': None},
+            {'author': 'alice', 'content': 'No title'},
+            '{"author": "alice", "title": "torn',
+            ['alice', 'a list'],
+            {'author': 'nobody', 'title': 'Unknown author'},
+        ])
+        self.assertIn('2 posts imported', output)
+        self.assertIn('1 unknown author, 0 unknown post, 6 invalid', output)
+        self.assertEqual(set(Post.objects.values_list('title', flat=True)), {'Kept', 'Also kept'})
+
+        output = self.run_import([
+            {'post': 500, 'author': 'reader', 'content': 'Reply'},
+            {'post': 'five hundred', 'author': 'reader', 'content': 'Bad post'},
+            {'post': 999, 'author': 'reader', 'content': 'Unknown post'},
+        ], '--kind', 'comments')
+        self.assertIn('1 comments imported', output)
+        self.assertIn('0 unknown author, 1 unknown post, 1 invalid', output)
+        self.assertEqual(Post.objects.get(pk=500).comment_count, 1)
+
+    def test_imported_posts_reach_the_feed(self):
+        self.run_import([{'author': 'alice', 'title': f'Imported {number}', 'created_at': f'2024-01-0{number}T10:00:00Z'}
+                         for number in range(1, 4)])
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse('feed'))
+        self.assertEqual([post['title'] for post in response.data['results']], ['Imported 3', 'Imported 2', 'Imported 1'])
+        self.assertEqual(TimelineEntry.objects.filter(user=self.author).count(), 3)
+
+
+# Likes buffered by posts.write_behind: journals, flushes and replays
+@override_settings(SECURE_SSL_REDIRECT=False, LIKE_WRITE_BEHIND=True, LIKE_WRITE_BEHIND_MIN_LIKES=0)
+class WriteBehindTests(APITransactionTestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='buffer-pass-123')
+        self.fans = [User.objects.create_user(username=f'fan{number}', password='buffer-pass-123') for number in range(3)]
+        self.post = Post.objects.create(author=self.author, title='Viral', content='Everybody likes it')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # A buffer without its flush thread: the tests flush by hand
+        self.buffer = write_behind.LikeBuffer(self.directory, flush_interval=3600, batch_size=100, max_pending=2,
+                                              fsync=False)
+        write_behind._buffer = self.buffer
+        self.addCleanup(setattr, write_behind, '_buffer', None)
+
+    def open_journal(self):
+        # As LikeBuffer.start does once it has replayed older journals
+        self.buffer.journal = self.buffer._open_journal()
+        self.addCleanup(lambda: os.close(self.buffer.journal))
+
+    def dead_pid(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        return process.pid
+
+    def assertLikes(self, count, notifications=1):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, count)
+        self.assertEqual(Like.objects.filter(post=self.post).count(), count)
+        self.assertEqual(Notification.objects.filter(target=self.post).count(), notifications)
+
+    def test_flush_writes_each_like_once(self):
+        self.open_journal()
+        self.assertTrue(self.buffer.add(self.fans[0].pk, self.post.pk))
+        self.assertTrue(self.buffer.add(self.fans[0].pk, self.post.pk))
+        self.assertTrue(self.buffer.add(self.fans[1].pk, self.post.pk))
+        self.assertFalse(self.buffer.add(self.fans[2].pk, self.post.pk))  # full
+        self.assertEqual(self.buffer.pending_count(self.post.pk), 2)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.buffer.pending_count(self.post.pk), 0)
+        # One collapsed notification per post and flush
+        self.assertLikes(2)
+        self.assertEqual(Notification.objects.get(target=self.post).verb, 'and 1 others liked your post')
+        self.assertEqual(write_behind.write_likes([(self.fans[0].pk, self.post.pk)]), 0)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(self.buffer.journal_path)])
+
+    def test_unlikes_recount_the_collapsed_notification(self):
+        self.buffer.max_pending = 3
+        self.open_journal()
+        for fan in self.fans:
+            self.buffer.add(fan.pk, self.post.pk)
+        # Cancelled before the flush: never counted
+        self.buffer.discard(self.fans[0].pk, self.post.pk)
+        self.assertEqual(self.buffer.flush(), 2)
+        notification = Notification.objects.get(target=self.post)
+        self.assertEqual((notification.actor_id, notification.verb), (self.fans[2].pk, 'and 1 others liked your post'))
+
+        self.client.force_authenticate(self.fans[2])
+        self.assertEqual(self.client.post(reverse('unlike-post', args=[self.post.pk])).status_code, 200)
+        notification = Notification.objects.get(target=self.post)
+        self.assertEqual((notification.actor_id, notification.verb), (self.fans[1].pk, 'liked your post'))
+
+        self.client.force_authenticate(self.fans[1])
+        response = self.client.post(reverse('like-batch'), {'unlike': [self.post.pk]}, format='json')
+        self.assertEqual(response.data['results'], [{'post': self.post.pk, 'status': 'unliked'}])
+        self.assertLikes(0, notifications=0)
+
+    def test_unlike_drops_a_pending_like(self):
+        self.open_journal()
+        self.buffer.add(self.fans[0].pk, self.post.pk)
+        self.assertTrue(self.buffer.discard(self.fans[0].pk, self.post.pk))
+        self.assertFalse(self.buffer.discard(self.fans[0].pk, self.post.pk))
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertLikes(0, notifications=0)
+
+    def test_replay_journals_of_dead_processes(self):
+        Like.objects.create(user=self.fans[2], post=self.post)
+        Post.objects.filter(pk=self.post.pk).update(like_count=1)
+        pid = self.dead_pid()
+        with open(os.path.join(self.directory, f'likes-{pid}.00000001.flushing'), 'w') as journal:
+            journal.write(f'L {self.fans[2].pk} {self.post.pk}\n')
+        with open(os.path.join(self.directory, f'likes-{pid}.journal'), 'w') as journal:
+            journal.write(f'L {self.fans[0].pk} {self.post.pk}\nL {self.fans[1].pk} {self.post.pk}\n'
+                          f'U {self.fans[0].pk} {self.post.pk}\nL {self.fans[0].pk}')
+        # fan0 unliked in the live journal, fan2 was already written, the torn last line is skipped
+        self.assertEqual(write_behind.replay_journals(self.directory), 1)
+        self.assertLikes(2)
+        self.assertEqual(sorted(Like.objects.values_list('user_id', flat=True)), [self.fans[1].pk, self.fans[2].pk])
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(write_behind.replay_journals(self.directory), 0)
+
+    def test_api_sees_pending_likes(self):
+        self.open_journal()
+        self.client.force_authenticate(self.fans[0])
+        self.assertEqual(self.client.post(reverse('like-post', args=[self.post.pk])).status_code, 201)
+        self.assertEqual(self.client.post(reverse('like-post', args=[self.post.pk])).status_code, 400)
+        response = self.client.get(reverse('post-detail', args=[self.post.pk]))
+        self.assertEqual((response.data['like_count'], response.data['has_liked']), (1, True))
+        self.assertFalse(Like.objects.exists())
+
+        response = self.client.post(reverse('like-batch'), {'like': [self.post.pk]}, format='json')
+        self.assertEqual(response.data['results'], [{'post': self.post.pk, 'status': 'already liked'}])
+        response = self.client.post(reverse('like-batch'), {'unlike': [self.post.pk]}, format='json')
+        self.assertEqual(response.data['results'], [{'post': self.post.pk, 'status': 'unliked'}])
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertLikes(0, notifications=0)
+
+
+# Read replicas (social_media_api.routers) with the replica a second SQLite file,
+# copied from the primary before the writes under test, so it lags behind
+@skipUnless(connection.vendor == 'sqlite', 'copies the SQLite database file')
+class ReplicaRoutingTests(APITransactionTestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.writer = User.objects.create_user(username='writer', password='replica-pass-123')
+        self.reader = User.objects.create_user(username='reader', password='replica-pass-123')
+        self.tokens = {user.pk: Token.objects.create(user=user).key for user in (self.writer, self.reader)}
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        replica = os.path.join(directory, 'replica.sqlite3')
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM INTO %s', [replica])
+        connections.settings['replica1'] = dict(connections['default'].settings_dict, NAME=replica)
+        self.addCleanup(connections.settings.pop, 'replica1')
+        # Opened here: the test case only lets aliases listed in `databases` connect on demand
+        connections['replica1'].connect()
+        self.addCleanup(lambda: (connections['replica1'].close(), delattr(connections._connections, 'replica1')))
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': os.path.join(directory, 'cache')}
+        settings = override_settings(DATABASE_REPLICAS=['replica1'], CACHES={'default': shared}, SECURE_SSL_REDIRECT=False)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def get(self, user, url):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[user.pk]}')
+        return self.client.get(url)
+
+    def test_writer_reads_its_writes(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[self.writer.pk]}')
+        post_id = self.client.post(reverse('post-list'), {'title': 'Fresh', 'content': 'Not replicated yet'}).data['id']
+        # The writer is pinned to the primary, everybody else reads the lagging replica
+        self.assertEqual(self.get(self.writer, reverse('post-detail', args=[post_id])).status_code, 200)
+        self.assertEqual(self.get(self.reader, reverse('post-detail', args=[post_id])).status_code, 404)
+        self.assertEqual(self.get(self.reader, reverse('post-list')).data['results'], [])
+        self.assertEqual([post['id'] for post in self.get(self.writer, reverse('post-list')).data['results']], [post_id])
+
+    def test_pins_need_a_shared_cache(self):
+        local = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        with override_settings(CACHES={'default': local}), self.assertRaises(ImproperlyConfigured):
+            ReplicaRoutingMiddleware(lambda request: None)
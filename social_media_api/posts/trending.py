@@ -0,0 +1,108 @@
+"""
+Trending posts ranked by time-decayed engagement.
+
+Every like and comment adds weight * exp(-(now - t) / tau) to its post's
+score, so older activity fades out with a configurable half-life. Scores are
+stored relative to a fixed epoch as weight * exp((t - epoch) / tau): the decay
+factor is the same for every post, so rows that receive no new activity never
+need rewriting and the ranking is a plain read of the score index.
+
+`refresh_trending` only processes likes and comments created since the last
+run (tracked by id watermarks) and is driven by `manage.py refresh_trending`,
+either once (e.g. from cron) or in a loop. Ids are handed out before a
+transaction commits, so a row can become visible after a higher id was
+processed: the last RESCAN_IDS ids behind each watermark are read again, and
+the ids already counted there are remembered so nothing is counted twice.
+"""
+
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Like, Comment, TrendingPost, TrendingState
+
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+# Activity older than this is ignored when it is first seen
+WINDOW = timedelta(days=3)
+# Posts whose decayed score falls below this are dropped from the table
+MIN_SCORE = 0.05
+# Scores are rebased to a newer epoch before exp() can overflow
+REBASE_AFTER = timedelta(days=7)
+CHUNK_SIZE = 5000
+# Ids behind a watermark read again on every run, for rows whose transaction committed late
+RESCAN_IDS = 1000
+
+
+def half_life():
+    return timedelta(hours=getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 6))
+
+
+def tau_seconds():
+    return half_life().total_seconds() / math.log(2)
+
+
+def _events(model, last_id):
+    # (id, post id, created_at) of rows added after the watermark, in bounded chunks
+    while True:
+        rows = list(model.objects.filter(id__gt=last_id).order_by('id')
+                    .values_list('id', 'post_id', 'created_at')[:CHUNK_SIZE])
+        yield from rows
+        if len(rows) < CHUNK_SIZE:
+            return
+        last_id = rows[-1][0]
+
+
+@transaction.atomic
+def refresh_trending(now=None):
+    now = now or timezone.now()
+    tau = tau_seconds()
+    state, _ = TrendingState.objects.select_for_update().get_or_create(pk=1, defaults={'epoch': now})
+
+    if now - state.epoch > REBASE_AFTER:
+        factor = math.exp(-(now - state.epoch).total_seconds() / tau)
+        TrendingPost.objects.update(score=F('score') * factor)
+        state.epoch = now
+
+    deltas = defaultdict(float)
+    since = now - WINDOW
+    for model, weight, watermark, recent in ((Like, LIKE_WEIGHT, 'last_like_id', 'recent_like_ids'),
+                                             (Comment, COMMENT_WEIGHT, 'last_comment_id', 'recent_comment_ids')):
+        last_id = getattr(state, watermark)
+        # None: nothing was recorded behind the watermark yet, so start right after it
+        seen = getattr(state, recent)
+        start = last_id if seen is None else max(0, last_id - RESCAN_IDS)
+        seen = set(seen or ())
+        for event_id, post_id, created_at in _events(model, start):
+            if event_id in seen:
+                continue
+            seen.add(event_id)
+            last_id = max(last_id, event_id)
+            if created_at >= since:
+                deltas[post_id] += weight * math.exp((created_at - state.epoch).total_seconds() / tau)
+        setattr(state, watermark, last_id)
+        setattr(state, recent, sorted(event_id for event_id in seen if event_id > last_id - RESCAN_IDS))
+
+    post_ids = list(deltas)
+    # MySQL's ON DUPLICATE KEY UPDATE names no conflict target and rejects unique_fields
+    features = connections[router.db_for_write(TrendingPost)].features
+    target = {'unique_fields': ['post']} if features.supports_update_conflicts_with_target else {}
+    for start in range(0, len(post_ids), CHUNK_SIZE):
+        chunk = post_ids[start:start + CHUNK_SIZE]
+        current = dict(TrendingPost.objects.filter(post_id__in=chunk).values_list('post_id', 'score'))
+        TrendingPost.objects.bulk_create(
+            [TrendingPost(post_id=post_id, score=current.get(post_id, 0) + deltas[post_id]) for post_id in chunk],
+            update_conflicts=True, update_fields=['score'], **target,
+        )
+
+    # Decayed score below MIN_SCORE <=> stored score below MIN_SCORE * exp((now - epoch) / tau)
+    TrendingPost.objects.filter(score__lt=MIN_SCORE * math.exp((now - state.epoch).total_seconds() / tau)).delete()
+
+    state.refreshed_at = now
+    state.save()
+    return len(post_ids)
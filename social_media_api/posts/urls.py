@@ -1,13 +1,22 @@
 from rest_framework import routers
-from .views import PostViewSet, CommentViewSet, LikePostView, UnlikePostView, FollowView, UnfollowView
+from .views import PostViewSet, CommentViewSet, LikePostView, UnlikePostView, LikeBatchView, FeedView
+from accounts.views import FollowView, UnfollowView
+from django.conf import settings
 from django.urls import path, include
 
+# Native async like/unlike/follow/unfollow under ASGI, the DRF views under WSGI
+if settings.ASYNC_VIEWS:
+    from .async_views import AsyncLikePostView as LikePostView, AsyncUnlikePostView as UnlikePostView
+    from accounts.async_views import AsyncFollowView as FollowView, AsyncUnfollowView as UnfollowView
+
 router = routers.DefaultRouter()
 router.register(r'posts', PostViewSet, basename='post')
 router.register(r'comments', CommentViewSet, basename='comment')
 
 urlpatterns = [
     path("", include(router.urls)),
+    path('feed/', FeedView.as_view(), name='feed'),
+    path('posts/likes/batch/', LikeBatchView.as_view(), name='like-batch'),
     path('posts/<int:pk>/like/', LikePostView.as_view(), name='like-post'),
     path('posts/<int:pk>/unlike/', UnlikePostView.as_view(), name='unlike-post'),
     path('follow/<int:pk>/', FollowView.as_view(), name='follow-user'),
@@ -1,75 +1,295 @@
 from django.shortcuts import render
-from .models import Post, Comment, Like
+from .models import Post, Comment, Like, TrendingPost
 from rest_framework import viewsets, status, generics, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
-from .serializers import PostSerializer, CommentSerializer
-from rest_framework.authentication import TokenAuthentication
+from .serializers import PostSerializer, CommentSerializer, LikeSerializer, LikeBatchSerializer
+from accounts.authentication import CachedTokenAuthentication
 from posts.permissions import IsOwnerOrReadOnly, IsAuthenticatedOrReadOnly
-from .pagination import DefaultPagination
+from .pagination import KeysetPagination, FeedPagination
+from .feed import fan_out_post, invalidate_recent_posts, read_feed
+from .filters import PostSearchFilter, SparseFieldsFilter
+from .mixins import ConditionalGetMixin, CachedResponseMixin
+from . import cache as response_cache
+from . import write_behind
+from .search import MAX_RESULTS as MAX_SEARCH_RESULTS, search as search_posts
+from social_media_api.routers import ReplicaReadMixin
+from social_media_api.sql import insert_from_select, delete_rows
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.utils import timezone
 from notifications.models import Notification
 from rest_framework.permissions import IsAuthenticated
 
 
 # Create your views here.
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(ReplicaReadMixin, CachedResponseMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-    pagination_class = DefaultPagination
+    pagination_class = KeysetPagination
     # Filtering and searching 
-    filter_backends = [SearchFilter, DjangoFilterBackend]
+    filter_backends = [PostSearchFilter, DjangoFilterBackend, SparseFieldsFilter]
+    # ?author= gives a profile timeline (post_author_live_idx)
+    filterset_fields = ['author']
+    # Counters change without touching updated_at, so they are part of the ETag
+    conditional_sum_fields = ('like_count', 'comment_count')
+
+    # The viewer's likes still in the write-behind buffer change has_liked before they reach the table
+    def get_version(self, queryset):
+        version = super().get_version(queryset)
+        if self.request.user.is_authenticated:
+            pending = write_behind.pending_liked_post_ids(self.request.user.pk)
+            if pending:
+                version['pending_likes'] = sorted(pending)
+        return version
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)   
+        post = serializer.save(author=self.request.user)
+        # Fan-out on write: push the new post into every follower's timeline
+        fan_out_post(post)
+
+    def perform_destroy(self, instance):
+        invalidate_recent_posts(instance.author_id)
+        if settings.POST_SOFT_DELETE:
+            # Hidden at once; comments, likes and the rest are purged in the background
+            instance.soft_delete()
+            response_cache.bump_versions([instance.pk])
+        else:
+            instance.delete()
 
-class CommentViewSet(viewsets.ModelViewSet):
-    queryset = Comment.objects.all()
+    # Hit/miss counters of the response cache (per process), for capacity planning
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        return Response(response_cache.stats())
+
+    # Posts ranked by time-decayed likes and comments, read from the score index
+    # (scores are maintained by `manage.py refresh_trending`)
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        limit = self.paginator.get_page_size(request)
+        ranked = TrendingPost.objects.filter(post__deleted_at__isnull=True).select_related('post').order_by('-score')[:limit]
+        serializer = self.get_serializer([entry.post for entry in ranked], many=True)
+        return Response({'results': serializer.data})
+
+    # Who liked a post, newest first (like_post_created_idx)
+    @action(detail=True, methods=['get'])
+    def likes(self, request, pk=None):
+        post = generics.get_object_or_404(Post, pk=pk)
+        page = self.paginator.paginate_queryset(Like.objects.filter(post=post), request, self)
+        serializer = LikeSerializer(page, many=True, context=self.get_serializer_context())
+        return self.paginator.get_paginated_response(serializer.data)
+
+    # Ranked full-text search: /api/posts/search/?q=django "query planner" optim*
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        limit = self.paginator.get_page_size(request)
+        position = self.paginator.get_position(request)
+        ranked = [(score, post_id) for post_id, score in search_posts(request.query_params.get('q', ''), MAX_SEARCH_RESULTS)]
+        if position:
+            ranked = [item for item in ranked if item < position]
+        page = self.paginator.set_page(request, ranked[:limit + 1], limit, lambda item: item)
+        posts = Post.objects.in_bulk([post_id for _, post_id in page])
+        serializer = self.get_serializer([posts[post_id] for _, post_id in page if post_id in posts], many=True)
+        return self.paginator.get_paginated_response(serializer.data)
+
+class CommentViewSet(ReplicaReadMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    # Comments of deleted posts are hidden until they are purged
+    queryset = Comment.objects.filter(post__deleted_at__isnull=True)
     serializer_class = CommentSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-    pagination_class = DefaultPagination
-    
+    pagination_class = KeysetPagination
+    # ?post= gives the thread of one post (comment_post_created_idx)
+    filterset_fields = ['post']
 
+    # Keep Post.comment_count in step with the comments table
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        comment = serializer.save(author=self.request.user)
+        Post.objects.filter(pk=comment.post_id).update(comment_count=F('comment_count') + 1)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        Post.objects.filter(pk=instance.post_id, comment_count__gt=0).update(comment_count=F('comment_count') - 1)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        old_post_id = serializer.instance.post_id
+        comment = serializer.save()
+        if comment.post_id != old_post_id:
+            Post.objects.filter(pk=old_post_id, comment_count__gt=0).update(comment_count=F('comment_count') - 1)
+            Post.objects.filter(pk=comment.post_id).update(comment_count=F('comment_count') + 1)
 
 # Like and Unlike functionality
+# Each is one INSERT ... SELECT that skips an existing like (and hidden posts), or
+# one DELETE; the row count says whether anything changed, and only then do the
+# counter, the notification and the cached responses follow. Shared with the async views.
+LIKE_VERB = write_behind.LIKE_VERB
+
+
+def record_like(user, post_id):
+    now = timezone.now()
+    with transaction.atomic():
+        created = insert_from_select(Like, ['user', 'post', 'created_at'],
+                                     Post.objects.filter(pk=post_id).values_list(Value(user.pk), 'pk', Value(now)),
+                                     ignore_conflicts=True)
+        if created:
+            Post.objects.filter(pk=post_id).update(like_count=F('like_count') + 1)
+            # Notify the post author
+            insert_from_select(Notification, ['recipient', 'actor', 'verb', 'target', 'timestamp'],
+                               Post.objects.filter(pk=post_id).values_list('author_id', Value(user.pk), Value(LIKE_VERB),
+                                                                           'pk', Value(now)))
+            response_cache.bump_versions([post_id])
+    return bool(created)
+
+
+def remove_like(user, post_id):
+    with transaction.atomic():
+        deleted = delete_rows(Like.objects.filter(user=user, post_id=post_id))
+        if deleted:
+            Post.objects.filter(pk=post_id, like_count__gt=0).update(like_count=F('like_count') - 1)
+            # A like without a notification of its own was written by a write-behind flush
+            if not Notification.objects.filter(actor=user, target_id=post_id, verb=LIKE_VERB).delete()[0]:
+                write_behind.recount_collapsed_notifications([post_id])
+            response_cache.bump_versions([post_id])
+    return bool(deleted)
+
+
+# POST like/unlike answer 400 when nothing changes; PUT and DELETE are idempotent and answer 200
+def like(request, pk, unchanged_status):
+    if write_behind.enabled():
+        post = generics.get_object_or_404(Post, pk=pk)
+        if write_behind.should_buffer(post):
+            result = write_behind.buffer_like(request.user.pk, post.pk)
+            if result == 'already liked':
+                return Response({'status': 'you already liked this post'}, status=unchanged_status)
+            if result == 'liked':
+                return Response({'status': 'post liked'}, status=status.HTTP_201_CREATED)
+            # Buffer full: write this like directly
+
+    if record_like(request.user, pk):
+        return Response({'status': 'post liked'}, status=status.HTTP_201_CREATED)
+    generics.get_object_or_404(Post, pk=pk)
+    return Response({'status': 'you already liked this post'}, status=unchanged_status)
+
+
+def unlike(request, pk, unchanged_status):
+    if write_behind.buffer_unlike(request.user.pk, pk) or remove_like(request.user, pk):
+        return Response({'status': 'post unliked'}, status=status.HTTP_200_OK)
+    generics.get_object_or_404(Post, pk=pk)
+    return Response({'status': 'you have not liked this post'}, status=unchanged_status)
+
+
+# POST likes; PUT likes and DELETE unlikes idempotently
 class LikePostView(APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk):
-        post = generics.get_object_or_404(Post, pk=pk)
-        like, created = Like.objects.get_or_create(user=request.user, post=post)
-        
-        if created:
-            # Create notification for post author
-            Notification.objects.create(
-                recipient=post.author,
-                actor=request.user,
-                verb='liked your post',
-                target=post
-            )
-            return Response({'status': 'post liked'}, status=status.HTTP_201_CREATED)
-        else:
-            return Response({'status': 'you already liked this post'}, status=status.HTTP_400_BAD_REQUEST)
+        return like(request, pk, status.HTTP_400_BAD_REQUEST)
+
+    def put(self, request, pk):
+        return like(request, pk, status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        return unlike(request, pk, status.HTTP_200_OK)
 
 
 class UnlikePostView(APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk):
-        post = generics.get_object_or_404(Post, pk=pk)
-        
-        try:
-            like = Like.objects.get(user=request.user, post=post)
-            like.delete()
-            return Response({'status': 'post unliked'}, status=status.HTTP_200_OK)
-        except Like.DoesNotExist:
-            return Response({'status': 'you have not liked this post'}, status=status.HTTP_400_BAD_REQUEST)
-        
+        return unlike(request, pk, status.HTTP_400_BAD_REQUEST)
+
+
+# Batch like/unlike for clients syncing queued offline actions.
+# The whole batch runs in one transaction with a fixed number of queries:
+# one INSERT ... SELECT for likes that skips existing ones, one bulk insert for
+# notifications and one counter update per action.
+# The posts are locked first, as write_behind.write_likes does, so the likes read
+# under the lock are the ones the inserts and counters act on.
+class LikeBatchView(APIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = LikeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        like_ids = list(dict.fromkeys(serializer.validated_data['like']))
+        unlike_ids = list(dict.fromkeys(serializer.validated_data['unlike']))
+
+        # Likes still in the write-behind buffer count as liked; unliking drops them
+        # there. Done before the posts are locked: a discard may wait for a flush,
+        # which needs the same locks.
+        pending = write_behind.pending_liked_post_ids(request.user.pk)
+        discarded = {post_id for post_id in unlike_ids if write_behind.buffer_unlike(request.user.pk, post_id)}
+
+        with transaction.atomic():
+            authors = dict(Post.objects.select_for_update().filter(id__in=like_ids + unlike_ids)
+                           .order_by('id').values_list('id', 'author_id'))
+            liked = set(Like.objects.filter(user=request.user, post_id__in=authors).values_list('post_id', flat=True))
+
+            to_like = [post_id for post_id in like_ids if post_id in authors and post_id not in liked and post_id not in pending]
+            if to_like:
+                # A single like of one of these posts (record_like does not lock the post) may
+                # insert first: the unique constraint skips it, and the rows stamped with this
+                # batch's time tell which likes went in
+                now = timezone.now()
+                inserted = insert_from_select(Like, ['user', 'post', 'created_at'],
+                                              Post.objects.filter(pk__in=to_like).values_list(Value(request.user.pk), 'pk', Value(now)),
+                                              ignore_conflicts=True)
+                if inserted < len(to_like):
+                    created = set(Like.objects.filter(user=request.user, post_id__in=to_like, created_at=now)
+                                  .values_list('post_id', flat=True))
+                    to_like = [post_id for post_id in to_like if post_id in created]
+            if to_like:
+                Post.objects.filter(id__in=to_like).update(like_count=F('like_count') + 1)
+                Notification.objects.bulk_create([
+                    Notification(recipient_id=authors[post_id], actor=request.user, verb=LIKE_VERB, target_id=post_id)
+                    for post_id in to_like
+                ])
+
+            to_unlike = [post_id for post_id in unlike_ids if post_id in liked]
+            if to_unlike:
+                delete_rows(Like.objects.filter(user=request.user, post_id__in=to_unlike))
+                Post.objects.filter(id__in=to_unlike, like_count__gt=0).update(like_count=F('like_count') - 1)
+                notified, _ = Notification.objects.filter(actor=request.user, target_id__in=to_unlike, verb=LIKE_VERB).delete()
+                if notified < len(to_unlike):
+                    write_behind.recount_collapsed_notifications(to_unlike)
+
+            # Neither bulk_create nor delete_rows sends signals, so cached responses are invalidated here
+            response_cache.bump_versions(to_like + to_unlike)
+
+        results = {}
+        for post_id in like_ids:
+            results[post_id] = ('not found' if post_id not in authors else 'liked' if post_id in to_like
+                                else 'already liked')
+        for post_id in unlike_ids:
+            results[post_id] = ('unliked' if post_id in liked or post_id in discarded
+                                else 'not found' if post_id not in authors else 'not liked')
+        return Response({'results': [{'post': post_id, 'status': result} for post_id, result in results.items()]},
+                        status=status.HTTP_200_OK)
+
+
+# Home timeline of the authenticated user: timeline rows pushed on write,
+# merged with recent posts of high-follower authors pulled at read time
+class FeedView(generics.ListAPIView):
+    serializer_class = PostSerializer
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = FeedPagination
+
+    def list(self, request, *args, **kwargs):
+        limit = self.paginator.get_page_size(request)
+        items = read_feed(request.user, limit + 1, before=self.paginator.get_position(request))
+        page = self.paginator.set_page(request, items, limit, lambda item: item[:2])
+        serializer = self.get_serializer([post for _, _, post in page], many=True)
+        return self.paginator.get_paginated_response(serializer.data)
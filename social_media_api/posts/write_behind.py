@@ -0,0 +1,372 @@
+"""
+Write-behind buffer for likes on viral posts.
+
+With LIKE_WRITE_BEHIND enabled, likes on posts that already have at least
+LIKE_WRITE_BEHIND_MIN_LIKES likes are accepted into a bounded in-process
+buffer instead of being written by the request. A background thread flushes
+the buffer every LIKE_WRITE_BEHIND_FLUSH_MS milliseconds, or as soon as
+LIKE_WRITE_BEHIND_BATCH likes are waiting, in one transaction: likes are
+deduplicated by (user, post), and each post gets one INSERT ... SELECT for its
+likes, one counter UPDATE and a single collapsed notification ("and N others
+liked your post"). The likes of a flush carry the notification's timestamp, so
+unliking one of them recounts the notification (recount_collapsed_notifications)
+or deletes it with the last one. When the buffer is full, likes fall back to
+the synchronous path.
+
+Every accepted like (and every unlike of a still pending one) is appended to
+a per-process journal before the request returns. A flush renames the journal
+aside and only deletes it once its transaction has committed; journals left
+behind by dead processes are replayed when a buffer starts. Flushes skip pairs
+that already have a Like row, so replaying a journal that was partly or fully
+written never counts a like twice.
+
+Pending likes are merged into has_liked and like_count by the process that
+accepted them. With several workers a client routed to another worker sees
+its like once the buffer is flushed.
+"""
+
+import atexit
+import logging
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, transaction
+from django.db.models import F, Value
+from django.utils import timezone
+
+from notifications.models import Notification
+from social_media_api.sql import insert_from_select
+from .cache import bump_versions
+from .models import Post, Like
+
+logger = logging.getLogger(__name__)
+
+LIKE_VERB = 'liked your post'
+COLLAPSED_SUFFIX = ' others liked your post'
+COLLAPSED_VERB = 'and {}' + COLLAPSED_SUFFIX
+JOURNAL_RE = re.compile(r'^(?:replay-(?P<replayer>\d+)-)?(?P<name>likes-(?P<pid>\d+)\.(?:\d+\.flushing|journal))$')
+
+
+def enabled():
+    return getattr(settings, 'LIKE_WRITE_BEHIND', False)
+
+
+def like_verb(likes):
+    return LIKE_VERB if likes == 1 else COLLAPSED_VERB.format(likes - 1)
+
+
+def write_likes(pairs):
+    """Insert the (user id, post id) pairs that are not liked yet; returns how many were new."""
+    pairs = set(pairs)
+    if not pairs:
+        return 0
+    now = timezone.now()
+    with transaction.atomic():
+        # Locking the posts serialises concurrent flushes of the same posts, so the
+        # existence check below and the counter increments cannot race
+        authors = dict(Post.objects.select_for_update().filter(id__in={post_id for _, post_id in pairs})
+                       .order_by('id').values_list('id', 'author_id'))
+        existing = set(Like.objects.filter(post_id__in=authors, user_id__in={user_id for user_id, _ in pairs})
+                       .values_list('user_id', 'post_id'))
+        likers = defaultdict(list)
+        for user_id, post_id in sorted(pairs):
+            if post_id in authors and (user_id, post_id) not in existing:
+                likers[post_id].append(user_id)
+
+        written = 0
+        for post_id, users in likers.items():
+            # The likes carry the flush time, which is how the post's notification knows
+            # which likes it stands for. A direct like (record_like does not lock the post)
+            # may have been inserted meanwhile: it is skipped, and the stamped rows tell
+            # which likes went in.
+            inserted = insert_from_select(Like, ['user', 'post', 'created_at'],
+                                          get_user_model().objects.filter(pk__in=users)
+                                          .values_list('pk', Value(post_id), Value(now)),
+                                          ignore_conflicts=True)
+            if inserted < len(users):
+                users = sorted(Like.objects.filter(post_id=post_id, created_at=now).values_list('user_id', flat=True))
+                if not users:
+                    continue
+            Post.objects.filter(id=post_id).update(like_count=F('like_count') + len(users))
+            # One notification per post and flush instead of one per like
+            insert_from_select(Notification, ['recipient', 'actor', 'verb', 'target', 'timestamp'],
+                               Post.objects.filter(pk=post_id).values_list('author_id', Value(users[-1]),
+                                                                           Value(like_verb(len(users))), 'pk', Value(now)))
+            written += len(users)
+        bump_versions(likers)
+    return written
+
+
+def recount_collapsed_notifications(post_ids):
+    """Bring the collapsed like notifications of `post_ids` in line with the likes they stand for, after unlikes."""
+    collapsed = Notification.objects.filter(target_id__in=post_ids, verb__endswith=COLLAPSED_SUFFIX)
+    for notification in collapsed:
+        users = sorted(Like.objects.filter(post_id=notification.target_id, created_at=notification.timestamp)
+                       .values_list('user_id', flat=True))
+        if not users:
+            Notification.objects.filter(pk=notification.pk).delete()
+            continue
+        actor_id = notification.actor_id if notification.actor_id in users else users[-1]
+        Notification.objects.filter(pk=notification.pk).update(actor_id=actor_id, verb=like_verb(len(users)))
+
+
+def read_journal(path):
+    # Fold like/unlike records into the pairs that are still liked
+    liked = {}
+    with open(path, encoding='ascii', errors='replace') as journal:
+        for line in journal:
+            parts = line.split()
+            if len(parts) != 3 or parts[0] not in ('L', 'U') or not (parts[1].isdigit() and parts[2].isdigit()):
+                continue  # torn last line after a crash
+            pair = (int(parts[1]), int(parts[2]))
+            if parts[0] == 'L':
+                liked[pair] = None
+            else:
+                liked.pop(pair, None)
+    return liked
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def replay_journals(directory):
+    """Write the likes left in journals of processes that are gone; returns how many were new."""
+    me = os.getpid()
+    claimed = []
+    for filename in os.listdir(directory):
+        match = JOURNAL_RE.match(filename)
+        if not match:
+            continue
+        owner = int(match['replayer'] or match['pid'])
+        # Our own pid on a file we have not opened yet means an earlier process with the same pid
+        if owner != me and _alive(owner):
+            continue
+        target = os.path.join(directory, f'replay-{me}-{match["name"]}')
+        try:
+            os.rename(os.path.join(directory, filename), target)
+        except FileNotFoundError:
+            continue  # claimed by another process
+        claimed.append((int(match['pid']), match['name'], target))
+
+    # Per process, rotated journals (zero-padded sequence numbers) sort before the live one
+    liked = {}
+    for pid, name, path in sorted(claimed):
+        liked.update(read_journal(path))
+    written = write_likes(liked)
+    for _, _, path in claimed:
+        os.remove(path)
+    if claimed:
+        logger.info('Replayed %d like journal(s): %d of %d likes were new', len(claimed), written, len(liked))
+    return written
+
+
+class LikeBuffer:
+    def __init__(self, directory, flush_interval, batch_size, max_pending, fsync=True):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        # Held for the whole flush; unlikes of in-flight pairs wait on it
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        self.by_user = defaultdict(set)
+        self.by_post = Counter()
+        self.in_flight = set()
+        self.sequence = 0
+        self.stopping = False
+        self.journal_path = os.path.join(directory, f'likes-{os.getpid()}.journal')
+        self.journal = None
+        self.thread = threading.Thread(target=self.run, name='like-write-behind', daemon=True)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        replay_journals(self.directory)
+        self.journal = self._open_journal()
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def _open_journal(self):
+        return os.open(self.journal_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+    def _append(self, lines):
+        os.write(self.journal, ''.join(lines).encode('ascii'))
+        if self.fsync:
+            os.fsync(self.journal)
+
+    def _track(self, pair):
+        self.pending[pair] = None
+        self.by_user[pair[0]].add(pair[1])
+        self.by_post[pair[1]] += 1
+
+    def _untrack(self, pair):
+        del self.pending[pair]
+        self.by_user[pair[0]].discard(pair[1])
+        if not self.by_user[pair[0]]:
+            del self.by_user[pair[0]]
+        self.by_post[pair[1]] -= 1
+        if not self.by_post[pair[1]]:
+            del self.by_post[pair[1]]
+
+    def contains(self, user_id, post_id):
+        with self.lock:
+            return (user_id, post_id) in self.pending or (user_id, post_id) in self.in_flight
+
+    # Returns False when the buffer is full and the like has to be written directly
+    def add(self, user_id, post_id):
+        pair = (user_id, post_id)
+        with self.lock:
+            if pair in self.pending or pair in self.in_flight:
+                return True
+            if len(self.pending) >= self.max_pending:
+                return False
+            self._append([f'L {user_id} {post_id}\n'])
+            self._track(pair)
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.notify()
+        bump_versions([post_id])
+        return True
+
+    # Drops a pending like; returns False when there was none (it may be in the database)
+    def discard(self, user_id, post_id):
+        pair = (user_id, post_id)
+        with self.lock:
+            if pair in self.pending:
+                self._append([f'U {user_id} {post_id}\n'])
+                self._untrack(pair)
+                removed = True
+            else:
+                removed = False
+                in_flight = pair in self.in_flight
+        if removed:
+            bump_versions([post_id])
+            return True
+        if in_flight:
+            # Once the flush ends the like is either in the database or pending again
+            with self.flush_lock:
+                pass
+            return self.discard(user_id, post_id)
+        return False
+
+    def liked_post_ids(self, user_id):
+        with self.lock:
+            return set(self.by_user.get(user_id, ())) | {post_id for uid, post_id in self.in_flight if uid == user_id}
+
+    def pending_count(self, post_id):
+        with self.lock:
+            return self.by_post.get(post_id, 0) + sum(1 for _, pid in self.in_flight if pid == post_id)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return 0
+                batch = list(self.pending)
+                self.in_flight = set(batch)
+                self.pending, self.by_user, self.by_post = {}, defaultdict(set), Counter()
+                # New likes go to a fresh journal while this batch is written
+                self.sequence += 1
+                rotated = os.path.join(self.directory, f'likes-{os.getpid()}.{self.sequence:08d}.flushing')
+                os.close(self.journal)
+                os.rename(self.journal_path, rotated)
+                self.journal = self._open_journal()
+            try:
+                close_old_connections()
+                written = write_likes(batch)
+            except Exception:
+                logger.exception('Flushing %d buffered likes failed, keeping them for the next flush', len(batch))
+                written = 0
+                with self.lock:
+                    retry = [pair for pair in batch if pair not in self.pending]
+                    self._append([f'L {user_id} {post_id}\n' for user_id, post_id in retry])
+                    for pair in retry:
+                        self._track(pair)
+            finally:
+                with self.lock:
+                    self.in_flight = set()
+                close_old_connections()
+            os.remove(rotated)
+            return written
+
+    def run(self):
+        while True:
+            with self.wakeup:
+                self.wakeup.wait_for(lambda: self.stopping or len(self.pending) >= self.batch_size,
+                                     timeout=self.flush_interval)
+                stopping = self.stopping
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Like write-behind flush failed')
+            if stopping:
+                return
+
+    def stop(self):
+        with self.wakeup:
+            self.stopping = True
+            self.wakeup.notify()
+        self.thread.join()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """The process-wide buffer, started on first use; None when write-behind is off."""
+    global _buffer
+    if not enabled():
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                buffer = LikeBuffer(
+                    directory=settings.LIKE_WRITE_BEHIND_JOURNAL_DIR,
+                    flush_interval=settings.LIKE_WRITE_BEHIND_FLUSH_MS / 1000,
+                    batch_size=settings.LIKE_WRITE_BEHIND_BATCH,
+                    max_pending=settings.LIKE_WRITE_BEHIND_MAX_PENDING,
+                    fsync=settings.LIKE_WRITE_BEHIND_FSYNC,
+                )
+                buffer.start()
+                _buffer = buffer
+    return _buffer
+
+
+def should_buffer(post):
+    return enabled() and post.like_count >= settings.LIKE_WRITE_BEHIND_MIN_LIKES
+
+
+# Takes a like on a buffered post: 'liked' or 'already liked', None when the buffer is full
+def buffer_like(user_id, post_id):
+    buffer = get_buffer()
+    if buffer.contains(user_id, post_id) or Like.objects.filter(user_id=user_id, post_id=post_id).exists():
+        return 'already liked'
+    return 'liked' if buffer.add(user_id, post_id) else None
+
+
+# True when the like was still pending and has been dropped
+def buffer_unlike(user_id, post_id):
+    buffer = get_buffer()
+    return buffer is not None and buffer.discard(user_id, post_id)
+
+
+# Helpers for serializers: pending likes of the viewer and per post (empty when write-behind is off)
+def pending_liked_post_ids(user_id):
+    return _buffer.liked_post_ids(user_id) if _buffer is not None else set()
+
+
+def pending_like_count(post_id):
+    return _buffer.pending_count(post_id) if _buffer is not None else 0
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "social_media_api.settings")
+# Serve the async versions of the views that have one (see settings.ASYNC_VIEWS)
+os.environ.setdefault("ASYNC_VIEWS", "True")
 
 application = get_asgi_application()
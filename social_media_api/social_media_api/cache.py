@@ -0,0 +1,12 @@
+"""
+Helpers for the aliases in settings.CACHES.
+"""
+
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+# Local memory lives in one process and the dummy cache keeps nothing, so state
+# that every worker must see (pins, invalidation versions) cannot be kept there
+def is_shared(cache):
+    return not isinstance(cache, (LocMemCache, DummyCache))
@@ -0,0 +1,148 @@
+"""
+Read-replica routing.
+
+Replicas are configured with DB_REPLICAS (see settings.py). Reads go to a
+random replica only while a view that opted in with ReplicaReadMixin handles
+a GET/HEAD/OPTIONS request; every other query goes to the primary. A request
+is pinned to the primary as soon as it writes, and a client that wrote is
+kept on the primary for DB_REPLICA_PIN_SECONDS afterwards, so it reads its
+own writes even when a replica lags behind. The client is identified by its
+Authorization header or session cookie.
+
+Pins live in the DB_REPLICA_PIN_CACHE cache, which every process must share:
+the next request of a client may reach any worker. With replicas configured,
+ReplicaRoutingMiddleware refuses to start on a per-process (local memory) or
+dummy cache.
+
+Locally, point DB_REPLICAS at a copy of the SQLite database file and keep the
+cache in files:
+
+    cp db.sqlite3 replica.sqlite3
+    DB_ENGINE=django.db.backends.sqlite3 DB_NAME=db.sqlite3 DB_REPLICAS=replica.sqlite3 \
+    CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache CACHE_LOCATION=/tmp/social_media_api_cache \
+    python manage.py runserver
+"""
+
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.permissions import SAFE_METHODS
+
+from .cache import is_shared
+
+PRIMARY = 'default'
+PIN_KEY_PREFIX = 'db:pin'
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        self.replica_reads = False
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = ContextVar('db_routing_state', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+# Called by views whose reads may be served by a replica
+def allow_replica_reads():
+    state = _state.get()
+    if state is not None:
+        state.replica_reads = True
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica_reads or state.pinned or not replicas():
+            return PRIMARY
+        return random.choice(replicas())
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+def pin_cache():
+    return caches[settings.DB_REPLICA_PIN_CACHE]
+
+
+def pin_key(request):
+    credentials = request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return f'{PIN_KEY_PREFIX}:{hashlib.sha1(credentials.encode()).hexdigest()}'
+
+
+# Sets up the routing state of each request and remembers clients that wrote
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if replicas() and not is_shared(pin_cache()):
+            raise ImproperlyConfigured(
+                f'DB_REPLICA_PIN_CACHE ({settings.DB_REPLICA_PIN_CACHE!r}) must be a cache shared by every process '
+                'when DB_REPLICAS is set, otherwise a client that wrote may read a lagging replica')
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not replicas():
+            return self.get_response(request)
+        key = pin_key(request)
+        pinned = request.method not in SAFE_METHODS or (key is not None and pin_cache().get(key) is not None)
+        state = RoutingState(pinned)
+        token = _state.set(state)
+        try:
+            return self.get_response(request)
+        finally:
+            _state.reset(token)
+            if state.wrote and key is not None:
+                pin_cache().set(key, 1, settings.DB_REPLICA_PIN_SECONDS)
+
+    async def __acall__(self, request):
+        if not replicas():
+            return await self.get_response(request)
+        key = pin_key(request)
+        pinned = request.method not in SAFE_METHODS or (key is not None and await pin_cache().aget(key) is not None)
+        state = RoutingState(pinned)
+        token = _state.set(state)
+        try:
+            return await self.get_response(request)
+        finally:
+            _state.reset(token)
+            if state.wrote and key is not None:
+                await pin_cache().aset(key, 1, settings.DB_REPLICA_PIN_SECONDS)
+
+
+# Lets the safe-method reads of a DRF view go to a replica (authentication has
+# already read the token from the primary by the time this runs)
+class ReplicaReadMixin:
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            allow_replica_reads()
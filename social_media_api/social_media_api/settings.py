@@ -26,7 +26,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = config("SECRET_KEY", default="django-insecure-please-change-me")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = False
+DEBUG = config("DEBUG", default=False, cast=bool)
 
 ALLOWED_HOSTS = config(
     'ALLOWED_HOSTS',
@@ -59,7 +59,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "social_media_api.routers.ReplicaRoutingMiddleware",
+    "social_media_api.middleware.AsyncWhiteNoiseMiddleware",
 ]
 
 ROOT_URLCONF = "social_media_api.urls"
@@ -93,15 +94,49 @@ DATABASES = {
         "PASSWORD": os.getenv("DB_PASSWORD", "Ilov3maimom@098"),
         "HOST": os.getenv("DB_HOST", "localhost"),
         "PORT": os.getenv("DB_PORT", "3306"),
-        "OPTIONS": {
-            "init_command": "SET sql_mode='STRICT_TRANS_TABLES'",
-            "charset": "utf8mb4",
-            "use_unicode": True,
-            "collation": "utf8mb4_general_ci",
-        },
     }
 }
 
+# MySQL specific connection options (not understood by other backends such as SQLite)
+if DATABASES["default"]["ENGINE"] == "django.db.backends.mysql":
+    DATABASES["default"]["OPTIONS"] = {
+        "init_command": "SET sql_mode='STRICT_TRANS_TABLES'",
+        "charset": "utf8mb4",
+        "use_unicode": True,
+        "collation": "utf8mb4_general_ci",
+    }
+
+# Read replicas: comma-separated hosts (database files for SQLite) holding a copy
+# of the primary, added as replica1, replica2, ... (see social_media_api/routers.py)
+DATABASE_REPLICAS = []
+for number, location in enumerate([item.strip() for item in os.getenv("DB_REPLICAS", "").split(",") if item.strip()], start=1):
+    replica = dict(DATABASES["default"], TEST={"MIRROR": "default"})
+    replica["NAME" if "sqlite3" in replica["ENGINE"] else "HOST"] = location
+    DATABASES[f"replica{number}"] = replica
+    DATABASE_REPLICAS.append(f"replica{number}")
+
+DATABASE_ROUTERS = ["social_media_api.routers.ReplicaRouter"]
+# Seconds a client stays on the primary after writing (should exceed the replication lag)
+DB_REPLICA_PIN_SECONDS = config("DB_REPLICA_PIN_SECONDS", default=5, cast=int)
+# Cache holding those pins; with replicas it must be shared by every process (not local memory)
+DB_REPLICA_PIN_CACHE = config("DB_REPLICA_PIN_CACHE", default="default")
+
+
+
+# Cache (used by the post response cache and the feed)
+# Local memory by default; set CACHE_BACKEND to e.g.
+# django.core.cache.backends.filebased.FileBasedCache with CACHE_LOCATION=/var/tmp/social_media_api_cache
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="social-media-api"),
+    }
+}
+# Cache holding rendered post responses and their versions (see posts/cache.py);
+# responses are only cached when it is shared by every process ("" turns it off)
+POST_RESPONSE_CACHE = config("POST_RESPONSE_CACHE", default="default")
+# Cache holding the recent posts of pulled feed authors (see posts/feed.py)
+FEED_CACHE = config("FEED_CACHE", default="default")
 
 
 # Password validation
@@ -162,15 +197,16 @@ AUTH_USER_MODEL = "accounts.CustomUser"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "accounts.authentication.CachedTokenAuthentication",
     ],
     
-    "DEFAULT_PAGINATION_CLASS": "posts.pagination.DefaultPagination",
+    "DEFAULT_PAGINATION_CLASS": "posts.pagination.KeysetPagination",
 
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
         "rest_framework.filters.SearchFilter",
         "rest_framework.filters.OrderingFilter",
+        "posts.filters.SparseFieldsFilter",
     ],
 }
 
@@ -185,3 +221,36 @@ if not DEBUG:
     SECURE_CONTENT_TYPE_NOSNIFF = True
     X_FRAME_OPTIONS = 'DENY'
     SECURE_BROWSER_XSS_FILTER = True
+
+# Home feed: authors with at least this many followers are merged into feeds at
+# read time instead of being fanned out to every follower (0 pushes every post)
+FEED_FANOUT_THRESHOLD = config("FEED_FANOUT_THRESHOLD", default=10000, cast=int)
+
+# Trending posts: half-life of like/comment activity in the trending score
+TRENDING_HALF_LIFE_HOURS = config("TRENDING_HALF_LIFE_HOURS", default=6, cast=float)
+
+# Likes on posts with at least LIKE_WRITE_BEHIND_MIN_LIKES likes are buffered in
+# process and written in batches (see posts.write_behind)
+LIKE_WRITE_BEHIND = config("LIKE_WRITE_BEHIND", default=False, cast=bool)
+LIKE_WRITE_BEHIND_MIN_LIKES = config("LIKE_WRITE_BEHIND_MIN_LIKES", default=1000, cast=int)
+LIKE_WRITE_BEHIND_FLUSH_MS = config("LIKE_WRITE_BEHIND_FLUSH_MS", default=200, cast=int)
+LIKE_WRITE_BEHIND_BATCH = config("LIKE_WRITE_BEHIND_BATCH", default=500, cast=int)
+LIKE_WRITE_BEHIND_MAX_PENDING = config("LIKE_WRITE_BEHIND_MAX_PENDING", default=10000, cast=int)
+LIKE_WRITE_BEHIND_FSYNC = config("LIKE_WRITE_BEHIND_FSYNC", default=True, cast=bool)
+LIKE_WRITE_BEHIND_JOURNAL_DIR = config("LIKE_WRITE_BEHIND_JOURNAL_DIR", default=str(BASE_DIR / "var" / "like_journal"))
+
+# Route like/unlike/follow/unfollow to their native async views. asgi.py turns
+# this on; WSGI deployments keep the DRF views
+ASYNC_VIEWS = config("ASYNC_VIEWS", default=False, cast=bool)
+
+# Deleting a post only hides it; run `manage.py purge_deleted_posts` to remove
+# it and its comments, likes and notifications in batches (False deletes inline)
+POST_SOFT_DELETE = config("POST_SOFT_DELETE", default=True, cast=bool)
+
+# Token authentication keeps up to AUTH_TOKEN_CACHE_SIZE token lookups per process
+# (0 turns it off) for AUTH_TOKEN_CACHE_TTL seconds. AUTH_TOKEN_CACHE_ALIAS must be
+# shared by every process for token deletion and user deactivation to reach all of
+# them at once; on local memory entries live at most 5 seconds (see accounts/authentication.py)
+AUTH_TOKEN_CACHE_SIZE = config("AUTH_TOKEN_CACHE_SIZE", default=10000, cast=int)
+AUTH_TOKEN_CACHE_TTL = config("AUTH_TOKEN_CACHE_TTL", default=60, cast=int)
+AUTH_TOKEN_CACHE_ALIAS = config("AUTH_TOKEN_CACHE_ALIAS", default="default")
@@ -0,0 +1,35 @@
+"""
+Single-statement writes the ORM has no API for.
+
+`insert_from_select` runs INSERT ... SELECT with the SELECT built from a
+queryset, optionally skipping rows that would break a unique constraint, and
+`delete_rows` runs one DELETE for a queryset. Both return the number of rows
+affected, so callers can tell whether anything changed without reading first.
+Neither sends model signals: callers do that bookkeeping themselves.
+"""
+
+from django.db import connections, router
+from django.db.models.constants import OnConflict
+
+
+def insert_from_select(model, fields, queryset, ignore_conflicts=False):
+    """INSERT INTO model (fields) SELECT ...; `queryset` must select one value per field, in order."""
+    using = router.db_for_write(model)
+    connection = connections[using]
+    ops = connection.ops
+    opts = model._meta
+    on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+    select, params = queryset.query.get_compiler(using).as_sql()
+    columns = ', '.join(ops.quote_name(opts.get_field(name).column) for name in fields)
+    sql = f'{ops.insert_statement(on_conflict=on_conflict)} {ops.quote_name(opts.db_table)} ({columns}) {select}'
+    suffix = ops.on_conflict_suffix_sql([], on_conflict, [], [])
+    if suffix:
+        sql = f'{sql} {suffix}'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def delete_rows(queryset):
+    """DELETE the rows of a queryset without collecting them first; returns how many went."""
+    return queryset._raw_delete(router.db_for_write(queryset.model))
@@ -0,0 +1,161 @@
+"""
+Shared helpers for the query budget tests of the posts, accounts and
+notifications apps.
+
+`seed_social_graph` builds a small but realistic data set: a follow graph,
+posts fanned out to timelines and indexed for search, comments, likes and
+notifications. `QueryBudgetTestCase` asserts how many SQL queries a request
+may run and, for paginated endpoints, that the count does not grow with the
+page size. Failures list every query that ran.
+
+`QueryPlanMixin` runs EXPLAIN on the queries behind the hot list endpoints and
+fails when one of them sorts in memory or scans a whole table.
+"""
+
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver
+from rest_framework.authtoken.models import Token
+
+from accounts.authentication import token_cache
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from notifications.models import Notification
+from posts.feed import fan_out_post
+from posts.models import Post, Comment, Like
+from posts.pagination import KeysetPagination
+
+USERS = 24
+POSTS_PER_USER = 4
+COMMENTS_PER_POST = 3
+PASSWORD = 'budget-pass-123'
+
+
+def seed_social_graph():
+    User = get_user_model()
+    users = [User.objects.create_user(username=f'user{number}', email=f'user{number}@example.com', password=PASSWORD)
+             for number in range(USERS)]
+    viewer = users[0]
+    for user in users:
+        Token.objects.create(user=user)
+    # The viewer follows half of the users, and everybody else follows the viewer
+    viewer.following.add(*users[1:USERS // 2])
+    for user in users[1:]:
+        user.following.add(viewer)
+
+    posts = []
+    for user in users:
+        for number in range(POSTS_PER_USER):
+            post = Post.objects.create(author=user, title=f'Post {number} by {user.username}',
+                                       content=f'Query budgets keep the {user.username} feed fast, post {number}.')
+            fan_out_post(post)
+            posts.append(post)
+
+    Comment.objects.bulk_create([Comment(post=post, author=users[(post.pk + number) % USERS], content=f'Comment {number}')
+                                 for post in posts for number in range(COMMENTS_PER_POST)])
+    Post.objects.update(comment_count=COMMENTS_PER_POST)
+    likes = [Like(user=user, post=post) for post in posts[::2] for user in users[:5]]
+    Like.objects.bulk_create(likes)
+    # Each like notifies the post author, as record_like does
+    Notification.objects.bulk_create([Notification(recipient=like.post.author, actor=like.user, verb='liked your post',
+                                                   target=like.post) for like in likes])
+    for post in posts[::2]:
+        Post.objects.filter(pk=post.pk).update(like_count=5)
+    Notification.objects.bulk_create([Notification(recipient=viewer, actor=users[number % USERS or 1], verb='liked your post',
+                                                   target=posts[number]) for number in range(40)])
+    return {'users': users, 'viewer': viewer, 'posts': posts}
+
+
+def route_names(urlpatterns):
+    """Names of every route in a urlconf, including included and router patterns."""
+    names = set()
+    for pattern in urlpatterns:
+        if isinstance(pattern, URLResolver):
+            names |= route_names(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+# Test clients speak plain HTTP, which SECURE_SSL_REDIRECT (on whenever DEBUG is off) answers with 301
+@override_settings(SECURE_SSL_REDIRECT=False)
+class QueryBudgetTestCase(APITestCase):
+    small_page = 2
+    large_page = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        data = seed_social_graph()
+        cls.users, cls.viewer, cls.posts = data['users'], data['viewer'], data['posts']
+
+    def setUp(self):
+        # Every request is measured cold, not served from the response or token cache
+        cache.clear()
+        token_cache.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.viewer.auth_token.key}')
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data, format='json')
+            if response.streaming:
+                # Streamed bodies run their queries while they are consumed
+                response.streamed_content = b''.join(response.streaming_content)
+        return response, queries
+
+    def report(self, label, queries):
+        lines = [f'{number}. {query["sql"]}' for number, query in enumerate(queries.captured_queries, start=1)]
+        return f'{label}: {len(queries)} queries\n' + '\n'.join(lines)
+
+    def assertQueryBudget(self, budget, method, path, data=None, status=None):
+        response, queries = self.request(method, path, data)
+        if status is not None:
+            self.assertEqual(response.status_code, status, getattr(response, 'data', None))
+        if len(queries) > budget:
+            self.fail(self.report(f'{method.upper()} {path} is over its budget of {budget}', queries))
+        return response
+
+    # The same budget for a small and a large page, and the large page really is larger
+    def assertListBudget(self, budget, path):
+        separator = '&' if '?' in path else '?'
+        runs = []
+        for size in (self.small_page, self.large_page):
+            cache.clear()
+            token_cache.clear()
+            response, queries = self.request('get', f'{path}{separator}page_size={size}')
+            self.assertEqual(response.status_code, 200, response.content)
+            runs.append((size, len(response.data['results']), queries))
+        (_, small_rows, small), (_, large_rows, large) = runs
+        self.assertGreater(large_rows, small_rows, f'not enough seed data to fill a page of {self.large_page} on {path}')
+        if len(small) != len(large) or len(large) > budget:
+            self.fail(f'GET {path} must run at most {budget} queries whatever the page size\n'
+                      + self.report(f'page_size={self.small_page}', small) + '\n'
+                      + self.report(f'page_size={self.large_page}', large))
+
+
+# Plan lines that mean an in-memory sort or a full table scan, per database vendor
+BAD_PLAN_PATTERNS = {
+    'sqlite': [r'USE TEMP B-TREE FOR (ORDER BY|RIGHT PART OF ORDER BY)', r'\bSCAN \w+$'],
+    'mysql': [r'Using filesort', r'\bALL\b'],
+    'postgresql': [r'\bSort\b', r'Seq Scan'],
+}
+
+
+class QueryPlanMixin:
+
+    # The page query a list endpoint runs: filtered, keyset ordered and sliced by the paginator
+    def page_query(self, queryset, query=''):
+        request = Request(APIRequestFactory().get(f'/?{query}'))
+        return KeysetPagination().get_window(queryset, request)
+
+    def assertIndexedPlan(self, queryset):
+        plan = queryset.explain()
+        patterns = BAD_PLAN_PATTERNS.get(connection.vendor, [])
+        bad = [line for line in plan.splitlines() if any(re.search(pattern, line.strip()) for pattern in patterns)]
+        if bad:
+            self.fail(f'Query sorts in memory or scans a whole table:\n{queryset.query}\n\nPlan:\n{plan}')
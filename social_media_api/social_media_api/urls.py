@@ -22,4 +22,5 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("accounts.urls")), # Include accounts app URLs
     path("api/", include("posts.urls")), # Include posts app URLs
+    path("api/", include("notifications.urls")), # Include notifications app URLs
 ]